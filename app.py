@@ -3,6 +3,7 @@ TazaQala - Гражданская экоплатформа
 Главный файл запуска приложения
 """
 
+import click
 from app import create_app, db
 from app.models import User, Report, Badge, Notification, Reward
 
@@ -57,6 +58,87 @@ def create_admin():
     
     print(f"✅ Администратор {username} создан успешно!")
 
+@app.cli.command()
+def rebuild_clusters():
+    """Пересчет кластеров карты с нуля"""
+    from app.clusters import rebuild_clusters as rebuild
+    
+    cells = rebuild()
+    print(f"✅ Кластеры карты пересчитаны: {cells} ячеек")
+
+@app.cli.command()
+def reconcile_counters():
+    """Пересборка счетчиков репортов (report_counters) с нуля"""
+    from app.counters import rebuild_counters
+    
+    rows = rebuild_counters()
+    print(f"✅ Счетчики репортов пересчитаны: {rows} строк")
+
+@app.cli.command()
+@click.option('--concurrency', default=2, show_default=True, help='Одновременных задач модерации')
+@click.option('--once', is_flag=True, help='Выйти, когда очередь опустеет')
+def moderation_worker(concurrency, once):
+    """Воркер очереди AI-модерации"""
+    from app.moderation_queue import ModerationWorker
+    
+    worker = ModerationWorker(app, concurrency)
+    print(f"🤖 Воркер модерации {worker.worker_id} запущен (потоков: {concurrency})")
+    try:
+        worker.run(once=once)
+    except KeyboardInterrupt:
+        worker.stop()
+    print("✅ Воркер модерации остановлен")
+
+@app.cli.command()
+@click.option('--backend', type=click.Choice(['openai', 'local', 'fake']), default=None,
+              help='Модератор (по умолчанию MODERATION_BACKEND)')
+@click.option('--batch-size', default=200, show_default=True, help='Репортов в пачке (одна транзакция)')
+@click.option('--workers', default=None, type=int, help='Параллельных анализов (по умолчанию — ядер CPU)')
+@click.option('--restart', is_flag=True, help='Начать сначала, не продолжая сохраненный прогон')
+def remoderate(backend, batch_size, workers, restart):
+    """Повторная AI-модерация всех репортов (продолжается после прерывания)"""
+    from app.remoderation import remoderate as run
+    
+    backend = backend or app.config.get('MODERATION_BACKEND', 'openai')
+    result = run(backend, batch_size=batch_size, workers=workers, restart=restart)
+    print(f"✅ Перемодерировано репортов: {result['processed']}, пропущено: {result['skipped']}, "
+          f"к повтору: {len(result['retry'])} ({result['seconds']} с, {result['rate']} фото/с)")
+
+@app.cli.command()
+def index_photos():
+    """Перцептивные хеши и индекс дубликатов для уже загруженных фото"""
+    from app.photo_index import backfill
+    
+    indexed = backfill()
+    print(f"✅ Проиндексировано фото: {indexed}")
+
+@app.cli.command()
+def recompute_points():
+    """Пересчет баллов, балансов и уровней пользователей по журналу баллов"""
+    from app.points_ledger import recompute_balances
+    
+    users = recompute_balances()
+    print(f"✅ Баллы пересчитаны по журналу: {users} пользователей")
+
+@app.cli.command()
+def backfill_rollups():
+    """Заполнение почасовых и посуточных роллапов статистики с нуля"""
+    from app.rollups import rebuild_rollups
+    
+    rows = rebuild_rollups()
+    print(f"✅ Роллапы статистики пересчитаны: {rows} строк")
+
+@app.cli.command()
+@click.option('--min-zoom', default=10, show_default=True, help='Минимальный зум')
+@click.option('--max-zoom', default=14, show_default=True, help='Максимальный зум')
+def warm_tiles(min_zoom, max_zoom):
+    """Пререндер GeoJSON-тайлов карты города"""
+    from app.tiles import TILE_ZOOMS, warm_up
+    
+    zooms = [z for z in range(min_zoom, max_zoom + 1) if z in TILE_ZOOMS]
+    rendered = warm_up(zooms)
+    print(f"✅ Подготовлено тайлов: {rendered} (зумы {zooms[0] if zooms else '-'}–{zooms[-1] if zooms else '-'})")
+
 @app.cli.command()
 def seed_data():
     """Добавление тестовых данных"""
@@ -74,17 +156,14 @@ def seed_data():
         print("👥 Создаю тестовых пользователей...")
         users = []
         for i in range(10):
-            total_points = random.randint(0, 500)
             user = User(
                 username=f'user{i+1}',
                 email=f'user{i+1}@example.com',
                 full_name=f'Пользователь {i+1}',
-                total_points=total_points,
                 reports_count=random.randint(0, 50)
             )
             user.set_password('password123')
-            user._update_level()
-            user.points_balance = user.total_points
+            user.add_points(random.randint(0, 500), 'seed')
             users.append(user)
             db.session.add(user)
         
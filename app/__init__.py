@@ -36,6 +36,10 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     migrate.init_app(app, db)
     
+    # Общий кеш воркеров (SQLite в instance/)
+    from app.shared_cache import shared_cache
+    shared_cache.init_app(app)
+    
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Пожалуйста, войдите для доступа к этой странице.'
     
@@ -54,14 +58,30 @@ def create_app(config_class=Config):
     from app.routes import cleaner
     app.register_blueprint(cleaner.bp)
     
+    # Обработчики изменений репортов (инкрементальные агрегаты)
+    from app import clusters, tiles, counters, rollups, response_cache  # noqa: F401
+    
+    # Фоновая AI-модерация: пул стартует в каждом воркере при первом запросе
+    from app import moderation_queue
+    
+    @app.before_request
+    def start_moderation_queue():
+        moderation_queue.ensure_in_process_worker(app)
+    
     # Create database tables and initial admin
     with app.app_context():
         db.create_all()
 
         # Apply lightweight schema patch for legacy databases without migrations
         _ensure_points_columns()
+        _ensure_user_indexes()
         _ensure_report_category_column()
         _ensure_deleted_at_column()
+        _ensure_grid_cell_column()
+        _ensure_photo_hash_column()
+        _ensure_report_indexes()
+        _ensure_aggregates_built()
+        _ensure_points_ledger()
         
         # Create default admin user if not exists
         from app.models import User
@@ -117,6 +137,21 @@ def create_app(config_class=Config):
     
     return app
 
+def _ensure_points_ledger():
+    """Входящие остатки в points_ledger для баллов, набранных до появления журнала"""
+    from app.models import PointsEntry
+    from app.points_ledger import seed_opening_balances
+    
+    if PointsEntry.query.first() is not None:
+        return
+    try:
+        seeded = seed_opening_balances()
+        if seeded:
+            print(f"ℹ️ Журнал баллов: записаны входящие остатки для {seeded} пользователей")
+    except Exception as exc:
+        db.session.rollback()
+        print(f"⚠️ Не удалось заполнить журнал баллов: {exc}")
+
 def _ensure_points_columns():
     """Добавляет новые колонки баллов, если база была создана раньше"""
     inspector = inspect(db.engine)
@@ -151,6 +186,19 @@ def _ensure_points_columns():
             db.session.rollback()
             print(f"⚠️ Не удалось обновить значения баллов: {exc}")
 
+def _ensure_user_indexes():
+    """Создает индексы users, появившиеся после создания базы"""
+    inspector = inspect(db.engine)
+    if 'users' not in inspector.get_table_names():
+        return
+    
+    try:
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_users_total_points ON users (total_points)'))
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        print(f"⚠️ Не удалось создать индексы users: {exc}")
+
 def _ensure_report_category_column():
     """Добавляет колонку report_category, если база была создана раньше"""
     inspector = inspect(db.engine)
@@ -189,3 +237,88 @@ def _ensure_deleted_at_column():
 
 from app import models
 
+
+def _ensure_photo_hash_column():
+    """Добавляет колонку photo_hash (перцептивный хеш фото); заполняется `flask index-photos`"""
+    inspector = inspect(db.engine)
+    if 'reports' not in inspector.get_table_names():
+        return
+    
+    columns = {col['name'] for col in inspector.get_columns('reports')}
+    
+    if 'photo_hash' not in columns:
+        try:
+            db.session.execute(text('ALTER TABLE reports ADD COLUMN photo_hash VARCHAR(16)'))
+            db.session.commit()
+            print("ℹ️ Добавлена колонка reports.photo_hash (заполните: flask index-photos)")
+        except Exception as exc:
+            db.session.rollback()
+            print(f"⚠️ Не удалось добавить photo_hash: {exc}")
+
+def _ensure_grid_cell_column():
+    """Добавляет индексированную колонку grid_cell и заполняет её для старых репортов"""
+    from app.geo import quadkey_for
+    inspector = inspect(db.engine)
+    if 'reports' not in inspector.get_table_names():
+        return
+    
+    columns = {col['name'] for col in inspector.get_columns('reports')}
+    
+    try:
+        if 'grid_cell' not in columns:
+            db.session.execute(text('ALTER TABLE reports ADD COLUMN grid_cell VARCHAR(32)'))
+            print("ℹ️ Добавлена колонка reports.grid_cell")
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_reports_grid_cell ON reports (grid_cell)'))
+        
+        rows = db.session.execute(text(
+            'SELECT id, latitude, longitude FROM reports WHERE grid_cell IS NULL'
+        )).fetchall()
+        if rows:
+            db.session.execute(
+                text('UPDATE reports SET grid_cell = :cell WHERE id = :id'),
+                [{'cell': quadkey_for(row.latitude, row.longitude), 'id': row.id} for row in rows]
+            )
+        db.session.commit()
+        if rows:
+            print(f"ℹ️ Заполнено grid_cell для {len(rows)} репортов")
+    except Exception as exc:
+        db.session.rollback()
+        print(f"⚠️ Не удалось добавить grid_cell: {exc}")
+
+def _ensure_report_indexes():
+    """Создает индексы reports, появившиеся после создания базы"""
+    inspector = inspect(db.engine)
+    if 'reports' not in inspector.get_table_names():
+        return
+    
+    try:
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_reports_created_at_id ON reports (created_at, id)'))
+        db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_reports_updated_at_id ON reports (updated_at, id)'))
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        print(f"⚠️ Не удалось создать индексы reports: {exc}")
+
+def _ensure_aggregates_built():
+    """Первичное построение агрегатов (кластеры, счетчики, роллапы) для баз, созданных до их появления"""
+    from app.clusters import rebuild_clusters
+    from app.counters import rebuild_counters
+    from app.rollups import rebuild_rollups
+    from app.models import Report, ReportCluster, ReportCounter, ReportRollup
+    
+    if Report.query.first() is None:
+        return
+    
+    aggregates = [
+        (ReportCluster, rebuild_clusters, 'кластеры карты'),
+        (ReportCounter, rebuild_counters, 'счетчики репортов'),
+        (ReportRollup, rebuild_rollups, 'роллапы статистики'),
+    ]
+    for model, rebuild, title in aggregates:
+        try:
+            if model.query.first() is None:
+                rows = rebuild()
+                print(f"ℹ️ Построены {title}: {rows} строк")
+        except Exception as exc:
+            db.session.rollback()
+            print(f"⚠️ Не удалось построить {title}: {exc}")
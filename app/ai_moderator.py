@@ -3,6 +3,18 @@ import numpy as np
 from PIL import Image
 import json
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, has_app_context
+from app.image_io import ImageTooLarge, decode_bgr, limits
+
+# Длинная сторона рабочей копии для цветовых признаков, если нет MODERATION_WORK_EDGE
+WORK_EDGE = 1024
+
+FEATURE_NAMES = (
+    'laplacian_var', 'brightness', 'colorful_ratio', 'saturated_ratio',
+    'bright_ratio', 'organic_ratio', 'brown_ratio',
+)
 
 class AIModeratorService:
     """
@@ -13,6 +25,10 @@ class AIModeratorService:
     
     def __init__(self):
         self.min_confidence = 0.0
+        self.model = 'opencv-mvp'
+        self.prompt_version = 'mvp_v1.0'
+        self.work_edge = None  # None — MODERATION_WORK_EDGE из настроек приложения
+        self.image_limits = None  # None — лимиты IMAGE_* из настроек приложения
         self.auto_approve_threshold = 0.85
         self.reject_threshold = 0.50
     
@@ -30,22 +46,22 @@ class AIModeratorService:
             }
         """
         try:
-            # Загружаем изображение
-            image = cv2.imread(image_path)
+            # Загружаем изображение (JPEG — сразу уменьшенным, в пределах IMAGE_DECODE_PIXELS)
+            image, decode = decode_bgr(image_path, self.image_limits)
             if image is None:
                 return self._create_response(0.0, 'rejected', 'Невозможно прочитать изображение')
             
+            # Все признаки считаются за один проход по уменьшенной копии
+            features = self.extract_features(image)
+            
             # Проверка качества изображения
-            quality_score = self._check_image_quality(image)
+            quality_score = self._check_image_quality(features)
             
             # Проверка на наличие мусора (упрощенная логика для MVP)
-            trash_score = self._detect_trash(image)
-            
-            # Проверка на дубликаты (хеш изображения)
-            image_hash = self._calculate_image_hash(image)
+            trash_score = self._detect_trash(features)
             
             # Определение типа мусора
-            trash_type = self._classify_trash_type(image)
+            trash_type = self._classify_trash_type(features)
             
             # Итоговая оценка достоверности
             confidence = self._calculate_final_confidence(quality_score, trash_score)
@@ -61,9 +77,10 @@ class AIModeratorService:
             analysis = {
                 'quality_score': round(quality_score, 2),
                 'trash_score': round(trash_score, 2),
-                'image_hash': image_hash,
+                'image_hash': features['image_hash'],
                 'trash_type': trash_type,
                 'image_size': image.shape,
+                'decode': decode,
                 'model_version': 'mvp_v1.0'
             }
             
@@ -75,53 +92,121 @@ class AIModeratorService:
                 'trash_type': trash_type
             }
             
+        except ImageTooLarge as e:
+            # Фото не декодировалось — решение за модератором
+            return self._create_response(0.0, 'needs_review', str(e))
         except Exception as e:
             print(f"Error in AI analysis: {str(e)}")
             return self._create_response(0.0, 'needs_review', f'Ошибка анализа: {str(e)}')
     
-    def _check_image_quality(self, image):
-        """Проверяет качество изображения (резкость, яркость)"""
-        # Проверка резкости через Laplacian
+    def analyze_batch(self, image_paths, workers=None, max_in_flight=None):
+        """
+        Анализирует список фото в пуле процессов (OpenCV нагружает CPU, потоки не помогают).
+        В работе одновременно не больше max_in_flight фото (по умолчанию 2 на процесс),
+        чтобы память не росла с размером пакета. Результаты — в порядке image_paths.
+        """
+        image_paths = list(image_paths)
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(image_paths) <= 1:
+            return [self.analyze_image(path) for path in image_paths]
+        max_in_flight = max_in_flight or workers * 2
+        
+        results = []
+        pending = deque()
+        settings = (self._work_edge(), self.image_limits or limits(),
+                    self.auto_approve_threshold, self.reject_threshold)
+        with ProcessPoolExecutor(max_workers=min(workers, len(image_paths)),
+                                 initializer=_init_batch_worker, initargs=settings) as executor:
+            for path in image_paths:
+                if len(pending) >= max_in_flight:
+                    results.append(self._batch_result(pending.popleft()))
+                pending.append(executor.submit(_analyze_in_worker, path))
+            while pending:
+                results.append(self._batch_result(pending.popleft()))
+        return results
+    
+    def _batch_result(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            # Упал процесс пула, а не анализ — фото уходит на ручную проверку
+            print(f"Error in AI batch analysis: {str(e)}")
+            return self._create_response(0.0, 'needs_review', f'Ошибка анализа: {str(e)}')
+    
+    def _work_edge(self):
+        if self.work_edge:
+            return self.work_edge
+        if has_app_context():
+            return current_app.config.get('MODERATION_WORK_EDGE', WORK_EDGE)
+        return WORK_EDGE
+    
+    def extract_features(self, image):
+        """
+        Один проход по изображению: серое, HSV и все маски считаются один раз,
+        доли пикселей — редукциями NumPy. Резкость, яркость и блики зависят
+        от масштаба и считаются по серому в декодированном размере; цветовые
+        маски — на копии не больше MODERATION_WORK_EDGE по длинной стороне.
+        Возвращает словарь признаков; feature_vector() превращает его в вектор.
+        """
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        # Лапласиан uint8 умещается в int16: буфер вчетверо меньше CV_64F
+        _, laplacian_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+        gray_features = {
+            'laplacian_var': float(laplacian_std[0, 0] ** 2),
+            'brightness': float(gray.mean()),
+            # Блики (металл/стекло)
+            'bright_ratio': np.count_nonzero(gray > 200) / gray.size,
+        }
+        del gray
+        
+        height, width = image.shape[:2]
+        scale = self._work_edge() / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                               interpolation=cv2.INTER_AREA)
         
-        # Проверка яркости
-        brightness = np.mean(gray)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        hue, sat, val = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        total_pixels = hue.size
+        
+        def ratio(mask):
+            return np.count_nonzero(mask) / total_pixels
+        
+        # Оттенки коричневого нужны обеим органическим маскам
+        brown_hue = (hue >= 10) & (hue <= 30)
         
+        return {
+            **gray_features,
+            # Яркие цвета (пластик при обнаружении): S, V >= 50
+            'colorful_ratio': ratio((sat >= 50) & (val >= 50)),
+            # Насыщенные цвета (пластик при классификации): S, V >= 100
+            'saturated_ratio': ratio((sat >= 100) & (val >= 100)),
+            # Органика при обнаружении и при классификации
+            'organic_ratio': ratio(brown_hue & (sat >= 50) & (val >= 20) & (val <= 200)),
+            'brown_ratio': ratio(brown_hue & (sat >= 30) & (val >= 30) & (val <= 150)),
+            'image_hash': self._calculate_image_hash(image),
+        }
+    
+    @staticmethod
+    def feature_vector(features):
+        """Числовые признаки в порядке FEATURE_NAMES"""
+        return np.array([features[name] for name in FEATURE_NAMES], dtype=np.float64)
+    
+    def _check_image_quality(self, features):
+        """Проверяет качество изображения (резкость, яркость)"""
         # Оценка качества (0-1)
-        sharpness_score = min(laplacian_var / 500, 1.0)
-        brightness_score = 1.0 - abs(brightness - 127) / 127
+        sharpness_score = min(features['laplacian_var'] / 500, 1.0)
+        brightness_score = 1.0 - abs(features['brightness'] - 127) / 127
         
         return (sharpness_score * 0.6 + brightness_score * 0.4)
     
-    def _detect_trash(self, image):
+    def _detect_trash(self, features):
         """
         Упрощенное обнаружение мусора для MVP
         В production: YOLOv8 или custom CNN модель
         """
-        # Конвертируем в HSV для анализа цветов
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Детекция пластика (яркие цвета)
-        lower_plastic = np.array([0, 50, 50])
-        upper_plastic = np.array([180, 255, 255])
-        plastic_mask = cv2.inRange(hsv, lower_plastic, upper_plastic)
-        
-        # Детекция металла/стекла (блики)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, bright_mask = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-        
-        # Детекция органики (коричневые/темные оттенки)
-        lower_organic = np.array([10, 50, 20])
-        upper_organic = np.array([30, 255, 200])
-        organic_mask = cv2.inRange(hsv, lower_organic, upper_organic)
-        
-        # Подсчет пикселей
-        total_pixels = image.shape[0] * image.shape[1]
-        trash_pixels = cv2.countNonZero(plastic_mask) + cv2.countNonZero(bright_mask) + cv2.countNonZero(organic_mask)
-        
-        # Процент "мусорных" пикселей
-        trash_ratio = trash_pixels / total_pixels
+        # Процент "мусорных" пикселей (пересечения масок считаются в каждой)
+        trash_ratio = features['colorful_ratio'] + features['bright_ratio'] + features['organic_ratio']
         
         # Эвристика: если больше 15% изображения - потенциальный мусор
         base_score = min(trash_ratio * 5, 1.0)
@@ -136,38 +221,18 @@ class AIModeratorService:
         small = cv2.resize(image, (8, 8), interpolation=cv2.INTER_AREA)
         gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
         
-        # Вычисляем среднее
-        avg = gray.mean()
-        
-        # Создаем хеш
-        hash_str = ''.join(['1' if pixel > avg else '0' for pixel in gray.flatten()])
-        return hex(int(hash_str, 2))[2:]
+        # 64 бита "пиксель ярче среднего" -> 8 байт
+        bits = np.packbits(gray.flatten() > gray.mean())
+        return format(int.from_bytes(bits.tobytes(), 'big'), 'x')
     
-    def _classify_trash_type(self, image):
+    def _classify_trash_type(self, features):
         """Классифицирует тип мусора"""
         # Упрощенная логика для MVP
         # В production: multi-label classification model
-        
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Пластик (яркие насыщенные цвета)
-        plastic_mask = cv2.inRange(hsv, np.array([0, 100, 100]), np.array([180, 255, 255]))
-        plastic_ratio = cv2.countNonZero(plastic_mask) / (image.shape[0] * image.shape[1])
-        
-        # Металл/стекло (блестящие поверхности)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, metal_mask = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-        metal_ratio = cv2.countNonZero(metal_mask) / (image.shape[0] * image.shape[1])
-        
-        # Органика (темные/коричневые оттенки)
-        organic_mask = cv2.inRange(hsv, np.array([10, 30, 30]), np.array([30, 255, 150]))
-        organic_ratio = cv2.countNonZero(organic_mask) / (image.shape[0] * image.shape[1])
-        
-        # Определяем преобладающий тип
         ratios = {
-            'plastic': plastic_ratio,
-            'metal': metal_ratio,
-            'organic': organic_ratio
+            'plastic': features['saturated_ratio'],
+            'metal': features['bright_ratio'],
+            'organic': features['brown_ratio']
         }
         
         trash_type = max(ratios, key=ratios.get)
@@ -213,6 +278,27 @@ class AIModeratorService:
             return 100  # Если ошибка - считаем что не дубликат
 
 
+_batch_moderator = None
+
+
+def _init_batch_worker(work_edge, image_limits, auto_approve_threshold, reject_threshold):
+    """Настройки модератора для процесса пула analyze_batch"""
+    global _batch_moderator
+    # Параллельность — за счет процессов, внутренние потоки OpenCV лишние
+    cv2.setNumThreads(1)
+    # После fork у всех процессов одинаковое состояние генератора
+    np.random.seed()
+    _batch_moderator = AIModeratorService()
+    _batch_moderator.work_edge = work_edge
+    _batch_moderator.image_limits = image_limits
+    _batch_moderator.auto_approve_threshold = auto_approve_threshold
+    _batch_moderator.reject_threshold = reject_threshold
+
+
+def _analyze_in_worker(image_path):
+    return _batch_moderator.analyze_image(image_path)
+
+
 # Singleton instance
 ai_moderator = AIModeratorService()
 
@@ -0,0 +1,47 @@
+import json
+
+
+class FakeModeratorService:
+    """
+    Локальный модератор без сети для тестов и разработки.
+    Возвращает заранее заданный результат и запоминает проанализированные файлы.
+    """
+
+    def __init__(self, confidence=0.9, trash_type='mixed', error=None):
+        self.auto_approve_threshold = 0.85
+        self.reject_threshold = 0.50
+        self.model = 'fake'
+        self.calls = []
+        self.configure(confidence, trash_type, error)
+
+    def configure(self, confidence=0.9, trash_type='mixed', error=None):
+        """error — исключение, которое analyze_image будет выбрасывать (проверка повторов)"""
+        self.confidence = confidence
+        self.trash_type = trash_type
+        self.error = error
+        # Другая настройка — другой ключ в кеше модерации
+        self.prompt_version = f'{confidence}:{trash_type}'
+
+    def analyze_image(self, image_path):
+        self.calls.append(image_path)
+        if self.error is not None:
+            raise self.error
+
+        if self.confidence >= self.auto_approve_threshold:
+            status = 'auto_confirmed'
+        elif self.confidence >= self.reject_threshold:
+            status = 'needs_review'
+        else:
+            status = 'rejected'
+
+        return {
+            'confidence': self.confidence,
+            'status': status,
+            'analysis': json.dumps({'method': 'fake'}),
+            'trash_detected': status != 'rejected',
+            'trash_type': self.trash_type
+        }
+
+
+# Singleton instance
+fake_moderator = FakeModeratorService()
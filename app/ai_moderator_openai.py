@@ -1,13 +1,7 @@
-import os
 import base64
 import json
-
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    OpenAI = None
+from app.openai_client import ResilientOpenAIClient, CircuitOpenError
+from app.image_preprocess import prepare_for_vision
 
 class OpenAIModeratorService:
     """
@@ -15,10 +9,11 @@ class OpenAIModeratorService:
     """
     
     def __init__(self):
-        if OPENAI_AVAILABLE and os.environ.get('OPENAI_API_KEY'):
-            self.client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-        else:
-            self.client = None
+        # Пул соединений, дедлайны, повторы и автомат — в ResilientOpenAIClient
+        self.client = ResilientOpenAIClient.from_env()
+        self.model = 'gpt-4o-mini'
+        # Меняется вместе с текстом промпта — старые результаты кеша модерации не используются
+        self.prompt_version = 'v1'
         self.auto_approve_threshold = 0.85
         self.reject_threshold = 0.50
     
@@ -35,23 +30,19 @@ class OpenAIModeratorService:
                 'trash_type': str
             }
         """
+        # Без модуля или ключа — на ручную проверку, а не случайная оценка
+        if not self.client.available:
+            print("⚠️ OpenAI не настроен (модуль или OPENAI_API_KEY), репорт уйдет на ручную проверку")
+            return self._needs_review('not_configured')
+        
         try:
-            # Проверяем наличие OpenAI модуля и API ключа
-            if not OPENAI_AVAILABLE:
-                print("⚠️ OpenAI module not installed, using fallback logic")
-                return self._fallback_analysis(image_path)
-            
-            if not self.client or not os.environ.get('OPENAI_API_KEY'):
-                print("⚠️ OpenAI API key not found, using fallback logic")
-                return self._fallback_analysis(image_path)
-            
-            # Кодируем изображение в base64
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            # Уменьшенная копия (EXIF-поворот, длинная сторона VISION_MAX_EDGE) в base64
+            image_bytes, mime_type = prepare_for_vision(image_path)
+            base64_image = base64.b64encode(image_bytes).decode('utf-8')
             
             # Отправляем запрос к OpenAI Vision API
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = self.client.chat_completion(
+                model=self.model,
                 messages=[
                     {
                         "role": "user",
@@ -78,7 +69,7 @@ class OpenAIModeratorService:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                    "url": f"data:{mime_type};base64,{base64_image}"
                                 }
                             }
                         ]
@@ -122,32 +113,28 @@ class OpenAIModeratorService:
                 'trash_type': trash_type_en
             }
             
+        except CircuitOpenError:
+            # API недоступен — не ждем и не гадаем, отдаем модератору
+            return self._needs_review('circuit_open')
         except Exception as e:
-            print(f"⚠️ OpenAI API error: {str(e)}, using fallback")
-            return self._fallback_analysis(image_path)
+            if self.client.is_transient(e):
+                # Таймаут, 5xx, дедлайн — задачу повторит очередь модерации
+                # (после max_attempts она сама отдаст репорт на ручную проверку)
+                raise
+            print(f"⚠️ OpenAI API error: {str(e)}, репорт уйдет на ручную проверку")
+            return self._needs_review('api_error', f'{type(e).__name__}: {e}')
     
-    def _fallback_analysis(self, image_path):
-        """Запасной вариант анализа без OpenAI"""
-        import random
-        
-        confidence = random.uniform(0.8, 0.9)
-        
-        if confidence >= self.auto_approve_threshold:
-            status = 'auto_confirmed'
-        elif confidence >= self.reject_threshold:
-            status = 'needs_review'
-        else:
-            status = 'rejected'
-        
+    def _needs_review(self, reason, error=None):
+        """Результат без оценки AI: репорт остается pending для модератора"""
+        analysis = {'method': 'unavailable', 'reason': reason}
+        if error:
+            analysis['error'] = error
         return {
-            'confidence': round(confidence, 2),
-            'status': status,
-            'analysis': json.dumps({
-                'method': 'fallback',
-                'note': 'OpenAI API not available'
-            }),
-            'trash_detected': True,
-            'trash_type': 'mixed'
+            'confidence': None,
+            'status': 'needs_review',
+            'analysis': json.dumps(analysis, ensure_ascii=False),
+            'trash_detected': False,
+            'trash_type': None
         }
 
 
@@ -0,0 +1,119 @@
+"""
+Серверная кластеризация маркеров карты.
+
+Для каждого зума из CLUSTER_ZOOMS репорты агрегируются по ячейкам сетки
+уровня zoom + CELL_DEPTH (примерно 32px на экране). Агрегаты хранятся в
+report_clusters и обновляются инкрементально через report_hooks.
+"""
+
+from sqlalchemy import and_, or_
+from app import db
+from app.geo import GRID_ZOOM, covering_quadkeys, prefix_range, quadkey_for
+from app.models import Report, ReportCluster, MAP_STATUS_GROUPS, map_status_group
+from app.report_hooks import on_report_change
+
+CLUSTER_ZOOMS = range(10, 18)
+CELL_DEPTH = 3
+
+
+def cell_zoom(zoom):
+    """Уровень сетки, на котором хранятся кластеры для данного зума"""
+    return min(zoom + CELL_DEPTH, GRID_ZOOM)
+
+
+def clamp_zoom(zoom):
+    return max(CLUSTER_ZOOMS.start, min(zoom, CLUSTER_ZOOMS.stop - 1))
+
+
+def _contribution(snapshot):
+    """Вклад репорта в кластеры: (группа, lat, lon) или None"""
+    if snapshot is None or snapshot['deleted']:
+        return None
+    group = map_status_group(snapshot['status'])
+    if group is None or snapshot['latitude'] is None or snapshot['longitude'] is None:
+        return None
+    return group, snapshot['latitude'], snapshot['longitude']
+
+
+def _bump(connection, zoom, cell, group, lat, lon, delta):
+    table = ReportCluster.__table__
+    values = {
+        group: table.c[group] + delta,
+        'lat_sum': table.c.lat_sum + lat * delta,
+        'lon_sum': table.c.lon_sum + lon * delta,
+    }
+    result = connection.execute(
+        table.update().where(table.c.zoom == zoom, table.c.cell == cell).values(**values)
+    )
+    if result.rowcount == 0 and delta > 0:
+        row = {'zoom': zoom, 'cell': cell, 'lat_sum': lat * delta, 'lon_sum': lon * delta}
+        row.update({name: 0 for name in MAP_STATUS_GROUPS})
+        row[group] = delta
+        connection.execute(table.insert().values(**row))
+
+
+def _apply(connection, contribution, delta):
+    group, lat, lon = contribution
+    cell = quadkey_for(lat, lon)
+    for zoom in CLUSTER_ZOOMS:
+        _bump(connection, zoom, cell[:cell_zoom(zoom)], group, lat, lon, delta)
+
+
+@on_report_change
+def update_clusters(connection, old, new):
+    """Инкрементально переносит репорт между кластерами при смене статуса/координат"""
+    before = _contribution(old)
+    after = _contribution(new)
+    if before == after:
+        return
+    if before:
+        _apply(connection, before, -1)
+    if after:
+        _apply(connection, after, 1)
+
+
+def rebuild_clusters():
+    """Полный пересчет report_clusters по таблице reports"""
+    aggregates = {}
+    rows = db.session.query(Report.status, Report.latitude, Report.longitude)\
+        .filter(Report.deleted_at.is_(None))\
+        .yield_per(1000)
+    for status, lat, lon in rows:
+        contribution = _contribution({
+            'status': status, 'deleted': False, 'latitude': lat, 'longitude': lon
+        })
+        if not contribution:
+            continue
+        group = contribution[0]
+        cell = quadkey_for(lat, lon)
+        for zoom in CLUSTER_ZOOMS:
+            key = (zoom, cell[:cell_zoom(zoom)])
+            item = aggregates.get(key)
+            if item is None:
+                item = aggregates[key] = {
+                    'zoom': key[0], 'cell': key[1], 'lat_sum': 0.0, 'lon_sum': 0.0,
+                    **{name: 0 for name in MAP_STATUS_GROUPS}
+                }
+            item[group] += 1
+            item['lat_sum'] += lat
+            item['lon_sum'] += lon
+
+    ReportCluster.query.delete()
+    if aggregates:
+        db.session.execute(ReportCluster.__table__.insert(), list(aggregates.values()))
+    db.session.commit()
+    return len(aggregates)
+
+
+def query_clusters(bbox, zoom):
+    """Кластеры зума zoom, попадающие в bbox"""
+    zoom = clamp_zoom(zoom)
+    ranges = [
+        and_(ReportCluster.cell >= lo, ReportCluster.cell < hi)
+        for lo, hi in map(prefix_range, covering_quadkeys(bbox, zoom))
+    ]
+    clusters = ReportCluster.query.filter(
+        ReportCluster.zoom == zoom,
+        or_(*ranges)
+    ).all()
+    return zoom, [c for c in clusters if c.total > 0]
@@ -0,0 +1,66 @@
+"""
+Компактный колоночный формат ответа для карты.
+
+Вместо списка объектов с повторяющимися ключами отдаются параллельные массивы
+(id, lat, lon, коды статуса и категории) и словари кодов. Полные данные
+репорта подгружаются отдельно через /api/report/<id>.
+"""
+
+import json
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# Коды статусов и категорий (порядок менять нельзя — только добавлять в конец)
+STATUS_CODES = ('pending', 'confirmed', 'in_progress', 'pending_verification', 'cleaned')
+CATEGORY_CODES = (
+    'trash', 'vandalism', 'nature_damage', 'illegal_dumping',
+    'construction_waste', 'hazardous_waste', 'other',
+    # Устаревшие значения trash_type
+    'plastic', 'metal', 'organic', 'mixed', 'construction', 'paper'
+)
+
+_STATUS_INDEX = {name: code for code, name in enumerate(STATUS_CODES)}
+_CATEGORY_INDEX = {name: code for code, name in enumerate(CATEGORY_CODES)}
+
+# Точность координат: 5 знаков ≈ 1 метр
+COORD_PRECISION = 5
+
+
+def to_columnar(rows):
+    """Строки (id, latitude, longitude, status, report_category, trash_type) → колонки"""
+    other = _CATEGORY_INDEX['other']
+    columns = {'id': [], 'lat': [], 'lon': [], 'status': [], 'category': []}
+    for r in rows:
+        columns['id'].append(r.id)
+        columns['lat'].append(round(r.latitude, COORD_PRECISION))
+        columns['lon'].append(round(r.longitude, COORD_PRECISION))
+        columns['status'].append(_STATUS_INDEX.get(r.status, -1))
+        columns['category'].append(_CATEGORY_INDEX.get(r.report_category or r.trash_type or 'trash', other))
+    return columns
+
+
+def enums():
+    return {'status': list(STATUS_CODES), 'category': list(CATEGORY_CODES)}
+
+
+def wants_msgpack(request):
+    """Клиент просит MessagePack (encoding=msgpack или Accept)"""
+    if not MSGPACK_AVAILABLE:
+        return False
+    if request.args.get('encoding') == 'msgpack':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def encode(payload, use_msgpack):
+    """Тело ответа и mimetype"""
+    if use_msgpack:
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_MIMETYPE
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')), 'application/json'
@@ -0,0 +1,134 @@
+"""
+Буфер счетчиков репортов с отложенной записью (write-behind).
+
+Просмотры не пишутся в БД на каждый запрос: приращения копятся в памяти
+процесса и раз в FLUSH_INTERVAL секунд сбрасываются одним пакетным
+UPDATE reports SET views_count = views_count + ?. Страница репорта больше
+не берет блокировку записи SQLite. updated_at при этом не меняется —
+счетчик просмотров не должен сбрасывать ETag карты.
+
+Поддержки (upvotes) идемпотентны и пишутся сразу: строка в report_upvotes
+и атомарное приращение reports.upvotes в одной транзакции. updated_at они
+тоже не меняют, поэтому после коммита сбрасываются теги reports и района —
+по ним меняется ETag списка карты.
+"""
+
+import atexit
+import os
+import threading
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Report, ReportUpvote
+from app.report_hooks import collect
+
+FLUSH_INTERVAL = 10  # секунд
+BUFFERED_COLUMNS = ('views_count',)
+
+
+class CounterBuffer:
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)  # (колонка, id репорта) -> приращение
+        self._app = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def incr(self, report_id, column='views_count', n=1):
+        if column not in BUFFERED_COLUMNS:
+            raise ValueError(f'Колонка {column} не буферизуется')
+        self._ensure_flusher()
+        with self._lock:
+            self._pending[(column, report_id)] += n
+
+    def pending(self, report_id, column='views_count'):
+        """Еще не записанное приращение (для показа актуального значения)"""
+        with self._lock:
+            return self._pending.get((column, report_id), 0)
+
+    def flush(self):
+        """Пакетная запись накопленных приращений; возвращает число обновленных строк"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return 0
+
+        table = Report.__table__
+        by_column = defaultdict(list)
+        for (column, report_id), delta in pending.items():
+            by_column[column].append({'report_id': report_id, 'delta': delta})
+        try:
+            with db.engine.begin() as connection:
+                for column, rows in by_column.items():
+                    connection.execute(
+                        table.update()
+                        .where(table.c.id == bindparam('report_id'))
+                        .values({column: table.c[column] + bindparam('delta'), 'updated_at': table.c.updated_at}),
+                        rows
+                    )
+        except Exception as exc:
+            # Возвращаем приращения в буфер — запишутся при следующем сбросе
+            with self._lock:
+                for key, delta in pending.items():
+                    self._pending[key] += delta
+            print(f"⚠️ Не удалось сбросить счетчики репортов: {exc}")
+            return 0
+        return len(pending)
+
+    def _ensure_flusher(self):
+        # Поток сброса свой у каждого воркера (после fork потоки не наследуются)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._app = current_app._get_current_object()
+            self._pid = os.getpid()
+            self._stop.clear()
+            threading.Thread(target=self._run, name='counter-buffer', daemon=True).start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._app.app_context():
+                self.flush()
+
+    def shutdown(self):
+        """Останавливает поток и записывает остаток (при выходе процесса)"""
+        self._stop.set()
+        if self._app is not None and self._pid == os.getpid():
+            with self._app.app_context():
+                self.flush()
+
+
+# Singleton instance
+counter_buffer = CounterBuffer()
+atexit.register(counter_buffer.shutdown)
+
+
+def upvote(report_id, user_id):
+    """
+    Поддержка репорта пользователем. Повторная поддержка ничего не меняет.
+    Возвращает (засчитана ли поддержка, текущее число поддержек).
+    """
+    table = Report.__table__
+    try:
+        db.session.add(ReportUpvote(report_id=report_id, user_id=user_id))
+        db.session.flush()
+        db.session.execute(
+            table.update().where(table.c.id == report_id)
+            .values(upvotes=db.func.coalesce(table.c.upvotes, 0) + 1, updated_at=table.c.updated_at)
+        )
+        # Core-UPDATE не вызывает события модели — сбрасываем кеш сами: карточку
+        # и списки карты (upvotes есть в /api/reports, ETag которого учитывает тег reports)
+        district = db.session.execute(db.select(table.c.district).where(table.c.id == report_id)).scalar()
+        collect('response_cache', f'report:{report_id}', 'reports', *([f'district:{district}'] if district else []))
+        db.session.commit()
+        added = True
+    except IntegrityError:
+        db.session.rollback()
+        added = False
+    upvotes = db.session.execute(db.select(table.c.upvotes).where(table.c.id == report_id)).scalar()
+    return added, upvotes or 0
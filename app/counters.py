@@ -0,0 +1,108 @@
+"""
+Счетчики репортов по (статус, район, категория).
+
+Таблица report_counters обновляется через report_hooks в той же транзакции,
+что и изменение репорта, поэтому страницы читают количества одним запросом
+к маленькой таблице вместо повторных COUNT(*) по reports.
+Мягко удаленные репорты учитываются под статусом 'deleted'.
+"""
+
+from collections import defaultdict
+from sqlalchemy import case, func
+from app import db
+from app.models import Report, ReportCounter, MAP_STATUS_GROUPS
+from app.report_hooks import on_report_change
+
+DELETED = 'deleted'
+
+
+def _key(snapshot):
+    if snapshot is None:
+        return None
+    status = DELETED if snapshot['deleted'] else (snapshot['status'] or 'pending')
+    return status, snapshot['district'] or '', snapshot['category']
+
+
+def _bump(connection, key, delta):
+    table = ReportCounter.__table__
+    status, district, category = key
+    result = connection.execute(
+        table.update()
+        .where(table.c.status == status, table.c.district == district, table.c.category == category)
+        .values(count=table.c.count + delta)
+    )
+    if result.rowcount == 0 and delta > 0:
+        connection.execute(table.insert().values(
+            status=status, district=district, category=category, count=delta
+        ))
+
+
+@on_report_change
+def update_counters(connection, old, new):
+    """Переносит репорт между счетчиками при смене статуса, района или категории"""
+    before, after = _key(old), _key(new)
+    if before == after:
+        return
+    if before:
+        _bump(connection, before, -1)
+    if after:
+        _bump(connection, after, 1)
+
+
+def rebuild_counters():
+    """Пересчет report_counters с нуля по таблице reports"""
+    category = func.coalesce(Report.report_category, Report.trash_type, 'trash')
+    status = case((Report.deleted_at.isnot(None), DELETED), else_=func.coalesce(Report.status, 'pending'))
+    rows = db.session.query(
+        status, func.coalesce(Report.district, ''), category, func.count(Report.id)
+    ).group_by(status, func.coalesce(Report.district, ''), category).all()
+
+    totals = defaultdict(int)
+    for row_status, district, row_category, count in rows:
+        totals[(row_status, district, row_category)] += count
+
+    ReportCounter.query.delete()
+    if totals:
+        db.session.execute(ReportCounter.__table__.insert(), [
+            {'status': key[0], 'district': key[1], 'category': key[2], 'count': count}
+            for key, count in totals.items()
+        ])
+    db.session.commit()
+    return len(totals)
+
+
+class StatusCounts(dict):
+    """Количества по статусам с удобными выборками"""
+
+    def __missing__(self, key):
+        return 0
+
+    def total(self, include_deleted=False):
+        return sum(count for status, count in self.items() if include_deleted or status != DELETED)
+
+    def sum(self, *statuses):
+        return sum(self[status] for status in statuses)
+
+    def group(self, name):
+        """Сумма по группе статусов карты (on_review, in_work, cleaned)"""
+        return self.sum(*MAP_STATUS_GROUPS[name])
+
+
+def status_counts(district=None, category=None):
+    """Количества репортов по статусам одним запросом к report_counters"""
+    query = db.session.query(ReportCounter.status, func.sum(ReportCounter.count))
+    if district is not None:
+        query = query.filter(ReportCounter.district == district)
+    if category is not None:
+        query = query.filter(ReportCounter.category == category)
+    return StatusCounts((status, int(count or 0)) for status, count in query.group_by(ReportCounter.status))
+
+
+def district_counts():
+    """{район: StatusCounts} одним запросом"""
+    rows = db.session.query(ReportCounter.district, ReportCounter.status, func.sum(ReportCounter.count))\
+        .group_by(ReportCounter.district, ReportCounter.status).all()
+    result = defaultdict(StatusCounts)
+    for district, status, count in rows:
+        result[district][status] = int(count or 0)
+    return result
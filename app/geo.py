@@ -0,0 +1,143 @@
+"""
+Пространственная сетка для репортов.
+
+Каждая точка кодируется quadkey-строкой (тайлы Web Mercator). Префикс quadkey
+длины z — это тайл уровня z, поэтому выборка по окну карты сводится к
+нескольким диапазонам по индексированной колонке Report.grid_cell.
+"""
+
+import math
+
+# Уровень детализации, с которым хранится ключ ячейки (~40 м на широте Алматы)
+GRID_ZOOM = 20
+
+# Границы Алматы (расширенные для включения всех репортов)
+ALMATY_LAT_MIN = 42.8
+ALMATY_LAT_MAX = 43.5
+ALMATY_LON_MIN = 76.4
+ALMATY_LON_MAX = 77.3
+ALMATY_BBOX = (ALMATY_LON_MIN, ALMATY_LAT_MIN, ALMATY_LON_MAX, ALMATY_LAT_MAX)
+
+# Максимум диапазонов в одном запросе по окну карты
+MAX_COVER_CELLS = 16
+
+_MAX_LAT = 85.05112878
+
+
+def latlon_to_tile(lat, lon, zoom):
+    """Возвращает (x, y) тайла уровня zoom, в который попадает точка"""
+    lat = max(min(lat, _MAX_LAT), -_MAX_LAT)
+    n = 1 << zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_to_quadkey(x, y, zoom):
+    """Кодирует тайл в quadkey-строку длины zoom"""
+    digits = []
+    for i in range(zoom, 0, -1):
+        mask = 1 << (i - 1)
+        digit = 0
+        if x & mask:
+            digit += 1
+        if y & mask:
+            digit += 2
+        digits.append(str(digit))
+    return ''.join(digits)
+
+
+def quadkey_to_tile(quadkey):
+    """Обратное преобразование quadkey → (x, y, zoom)"""
+    x = y = 0
+    zoom = len(quadkey)
+    for i, digit in enumerate(quadkey):
+        mask = 1 << (zoom - i - 1)
+        value = int(digit)
+        if value & 1:
+            x |= mask
+        if value & 2:
+            y |= mask
+    return x, y, zoom
+
+
+def quadkey_for(lat, lon, zoom=GRID_ZOOM):
+    """Ключ ячейки сетки для координат (None, если координат нет)"""
+    if lat is None or lon is None:
+        return None
+    x, y = latlon_to_tile(lat, lon, zoom)
+    return tile_to_quadkey(x, y, zoom)
+
+
+def tile_bounds(x, y, zoom):
+    """Границы тайла: (min_lon, min_lat, max_lon, max_lat)"""
+    n = 1 << zoom
+    min_lon = x / n * 360.0 - 180.0
+    max_lon = (x + 1) / n * 360.0 - 180.0
+    max_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    min_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def prefix_range(prefix):
+    """Полуинтервал [lo, hi) ключей, начинающихся с prefix (цифры quadkey: 0-3)"""
+    return prefix, prefix + '4'
+
+
+def parse_bbox(value):
+    """
+    Разбирает bbox из строки 'min_lon,min_lat,max_lon,max_lat'
+    (формат Leaflet map.getBounds().toBBoxString()).
+    Возвращает None для пустой или некорректной строки.
+    """
+    if not value:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(','))
+    except ValueError:
+        return None
+    # float() принимает 'nan' и 'inf' — дальше они ломают математику тайлов
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        return None
+    if min_lon > max_lon or min_lat > max_lat:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def clip_bbox(bbox, bounds=ALMATY_BBOX):
+    """Обрезает bbox по границам города; None, если пересечения нет"""
+    min_lon = max(bbox[0], bounds[0])
+    min_lat = max(bbox[1], bounds[1])
+    max_lon = min(bbox[2], bounds[2])
+    max_lat = min(bbox[3], bounds[3])
+    if min_lon > max_lon or min_lat > max_lat:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def covering_tiles(bbox, zoom):
+    """Все тайлы уровня zoom, пересекающие bbox"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = latlon_to_tile(max_lat, min_lon, zoom)
+    x1, y1 = latlon_to_tile(min_lat, max_lon, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def covering_quadkeys(bbox, zoom, max_cells=MAX_COVER_CELLS):
+    """
+    Набор quadkey-префиксов, покрывающих bbox.
+    Если на уровне zoom получается больше max_cells ячеек, уровень понижается,
+    чтобы число диапазонов в запросе оставалось ограниченным.
+    """
+    zoom = max(0, min(zoom, GRID_ZOOM))
+    tiles = covering_tiles(bbox, zoom)
+    while len(tiles) > max_cells and zoom > 0:
+        zoom -= 1
+        tiles = covering_tiles(bbox, zoom)
+    return [tile_to_quadkey(x, y, zoom) for x, y in tiles]
+
+
+def contains(bbox, lat, lon):
+    """Попадает ли точка в bbox"""
+    return bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]
@@ -0,0 +1,127 @@
+"""
+Декодирование фото с ограниченной памятью.
+
+Фото 48 Мп в полном разрешении — около 140 МБ BGR-буфера на каждый
+анализ. Поэтому размер сначала читается из заголовка, без декодирования
+пикселей: фото больше IMAGE_MAX_PIXELS отклоняется сразу (ImageTooLarge).
+Остальные декодируются не больше чем в IMAGE_DECODE_PIXELS пикселей. JPEG
+уменьшается при декодировании средствами libjpeg: в OpenCV — флаги
+IMREAD_REDUCED_COLOR_*, в Pillow — draft(). PNG, WebP и GIF так не умеют и
+декодируются в полном размере, поэтому для них действует отдельный, меньший
+лимит IMAGE_MAX_UNSCALED_PIXELS.
+
+Лимиты — из настроек приложения (limits()); процессы пула без контекста
+приложения получают их явно. Размер декодированного буфера пишется в анализ
+(decode.buffer_mb); peak_rss_mb() — пик памяти процесса за все время, для
+/admin/ai-status.
+"""
+
+import resource
+import cv2
+from flask import current_app, has_app_context
+from PIL import Image
+
+# Значения по умолчанию (IMAGE_* в config.py)
+MAX_SOURCE_PIXELS = 64_000_000
+DECODE_PIXELS = 4_000_000
+MAX_UNSCALED_PIXELS = 16_000_000
+
+# Масштабы, которые libjpeg выполняет прямо при декодировании
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class ImageTooLarge(ValueError):
+    """Фото больше лимита пикселей, декодирование не выполнялось"""
+
+
+def probe(image_path):
+    """(ширина, высота, формат) по заголовку файла"""
+    with Image.open(image_path) as image:
+        return image.size[0], image.size[1], image.format
+
+
+def limits():
+    """(IMAGE_MAX_PIXELS, IMAGE_DECODE_PIXELS, IMAGE_MAX_UNSCALED_PIXELS) из настроек приложения"""
+    if not has_app_context():
+        return MAX_SOURCE_PIXELS, DECODE_PIXELS, MAX_UNSCALED_PIXELS
+    config = current_app.config
+    return (
+        config.get('IMAGE_MAX_PIXELS', MAX_SOURCE_PIXELS),
+        config.get('IMAGE_DECODE_PIXELS', DECODE_PIXELS),
+        config.get('IMAGE_MAX_UNSCALED_PIXELS', MAX_UNSCALED_PIXELS),
+    )
+
+
+def check_size(width, height, fmt, image_limits=None):
+    """ImageTooLarge, если фото нельзя декодировать в пределах лимитов"""
+    max_source_pixels, _, max_unscaled_pixels = image_limits or limits()
+    # Только JPEG уменьшается при декодировании
+    limit = max_source_pixels if fmt == 'JPEG' else min(max_source_pixels, max_unscaled_pixels)
+    if width * height > limit:
+        raise ImageTooLarge(f'Фото {fmt} {width}x{height} больше лимита {limit} пикселей')
+
+
+def reduction_factor(width, height, max_pixels=DECODE_PIXELS):
+    """Наименьший масштаб libjpeg (1, 2, 4, 8), при котором фото укладывается в max_pixels"""
+    for factor in REDUCED_FLAGS:
+        if (width // factor) * (height // factor) <= max_pixels:
+            return factor
+    return 8
+
+
+def decode_bgr(image_path, image_limits=None):
+    """
+    BGR-массив не больше IMAGE_DECODE_PIXELS и сведения о декодировании.
+    Возвращает (None, None), если файл не читается; ImageTooLarge — до декодирования.
+    """
+    image_limits = image_limits or limits()
+    max_pixels = image_limits[1]
+    try:
+        width, height, fmt = probe(image_path)
+    except Exception:
+        return None, None
+    check_size(width, height, fmt, image_limits)
+
+    factor = reduction_factor(width, height, max_pixels) if fmt == 'JPEG' else 1
+    image = cv2.imread(image_path, REDUCED_FLAGS[factor])
+    if image is None:
+        return None, None
+
+    decoded_height, decoded_width = image.shape[:2]
+    if decoded_width * decoded_height > max_pixels:
+        scale = (max_pixels / (decoded_width * decoded_height)) ** 0.5
+        image = cv2.resize(image, (max(int(decoded_width * scale), 1), max(int(decoded_height * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+
+    return image, {
+        'source_size': [width, height],
+        'decoded_size': [image.shape[1], image.shape[0]],
+        'jpeg_scale': factor,
+        'buffer_mb': round(image.nbytes / 2 ** 20, 1),
+    }
+
+
+def open_pil(image_path, draft_size=None, mode='RGB'):
+    """
+    Pillow-изображение с проверенным по заголовку размером;
+    JPEG будет декодирован уменьшенным, но не меньше draft_size
+    """
+    image = Image.open(image_path)
+    try:
+        check_size(*image.size, image.format)
+    except ImageTooLarge:
+        image.close()
+        raise
+    if draft_size:
+        image.draft(mode, draft_size)
+    return image
+
+
+def peak_rss_mb():
+    """Пик резидентной памяти процесса за все время его работы, МБ (ru_maxrss в Linux — в КБ)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
@@ -0,0 +1,83 @@
+"""
+Подготовка фото для vision-модели.
+
+Оригинал загрузки (до MAX_CONTENT_LENGTH) не отправляется как есть: фото
+поворачивается по EXIF, уменьшается до VISION_MAX_EDGE по длинной стороне и
+перекодируется в JPEG или WebP с правильным MIME-типом. Результат кешируется
+рядом с загрузкой (<файл>.vision<край>.<расширение>), поэтому повторная
+модерация того же фото не декодирует оригинал заново.
+
+Размер, формат и качество берутся из конфигурации приложения (VISION_MAX_EDGE,
+VISION_FORMAT, VISION_QUALITY в config.py), если не переданы явно.
+"""
+
+import io
+import os
+from flask import current_app
+from PIL import Image, ImageOps
+from app.image_io import open_pil
+
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+}
+
+
+def vision_settings(max_edge=None, fmt=None, quality=None):
+    """(край, формат, качество): явные значения или настройки приложения"""
+    config = current_app.config
+    return (
+        max_edge or config.get('VISION_MAX_EDGE', 1024),
+        (fmt or config.get('VISION_FORMAT', 'jpeg')).lower(),
+        quality or config.get('VISION_QUALITY', 85),
+    )
+
+
+def cached_path(image_path, max_edge, fmt):
+    return f'{image_path}.vision{max_edge}.{FORMATS[fmt][2]}'
+
+
+def downscale(image_path, max_edge, fmt, quality):
+    """Байты уменьшенного фото в формате fmt"""
+    pil_format = FORMATS[fmt][0]
+    # JPEG декодируется сразу уменьшенным (но не меньше max_edge), размер проверен по заголовку
+    with open_pil(image_path, (max_edge, max_edge)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Прозрачность заливаем белым — JPEG ее не поддерживает
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=pil_format, quality=quality, optimize=True)
+        return buffer.getvalue()
+
+
+def prepare_for_vision(image_path, max_edge=None, fmt=None, quality=None):
+    """(байты, MIME-тип) фото для отправки модели; берет из кеша, если он свежее оригинала"""
+    max_edge, fmt, quality = vision_settings(max_edge, fmt, quality)
+    if fmt not in FORMATS:
+        raise ValueError(f'Неподдерживаемый формат {fmt}')
+    mime = FORMATS[fmt][1]
+    path = cached_path(image_path, max_edge, fmt)
+
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(image_path):
+            with open(path, 'rb') as cached:
+                return cached.read(), mime
+    except OSError:
+        pass
+
+    data = downscale(image_path, max_edge, fmt, quality)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        print(f"⚠️ Не удалось сохранить уменьшенное фото {path}: {exc}")
+    return data, mime
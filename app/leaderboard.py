@@ -0,0 +1,68 @@
+"""
+Лидерборды по районам.
+
+Топ-N участников для всех районов считается одним запросом:
+GROUP BY (район, автор) и ROW_NUMBER() OVER (PARTITION BY район).
+Список районов берется из данных, а не из захардкоженного списка.
+Результат (id авторов по районам) хранится в общем кеше воркеров под тегом
+leaderboard и сбрасывается при изменении репортов или баллов.
+"""
+
+from collections import OrderedDict
+from sqlalchemy import func, select
+from app import db
+from app.models import Report, User
+from app.shared_cache import shared_cache
+
+
+def district_leaders(limit=3, district=None):
+    """
+    {район: [User, ...]} — топ-limit авторов каждого района по числу
+    неудаленных репортов. district ограничивает выборку одним районом.
+    """
+    leader_ids = shared_cache.cached(
+        f'leaderboard:districts:{limit}:{district or ""}',
+        lambda: _leader_ids(limit, district),
+        tags=('leaderboard',)
+    )
+    user_ids = {user_id for _, user_id in leader_ids}
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+
+    leaders = OrderedDict()
+    for district_name, user_id in leader_ids:
+        if user_id in users:
+            leaders.setdefault(district_name, []).append(users[user_id])
+    return leaders
+
+
+def _leader_ids(limit, district):
+    """[(район, id автора)] в порядке района и места"""
+    counts = select(
+        Report.district.label('district'),
+        Report.user_id.label('user_id'),
+        func.count(Report.id).label('reports')
+    ).where(
+        Report.deleted_at.is_(None),
+        Report.user_id.isnot(None),
+        Report.district.isnot(None),
+        Report.district != ''
+    )
+    if district is not None:
+        counts = counts.where(Report.district == district)
+    counts = counts.group_by(Report.district, Report.user_id).subquery()
+
+    ranked = select(
+        counts.c.district,
+        counts.c.user_id,
+        counts.c.reports,
+        func.row_number().over(
+            partition_by=counts.c.district,
+            order_by=(counts.c.reports.desc(), counts.c.user_id.asc())
+        ).label('rank')
+    ).subquery()
+
+    rows = db.session.query(ranked.c.district, ranked.c.user_id)\
+        .filter(ranked.c.rank <= limit)\
+        .order_by(ranked.c.district, ranked.c.rank)\
+        .all()
+    return [(district_name, user_id) for district_name, user_id in rows]
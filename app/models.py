@@ -1,12 +1,30 @@
 from datetime import datetime
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from app import db, login_manager
+from app.geo import quadkey_for, covering_quadkeys, prefix_range
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# Уровни по общему числу баллов (от старшего к младшему)
+LEVELS = (
+    (500, 'Городской герой'),
+    (200, 'Эко-патриот'),
+    (50, 'Активист'),
+    (0, 'Новичок'),
+)
+
+
+def level_for(total_points):
+    for threshold, level in LEVELS:
+        if (total_points or 0) >= threshold:
+            return level
+    return LEVELS[-1][1]
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -25,7 +43,7 @@ class User(UserMixin, db.Model):
     is_cleaner = db.Column(db.Boolean, default=False)
     
     # Points and level
-    total_points = db.Column(db.Integer, default=0)
+    total_points = db.Column(db.Integer, default=0, index=True)
     points_balance = db.Column(db.Integer, default=0)
     points_spent = db.Column(db.Integer, default=0)
     level = db.Column(db.String(50), default='Новичок')
@@ -49,36 +67,55 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
-    def add_points(self, points):
-        self.total_points = max(self.total_points + points, 0)
-        self.points_balance = max(self.points_balance + points, 0)
+    def add_points(self, points, reason, report_id=None):
+        """Начисление (или штраф) с записью в points_ledger; коммит — за вызывающим"""
+        self.total_points = max((self.total_points or 0) + points, 0)
+        self.points_balance = max((self.points_balance or 0) + points, 0)
         self._update_level()
-        db.session.commit()
+        db.session.add(PointsEntry(user=self, amount=points, kind=PointsEntry.EARN,
+                                   reason=reason, report_id=report_id))
 
-    def spend_points(self, points):
-        if points > self.points_balance:
+    def spend_points(self, points, reason, reward_id=None):
+        """Списание баланса с записью в points_ledger; коммит — за вызывающим"""
+        if points > (self.points_balance or 0):
             raise ValueError('Недостаточно баллов')
         self.points_balance -= points
-        self.points_spent += points
+        self.points_spent = (self.points_spent or 0) + points
         self._update_level()
-        db.session.commit()
+        db.session.add(PointsEntry(user=self, amount=-points, kind=PointsEntry.SPEND,
+                                   reason=reason, reward_id=reward_id))
     
     def _update_level(self):
-        if self.total_points >= 500:
-            self.level = 'Городской герой'
-        elif self.total_points >= 200:
-            self.level = 'Эко-патриот'
-        elif self.total_points >= 50:
-            self.level = 'Активист'
-        else:
-            self.level = 'Новичок'
+        self.level = level_for(self.total_points)
     
     def __repr__(self):
         return f'<User {self.username}>'
 
 
+# Группы статусов, которыми оперирует карта
+MAP_STATUS_GROUPS = {
+    'on_review': ('pending', 'confirmed'),
+    'in_work': ('in_progress', 'pending_verification'),
+    'cleaned': ('cleaned',),
+}
+
+
+def map_status_group(status):
+    """Группа статуса для карты (None для rejected/deleted)"""
+    for group, statuses in MAP_STATUS_GROUPS.items():
+        if status in statuses:
+            return group
+    return None
+
+
 class Report(db.Model):
     __tablename__ = 'reports'
+    __table_args__ = (
+        # Keyset-пагинация по (created_at, id), см. app/pagination.py
+        db.Index('ix_reports_created_at_id', 'created_at', 'id'),
+        # Дельта-лента карты по (updated_at, id), см. /api/reports/changes
+        db.Index('ix_reports_updated_at_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -91,8 +128,10 @@ class Report(db.Model):
     longitude = db.Column(db.Float, nullable=False)
     address = db.Column(db.String(255))
     district = db.Column(db.String(100))
+    grid_cell = db.Column(db.String(32), index=True)  # quadkey ячейки сетки, см. app/geo.py
     
     # Content
+    photo_hash = db.Column(db.String(16))  # 64-битный dHash (hex), см. app.photo_index
     photo_path = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
     trash_type = db.Column(db.String(50))  # Deprecated: kept for backward compatibility
@@ -100,7 +139,7 @@ class Report(db.Model):
     
     # AI Moderation
     ai_confidence = db.Column(db.Float)
-    ai_status = db.Column(db.String(20))  # auto_confirmed, needs_review, rejected
+    ai_status = db.Column(db.String(20))  # queued, auto_confirmed, needs_review, rejected
     ai_analysis = db.Column(db.Text)  # JSON with AI analysis details
     
     # Status: pending, confirmed, rejected, cleaned
@@ -129,6 +168,23 @@ class Report(db.Model):
     def __repr__(self):
         return f'<Report {self.id} - {self.status}>'
     
+    @classmethod
+    def in_bbox(cls, bbox, zoom):
+        """
+        Условие попадания в bbox через индекс grid_cell: диапазоны по
+        quadkey-префиксам покрывающих ячеек плюс точная обрезка по координатам.
+        """
+        ranges = [
+            db.and_(cls.grid_cell >= lo, cls.grid_cell < hi)
+            for lo, hi in map(prefix_range, covering_quadkeys(bbox, zoom))
+        ]
+        min_lon, min_lat, max_lon, max_lat = bbox
+        return db.and_(
+            db.or_(*ranges),
+            cls.latitude.between(min_lat, max_lat),
+            cls.longitude.between(min_lon, max_lon)
+        )
+    
     def is_deleted(self):
         """Проверка, удален ли репорт"""
         return self.deleted_at is not None
@@ -139,6 +195,183 @@ class Report(db.Model):
         self.status = 'deleted'
 
 
+@event.listens_for(Report, 'before_insert')
+@event.listens_for(Report, 'before_update')
+def _sync_report_grid_cell(mapper, connection, target):
+    """Поддерживает grid_cell в актуальном состоянии при вставке и смене координат"""
+    target.grid_cell = quadkey_for(target.latitude, target.longitude)
+
+
+class ReportCluster(db.Model):
+    """Предрассчитанный кластер карты: ячейка сетки на заданном зуме"""
+    __tablename__ = 'report_clusters'
+    __table_args__ = (
+        db.UniqueConstraint('zoom', 'cell', name='uq_report_clusters_zoom_cell'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    zoom = db.Column(db.Integer, nullable=False)
+    cell = db.Column(db.String(32), nullable=False)  # quadkey ячейки кластера
+    
+    # Счетчики по группам статусов карты
+    on_review = db.Column(db.Integer, default=0, nullable=False)
+    in_work = db.Column(db.Integer, default=0, nullable=False)
+    cleaned = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Суммы координат для центроида
+    lat_sum = db.Column(db.Float, default=0.0, nullable=False)
+    lon_sum = db.Column(db.Float, default=0.0, nullable=False)
+    
+    @property
+    def total(self):
+        return self.on_review + self.in_work + self.cleaned
+    
+    def __repr__(self):
+        return f'<ReportCluster z{self.zoom} {self.cell}>'
+
+
+class ReportCounter(db.Model):
+    """Счетчик репортов по (статус, район, категория), обновляется в транзакции изменения"""
+    __tablename__ = 'report_counters'
+    __table_args__ = (
+        db.UniqueConstraint('status', 'district', 'category', name='uq_report_counters_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False)
+    district = db.Column(db.String(100), nullable=False, default='')  # '' — район не указан
+    category = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ReportCounter {self.status}/{self.district}/{self.category}: {self.count}>'
+
+
+class ReportRollup(db.Model):
+    """Число репортов, созданных в интервале (час/день), по району, категории и текущему статусу"""
+    __tablename__ = 'report_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'district', 'category', 'status',
+                            name='uq_report_rollups_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), nullable=False)  # hour, day
+    bucket = db.Column(db.DateTime, nullable=False)  # начало интервала (UTC)
+    district = db.Column(db.String(100), nullable=False, default='')
+    category = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ReportRollup {self.granularity} {self.bucket}: {self.count}>'
+
+
+class PointsEntry(db.Model):
+    """Запись журнала баллов: начисление (earn) или списание (spend). Только добавление."""
+    __tablename__ = 'points_ledger'
+    
+    EARN = 'earn'
+    SPEND = 'spend'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)  # со знаком: списания отрицательные
+    kind = db.Column(db.String(10), nullable=False)
+    reason = db.Column(db.String(50), nullable=False)  # report_submitted, report_cleaned, reward_redeemed...
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=True)
+    reward_id = db.Column(db.Integer, db.ForeignKey('rewards.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref=db.backref('points_entries', lazy='dynamic'))
+    
+    def __repr__(self):
+        return f'<PointsEntry {self.user_id} {self.amount:+d} {self.reason}>'
+
+
+class ModerationJob(db.Model):
+    """Задача AI-модерации фото репорта (очередь в БД)"""
+    __tablename__ = 'moderation_jobs'
+    __table_args__ = (
+        db.Index('ix_moderation_jobs_status_run_after', 'status', 'run_after'),
+    )
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # не раньше (повторы с задержкой)
+    locked_by = db.Column(db.String(100))  # воркер, взявший задачу
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    report = db.relationship('Report', backref=db.backref('moderation_jobs', lazy='dynamic'))
+    
+    def __repr__(self):
+        return f'<ModerationJob {self.id} report={self.report_id} {self.status}>'
+
+
+class ModerationCacheEntry(db.Model):
+    """Результат модерации фото по SHA-256 нормализованных байтов, модели и версии промпта"""
+    __tablename__ = 'moderation_cache'
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'model', 'prompt_version', name='uq_moderation_cache_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    prompt_version = db.Column(db.String(20), nullable=False)
+    confidence = db.Column(db.Float)
+    status = db.Column(db.String(20), nullable=False)
+    analysis = db.Column(db.Text)
+    trash_type = db.Column(db.String(50))
+    trash_detected = db.Column(db.Boolean, default=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_hit_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ModerationCacheEntry {self.content_hash[:12]} {self.model}>'
+
+
+class PhotoHashBand(db.Model):
+    """16-битная полоса перцептивного хеша фото репорта (индекс почти-дубликатов)"""
+    __tablename__ = 'photo_hash_bands'
+    __table_args__ = (
+        db.Index('ix_photo_hash_bands_band_value', 'band', 'value'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=False, index=True)
+    band = db.Column(db.SmallInteger, nullable=False)
+    value = db.Column(db.Integer, nullable=False)
+
+
+class ReportUpvote(db.Model):
+    """Поддержка репорта пользователем (не больше одной на пару репорт/пользователь)"""
+    __tablename__ = 'report_upvotes'
+    __table_args__ = (
+        db.UniqueConstraint('report_id', 'user_id', name='uq_report_upvotes_report_user'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey('reports.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ReportUpvote {self.report_id} by {self.user_id}>'
+
+
 class Badge(db.Model):
     __tablename__ = 'badges'
     
@@ -0,0 +1,143 @@
+"""
+Кеш результатов модерации по содержимому фото.
+
+Ключ — SHA-256 нормализованных байтов (копия для vision-модели после
+EXIF-поворота и уменьшения) плюс модель и версия промпта модератора. Одно и
+то же фото, отправленное повторно или разными пользователями, получает
+сохраненные confidence/status/analysis без вызова модели; в ai_analysis
+такой результат помечается полем cache.
+
+Кешируются только настоящие оценки (confidence не None): отказ API или
+отсутствие ключа не должны закрепляться за фото. Записи старше
+MODERATION_CACHE_DAYS и сверх MODERATION_CACHE_MAX_ENTRIES удаляются.
+
+Кеш читается и пишется отдельным соединением (своя транзакция), а не через
+db.session: коммит, откат или autoflush здесь не должны затрагивать изменения,
+накопленные вызывающим кодом в его сессии.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app import db
+from app.models import ModerationCacheEntry
+from app.image_preprocess import prepare_for_vision
+
+# Как часто (в сохранениях) чистить старые записи
+PRUNE_EVERY = 100
+
+_stores = 0
+
+
+def content_hash(image_path):
+    """SHA-256 нормализованного фото; при ошибке декодирования — исходных байтов"""
+    try:
+        data, _ = prepare_for_vision(image_path)
+    except Exception:
+        with open(image_path, 'rb') as image_file:
+            data = image_file.read()
+    return hashlib.sha256(data).hexdigest()
+
+
+def moderator_key(moderator):
+    return getattr(moderator, 'model', type(moderator).__name__), getattr(moderator, 'prompt_version', '1')
+
+
+def lookup(digest, model, prompt_version):
+    """Строка кеша (Row) или None; читается мимо db.session — без autoflush вызывающего"""
+    table = ModerationCacheEntry.__table__
+    with db.engine.connect() as connection:
+        return connection.execute(select(table).where(
+            table.c.content_hash == digest, table.c.model == model,
+            table.c.prompt_version == prompt_version
+        )).first()
+
+
+def _result_from(entry):
+    try:
+        analysis = json.loads(entry.analysis) if entry.analysis else {}
+    except ValueError:
+        analysis = {'raw': entry.analysis}
+    if not isinstance(analysis, dict):
+        analysis = {'raw': analysis}
+    analysis['cache'] = {
+        'hit': True,
+        'content_hash': entry.content_hash,
+        'stored_at': entry.created_at.isoformat() if entry.created_at else None,
+    }
+    return {
+        'confidence': entry.confidence,
+        'status': entry.status,
+        'analysis': json.dumps(analysis, ensure_ascii=False),
+        'trash_detected': entry.trash_detected,
+        'trash_type': entry.trash_type,
+    }
+
+
+def store(digest, model, prompt_version, result):
+    """Сохраняет результат отдельной транзакцией (гонка двух воркеров — не ошибка)"""
+    global _stores
+    table = ModerationCacheEntry.__table__
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(table.insert().values(
+                content_hash=digest, model=model, prompt_version=prompt_version,
+                confidence=result['confidence'], status=result['status'],
+                analysis=result['analysis'], trash_type=result.get('trash_type'),
+                trash_detected=bool(result.get('trash_detected'))
+            ))
+    except IntegrityError:
+        return
+    except SQLAlchemyError as exc:
+        print(f"⚠️ Не удалось сохранить результат в кеш модерации: {exc}")
+        return
+    _stores += 1
+    if _stores % PRUNE_EVERY == 0:
+        prune()
+
+
+def prune():
+    """Удаляет записи старше срока хранения и самые старые сверх лимита"""
+    days = current_app.config.get('MODERATION_CACHE_DAYS', 30)
+    max_entries = current_app.config.get('MODERATION_CACHE_MAX_ENTRIES', 20000)
+    table = ModerationCacheEntry.__table__
+    with db.engine.begin() as connection:
+        removed = connection.execute(table.delete().where(
+            table.c.created_at < datetime.utcnow() - timedelta(days=days)
+        )).rowcount
+
+        excess = connection.execute(select(func.count()).select_from(table)).scalar() - max_entries
+        if excess > 0:
+            oldest = select(table.c.id).order_by(table.c.created_at.asc()).limit(excess)
+            removed += connection.execute(table.delete().where(table.c.id.in_(oldest))).rowcount
+    return removed
+
+
+def _record_hit(entry_id):
+    table = ModerationCacheEntry.__table__
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(table.update().where(table.c.id == entry_id).values(
+                hits=table.c.hits + 1, last_hit_at=datetime.utcnow()
+            ))
+    except SQLAlchemyError as exc:
+        print(f"⚠️ Не удалось обновить счетчик кеша модерации: {exc}")
+
+
+def analyze(moderator, image_path):
+    """moderator.analyze_image с кешем по содержимому фото"""
+    digest = content_hash(image_path)
+    model, prompt_version = moderator_key(moderator)
+
+    entry = lookup(digest, model, prompt_version)
+    if entry is not None:
+        _record_hit(entry.id)
+        return _result_from(entry)
+
+    result = moderator.analyze_image(image_path)
+    if result.get('confidence') is not None:
+        store(digest, model, prompt_version, result)
+    return result
@@ -0,0 +1,328 @@
+"""
+Очередь AI-модерации репортов.
+
+Репорт создается сразу со статусом pending, а анализ фото ставится задачей
+в таблицу moderation_jobs и выполняется в фоне: пулом потоков внутри
+веб-воркера (MODERATION_WORKERS) и/или отдельным процессом
+`flask moderation-worker`. Статус, баллы и уведомление применяются, когда
+задача завершилась. Ошибки модератора повторяются с экспоненциальной
+задержкой; после max_attempts репорт уходит на ручную проверку (needs_review).
+
+Задача забирается атомарным UPDATE ... WHERE status = 'queued', поэтому
+несколько воркеров (и процессов) не возьмут одну задачу дважды. Задачи,
+зависшие в running (воркер упал), возвращаются в очередь через STALE_AFTER.
+Каждый захват получает свой токен в locked_by; завершить задачу может только
+владелец текущего токена (условный UPDATE в транзакции применения результата),
+поэтому запоздавший первый прогон не начислит баллы повторно.
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from app import db
+from app.models import ModerationJob, Notification
+from app import moderation_cache, prefilter
+from app.report_hooks import collect, after_commit
+
+POLL_INTERVAL = 5  # секунд между проверками очереди без сигнала
+RETRY_BASE_DELAY = 10  # секунд; 10, 20, 40...
+STALE_AFTER = timedelta(minutes=10)
+
+
+BACKENDS = ('openai', 'local', 'fake')
+
+
+def get_moderator(backend=None):
+    """Модератор по MODERATION_BACKEND: openai, local (OpenCV) или fake (тесты)"""
+    backend = backend or current_app.config.get('MODERATION_BACKEND', 'openai')
+    if backend == 'fake':
+        from app.ai_moderator_fake import fake_moderator
+        return fake_moderator
+    if backend == 'local':
+        from app.ai_moderator import ai_moderator
+        return ai_moderator
+    from app.ai_moderator_openai import openai_moderator
+    return openai_moderator
+
+
+def enqueue(report):
+    """Ставит репорт в очередь модерации (коммит — за вызывающим)"""
+    report.ai_status = 'queued'
+    job = ModerationJob(
+        report=report,
+        max_attempts=current_app.config.get('MODERATION_MAX_ATTEMPTS', 5)
+    )
+    db.session.add(job)
+    collect('moderation_jobs', 'wake')
+    return job
+
+
+def claim_job(worker_id):
+    """
+    Забирает следующую готовую задачу: (id задачи, токен захвата) или None,
+    если очередь пуста. Токен передается в run_job.
+    """
+    table = ModerationJob.__table__
+    while True:
+        lock = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+        now = datetime.utcnow()
+        job_id = db.session.execute(
+            select(table.c.id)
+            .where(table.c.status == ModerationJob.QUEUED, table.c.run_after <= now)
+            .order_by(table.c.run_after, table.c.id)
+            .limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        claimed = db.session.execute(
+            table.update()
+            .where(table.c.id == job_id, table.c.status == ModerationJob.QUEUED)
+            .values(status=ModerationJob.RUNNING, locked_by=lock, locked_at=now,
+                    attempts=table.c.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id, lock
+        # Задачу перехватил другой воркер — берем следующую
+
+
+def release_stale():
+    """Возвращает в очередь задачи, которые слишком долго в running"""
+    table = ModerationJob.__table__
+    released = db.session.execute(
+        table.update()
+        .where(table.c.status == ModerationJob.RUNNING,
+               table.c.locked_at < datetime.utcnow() - STALE_AFTER)
+        .values(status=ModerationJob.QUEUED, locked_by=None, locked_at=None)
+    ).rowcount
+    db.session.commit()
+    return released
+
+
+def run_job(job_id, lock):
+    """Выполняет взятую задачу: анализ фото и применение результата"""
+    job = db.session.get(ModerationJob, job_id)
+    report = job.report if job else None
+    if job is None:
+        return
+    if report is None or report.deleted_at is not None:
+        _release(job_id, lock, ModerationJob.DONE)
+        db.session.commit()
+        return
+
+    image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], report.photo_path)
+    report_id, photo_hash = report.id, report.photo_hash
+    # Не держим транзакцию открытой, пока ждем модератора
+    db.session.commit()
+
+    try:
+        moderator = get_moderator()
+        remote = prefilter.applies(moderator)
+        # Явно негодные фото (перед vision API) и почти-дубликаты решаются локально
+        result, gate = prefilter.screen(image_path, photo_hash, report_id, check_quality=remote)
+        if result is None:
+            # Повторно отправленное фото берется из кеша по хешу содержимого
+            result = moderation_cache.analyze(moderator, image_path)
+            if remote:
+                result = prefilter.annotate(result, gate)
+    except Exception as exc:
+        db.session.rollback()
+        _retry_or_fail(job_id, lock, exc)
+        db.session.commit()
+        return
+
+    # Задача завершается и результат применяется в одной транзакции — только
+    # если токен захвата все еще наш
+    if not _release(job_id, lock, ModerationJob.DONE):
+        db.session.rollback()
+        print(f"⚠️ Задача модерации #{job_id} перехвачена другим воркером, результат не применен")
+        return
+    apply_result(db.session.get(ModerationJob, job_id).report, result)
+    db.session.commit()
+
+
+def _release(job_id, lock, status, error=None, run_after=None):
+    """
+    Снимает захват задачи, если он все еще принадлежит токену lock, и
+    переводит ее в status. False — задачу уже вернули в очередь или взял
+    другой воркер; тогда вызывающий ничего не применяет.
+    """
+    table = ModerationJob.__table__
+    values = {'status': status, 'last_error': error, 'locked_by': None, 'locked_at': None}
+    if status == ModerationJob.QUEUED:
+        values['run_after'] = run_after
+    else:
+        values['finished_at'] = datetime.utcnow()
+    released = db.session.execute(
+        table.update()
+        .where(table.c.id == job_id, table.c.status == ModerationJob.RUNNING, table.c.locked_by == lock)
+        .values(**values)
+    ).rowcount
+    return released > 0
+
+
+def _retry_or_fail(job_id, lock, exc):
+    job = db.session.get(ModerationJob, job_id)
+    error = f'{type(exc).__name__}: {exc}'
+    print(f"⚠️ Модерация репорта #{job.report_id}, попытка {job.attempts}: {error}")
+    if job.attempts < job.max_attempts:
+        delay = RETRY_BASE_DELAY * 2 ** (job.attempts - 1) + random.uniform(0, RETRY_BASE_DELAY)
+        _release(job_id, lock, ModerationJob.QUEUED, error,
+                 run_after=datetime.utcnow() + timedelta(seconds=delay))
+        return
+    # Попытки исчерпаны — репорт остается pending и уходит на ручную проверку
+    if _release(job_id, lock, ModerationJob.FAILED, error):
+        apply_result(job.report, {
+            'confidence': None,
+            'status': 'needs_review',
+            'analysis': json.dumps({'method': 'queue', 'error': error}),
+        })
+
+
+def apply_result(report, result):
+    """Результат модерации: поля AI, статус, баллы автору и уведомление"""
+    report.ai_confidence = result['confidence']
+    report.ai_status = result['status']
+    report.ai_analysis = result['analysis']
+    if result.get('trash_type'):
+        report.trash_type = result['trash_type']  # Для обратной совместимости
+    if report.status == 'pending' and result['status'] == 'auto_confirmed':
+        report.status = 'confirmed'
+
+    author = report.author
+    if author is None:
+        return
+
+    duplicates = prefilter.duplicate_of(result)
+    if duplicates:
+        # Повторная отправка того же фото баллов не приносит
+        db.session.add(Notification(
+            user_id=author.id,
+            message=f'Ваш репорт #{report.id} похож на ранее отправленный '
+                    f'(#{duplicates[0]}) и передан модератору. Баллы за него не начисляются.',
+            notification_type='report_submitted',
+            related_report_id=report.id
+        ))
+        return
+
+    points = current_app.config['POINTS_CONFIRMED_REPORT']
+    # Дополнительные баллы за GPS и комментарий
+    if report.description:
+        points += current_app.config['POINTS_WITH_GPS_COMMENT']
+    author.add_points(points, 'report_submitted', report_id=report.id)
+    if report.status == 'confirmed':
+        author.confirmed_reports = (author.confirmed_reports or 0) + 1
+
+    db.session.add(Notification(
+        user_id=author.id,
+        message=f'Ваш репорт #{report.id} проверен! Статус: {report.status}. Начислено {points} баллов.',
+        notification_type='report_submitted',
+        related_report_id=report.id
+    ))
+
+
+class ModerationWorker:
+    """Пул потоков, выполняющий задачи очереди (не больше concurrency одновременно)"""
+
+    def __init__(self, app, concurrency=2, poll_interval=POLL_INTERVAL):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix='moderation')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run(self, once=False):
+        """Цикл воркера; once — выйти, когда очередь пуста и задачи завершены"""
+        while not self._stop.is_set():
+            self._dispatch()
+            with self._lock:
+                idle = self._in_flight == 0
+            if once and idle and not self._has_ready_jobs():
+                break
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        self._executor.shutdown(wait=True)
+
+    def _has_ready_jobs(self):
+        with self.app.app_context():
+            return ModerationJob.query.filter(
+                ModerationJob.status == ModerationJob.QUEUED,
+                ModerationJob.run_after <= datetime.utcnow()
+            ).first() is not None
+
+    def _dispatch(self):
+        try:
+            with self.app.app_context():
+                release_stale()
+                while True:
+                    with self._lock:
+                        if self._in_flight >= self.concurrency:
+                            return
+                    claimed = claim_job(self.worker_id)
+                    if claimed is None:
+                        return
+                    with self._lock:
+                        self._in_flight += 1
+                    self._executor.submit(self._process, *claimed)
+        except Exception as exc:
+            print(f"⚠️ Ошибка очереди модерации: {exc}")
+
+    def _process(self, job_id, lock):
+        try:
+            with self.app.app_context():
+                try:
+                    run_job(job_id, lock)
+                except Exception as exc:
+                    db.session.rollback()
+                    print(f"⚠️ Ошибка задачи модерации #{job_id}: {exc}")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._wake.set()
+
+
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def ensure_in_process_worker(app):
+    """Пул модерации внутри веб-воркера (свой у каждого процесса gunicorn)"""
+    global _worker, _worker_pid
+    concurrency = app.config.get('MODERATION_WORKERS', 2)
+    if concurrency <= 0:
+        return None
+    if _worker is not None and _worker_pid == os.getpid():
+        return _worker
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid():
+            _worker = ModerationWorker(app, concurrency)
+            _worker_pid = os.getpid()
+            threading.Thread(target=_worker.run, name='moderation-queue', daemon=True).start()
+    return _worker
+
+
+@after_commit('moderation_jobs')
+def wake_workers(items):
+    worker = ensure_in_process_worker(current_app._get_current_object())
+    if worker is not None:
+        worker.wake()
@@ -0,0 +1,282 @@
+"""
+Устойчивый клиент OpenAI для модерации.
+
+- Пул соединений (httpx) переиспользуется между запросами.
+- Каждый вызов ограничен общим дедлайном; таймаут попытки не выходит за него.
+- Временные ошибки (таймаут, обрыв соединения, 429, 5xx) повторяются с
+  экспоненциальной задержкой и джиттером.
+- Автомат (circuit breaker): после серии неудач вызовы к API прекращаются на
+  reset_timeout секунд и сразу завершаются CircuitOpenError; затем одна
+  пробная попытка решает, закрыть его или открыть снова.
+- stats() — счетчики вызовов, ошибок и задержек этого процесса. Каждый
+  процесс (воркеры gunicorn, flask moderation-worker) раз в PUBLISH_INTERVAL
+  секунд публикует их в общий кеш, cluster_stats() складывает все процессы.
+
+Адрес API задается OPENAI_BASE_URL, поэтому клиент можно проверять против
+локального stub-сервера.
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+from app.shared_cache import shared_cache
+
+try:
+    import httpx
+    from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+    OpenAI = None
+
+
+# Счетчики процесса в общем кеше: ключ на процесс, публикация не чаще PUBLISH_INTERVAL
+STATS_PREFIX = 'openai_stats:'
+PUBLISH_INTERVAL = 5
+# Процесс, который давно не вызывал API (или завершился), выпадает из суммы
+STATS_TTL = 3600
+
+
+class CircuitOpenError(Exception):
+    """API признан недоступным, вызов не выполнялся"""
+
+
+class DeadlineExceeded(Exception):
+    """Не уложились в дедлайн вызова с учетом повторов"""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Можно ли выполнять вызов сейчас (в half_open — только один пробный)"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probe_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientOpenAIClient:
+    def __init__(self, api_key=None, base_url=None, timeout=20.0, deadline=45.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, pool_size=10,
+                 failure_threshold=5, reset_timeout=30):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            'calls': 0, 'successes': 0, 'failures': 0, 'retries': 0,
+            'timeouts': 0, 'circuit_rejections': 0,
+        }
+        self._latencies = deque(maxlen=200)  # секунды последних успешных вызовов
+        self._published_at = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            api_key=os.environ.get('OPENAI_API_KEY'),
+            base_url=os.environ.get('OPENAI_BASE_URL') or None,
+            timeout=float(os.environ.get('OPENAI_TIMEOUT', 20)),
+            deadline=float(os.environ.get('OPENAI_DEADLINE', 45)),
+            max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', 3)),
+            pool_size=int(os.environ.get('OPENAI_POOL_SIZE', 10)),
+            failure_threshold=int(os.environ.get('OPENAI_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.environ.get('OPENAI_BREAKER_RESET', 30)),
+        )
+
+    @property
+    def available(self):
+        return OPENAI_AVAILABLE and bool(self.api_key)
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=self.pool_size,
+                                        max_keepalive_connections=self.pool_size),
+                    timeout=self.timeout
+                )
+                # Повторы делаем сами — встроенные в SDK отключены
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                      http_client=http_client, max_retries=0)
+            return self._client
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counters[name] += 1
+
+    def is_transient(self, exc):
+        """Временная ошибка (таймаут, обрыв, 429, 5xx, дедлайн) — вызов стоит повторить позже"""
+        if isinstance(exc, DeadlineExceeded):
+            return True
+        if isinstance(exc, (APITimeoutError, APIConnectionError, RateLimitError)):
+            return True
+        return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+    def _backoff(self, attempt):
+        # Full jitter: случайная задержка до экспоненциального предела
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def chat_completion(self, **kwargs):
+        """chat.completions.create с дедлайном, повторами и автоматом"""
+        try:
+            return self._chat_completion(**kwargs)
+        finally:
+            self.publish()
+
+    def _chat_completion(self, **kwargs):
+        if not self.breaker.allow():
+            self._count('circuit_rejections')
+            raise CircuitOpenError('OpenAI API временно недоступен')
+
+        self._count('calls')
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count('failures')
+                self.breaker.record_failure()
+                raise DeadlineExceeded(f'Дедлайн {self.deadline}с исчерпан')
+
+            started = time.monotonic()
+            try:
+                response = self._get_client().with_options(
+                    timeout=min(self.timeout, remaining)
+                ).chat.completions.create(**kwargs)
+            except Exception as exc:
+                if isinstance(exc, APITimeoutError):
+                    self._count('timeouts')
+                if not self.is_transient(exc):
+                    # API ответил (4xx и т.п.) — он доступен, автомат не размыкаем
+                    self._count('failures')
+                    self.breaker.record_success()
+                    raise
+                if attempt >= self.max_retries:
+                    self._count('failures')
+                    self.breaker.record_failure()
+                    raise
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    self._count('failures')
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                self._count('retries')
+                time.sleep(delay)
+                continue
+
+            with self._stats_lock:
+                self._counters['successes'] += 1
+                self._latencies.append(time.monotonic() - started)
+            self.breaker.record_success()
+            return response
+
+    def _snapshot(self):
+        with self._stats_lock:
+            return dict(self._counters), sorted(self._latencies)
+
+    def stats(self):
+        """Счетчики и задержки (p50/p95/max, мс) по последним вызовам этого процесса"""
+        counters, latencies = self._snapshot()
+        counters.update({'circuit_state': self.breaker.state, 'latency_ms': latency_summary(latencies)})
+        return counters
+
+    def publish(self, force=False):
+        """Счетчики процесса в общий кеш (не чаще PUBLISH_INTERVAL секунд)"""
+        now = time.monotonic()
+        if not force and now - self._published_at < PUBLISH_INTERVAL:
+            return
+        self._published_at = now
+        counters, latencies = self._snapshot()
+        shared_cache.set(f'{STATS_PREFIX}{socket.gethostname()}:{os.getpid()}', {
+            'counters': counters,
+            'latencies': latencies,
+            'circuit_state': self.breaker.state,
+            'published_at': time.time(),
+        }, ttl=STATS_TTL)
+
+
+def latency_summary(latencies):
+    """p50/p95/max (мс) по отсортированным задержкам в секундах"""
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1)
+
+    return {
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'max': round(latencies[-1] * 1000, 1) if latencies else None,
+    }
+
+
+def cluster_stats(client=None):
+    """
+    Сумма счетчиков всех процессов из общего кеша; состояние автомата — по процессам.
+    client — клиент текущего процесса: его счетчики публикуются перед чтением.
+    """
+    if client is not None:
+        client.publish(force=True)
+    published = shared_cache.get_prefix(STATS_PREFIX)
+    totals = {}
+    latencies = []
+    states = {}
+    for key, entry in published.items():
+        for name, value in entry['counters'].items():
+            totals[name] = totals.get(name, 0) + value
+        latencies.extend(entry['latencies'])
+        states[key[len(STATS_PREFIX):]] = entry['circuit_state']
+    totals.update({
+        'processes': len(published),
+        'circuit_state': states,
+        'latency_ms': latency_summary(sorted(latencies)),
+    })
+    return totals
@@ -0,0 +1,96 @@
+"""
+Keyset (cursor) пагинация по (created_at, id).
+
+Курсор — непрозрачная urlsafe-base64 строка. Страница выбирается условием
+«строго после курсора» по индексу, поэтому глубокие страницы стоят столько же,
+сколько первая: нет ни OFFSET, ни COUNT(*).
+"""
+
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+from app.shared_cache import shared_cache
+
+
+def encode_cursor(created_at, item_id):
+    raw = f'{created_at.isoformat()}|{item_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбирает курсор; None для пустого или поврежденного значения"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, item_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """Страница результата с курсорами соседних страниц"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_page(query, model, per_page, after=None, before=None):
+    """
+    Страница query в порядке (created_at DESC, id DESC).
+
+    after  — курсор последнего элемента предыдущей страницы (листаем вперед);
+    before — курсор первого элемента следующей страницы (листаем назад).
+    """
+    created_col, id_col = model.created_at, model.id
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before:
+        created_at, item_id = before
+        rows = query.filter(or_(
+            created_col > created_at,
+            and_(created_col == created_at, id_col > item_id)
+        )).order_by(created_col.asc(), id_col.asc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_prev, has_next = has_more, True
+    else:
+        if after:
+            created_at, item_id = after
+            query = query.filter(or_(
+                created_col < created_at,
+                and_(created_col == created_at, id_col < item_id)
+            ))
+        rows = query.order_by(created_col.desc(), id_col.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev, has_next = after is not None, len(rows) > per_page
+
+    if not items:
+        return KeysetPage(items)
+
+    first, last = items[0], items[-1]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(last.created_at, last.id) if has_next else None,
+        prev_cursor=encode_cursor(first.created_at, first.id) if has_prev else None
+    )
+
+
+def approximate_count(key, query, ttl=60):
+    """
+    COUNT(*) запроса, закешированный на ttl секунд в общем кеше воркеров.
+    Ключ может содержать значения из запроса: число записей кеша ограничено
+    его max_entries, а не числом разных фильтров.
+    """
+    return shared_cache.cached(f'count:{key}', lambda: query.order_by(None).count(), ttl)
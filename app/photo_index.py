@@ -0,0 +1,154 @@
+"""
+Индекс почти-дубликатов фото по перцептивному хешу.
+
+Для фото считается 64-битный dHash (Report.photo_hash, hex). Поиск «все
+репорты на расстоянии Хэмминга ≤ k» идет через multi-index hashing: хеш
+делится на BANDS полос по 16 бит, каждая полоса хранится строкой в
+photo_hash_bands с индексом (band, value). Если два хеша отличаются не
+больше чем на k бит, то хотя бы в одной полосе они отличаются не больше
+чем на k // BANDS бит (принцип Дирихле). Поэтому достаточно найти по индексу
+репорты, у которых какая-то полоса совпадает с точностью до k // BANDS бит,
+и проверить полное расстояние только у этих кандидатов. При 10^6 фото
+на полосу приходится в среднем ~15 совпадений на вариант значения,
+а не полный перебор.
+
+Однотонные и очень темные фото дают хеш почти из одних нулей (или единиц):
+все такие фото «похожи» друг на друга. Хеши, где единиц меньше MIN_HASH_BITS
+(или нулей меньше MIN_HASH_BITS), не индексируются и не ищутся.
+"""
+
+import os
+from itertools import combinations
+from flask import current_app
+from PIL import Image, ImageOps
+from app.image_io import open_pil
+from app import db
+from app.models import PhotoHashBand, Report
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+MIN_HASH_BITS = 8
+
+
+def compute_hash(image_path):
+    """64-битный dHash: знаки разностей соседних пикселей уменьшенного 9x8 серого фото"""
+    # JPEG декодируется сразу в уменьшенном масштабе
+    with open_pil(image_path, (64, 64), mode='L') as image:
+        image = ImageOps.exif_transpose(image).convert('L')
+        pixels = list(image.resize((9, 8), Image.LANCZOS).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hash_file(image_path):
+    """Hex-хеш фото или None, если файл не читается"""
+    try:
+        return to_hex(compute_hash(image_path))
+    except Exception as exc:
+        print(f"⚠️ Не удалось посчитать хеш фото {image_path}: {exc}")
+        return None
+
+
+def to_hex(value):
+    return f'{value:016x}'
+
+
+def from_hex(photo_hash):
+    return int(photo_hash, 16) if isinstance(photo_hash, str) else photo_hash
+
+
+def hamming(a, b):
+    return bin(from_hex(a) ^ from_hex(b)).count('1')
+
+
+def informative(photo_hash):
+    """Достаточно ли в хеше и единиц, и нулей, чтобы сравнивать фото"""
+    ones = bin(from_hex(photo_hash)).count('1')
+    return MIN_HASH_BITS <= ones <= HASH_BITS - MIN_HASH_BITS
+
+
+def split_bands(photo_hash):
+    value = from_hex(photo_hash)
+    return [(band, (value >> (band * BAND_BITS)) & BAND_MASK) for band in range(BANDS)]
+
+
+def _variants(value, radius):
+    """Все значения полосы на расстоянии ≤ radius от value"""
+    yield value
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+def add(report_id, photo_hash):
+    """Добавляет полосы хеша репорта в индекс (коммит — за вызывающим)"""
+    if not informative(photo_hash):
+        return
+    for band, value in split_bands(photo_hash):
+        db.session.add(PhotoHashBand(report_id=report_id, band=band, value=value))
+
+
+def near_duplicates(photo_hash, max_distance=None, exclude_id=None, limit=10):
+    """[(id репорта, расстояние)] неудаленных репортов не дальше max_distance, ближайшие первыми"""
+    if not photo_hash or not informative(photo_hash):
+        return []
+    if max_distance is None:
+        max_distance = current_app.config.get('DUPLICATE_MAX_DISTANCE', 5)
+    radius = max_distance // BANDS
+
+    conditions = [
+        db.and_(PhotoHashBand.band == band, PhotoHashBand.value.in_(list(_variants(value, radius))))
+        for band, value in split_bands(photo_hash)
+    ]
+    candidates = db.session.query(PhotoHashBand.report_id).filter(db.or_(*conditions)).distinct().subquery()
+
+    query = db.session.query(Report.id, Report.photo_hash).filter(
+        Report.id.in_(db.select(candidates.c.report_id)),
+        Report.deleted_at.is_(None)
+    )
+    if exclude_id is not None:
+        query = query.filter(Report.id != exclude_id)
+
+    matches = []
+    for report_id, candidate_hash in query:
+        if not candidate_hash:
+            continue
+        distance = hamming(photo_hash, candidate_hash)
+        if distance <= max_distance:
+            matches.append((report_id, distance))
+    matches.sort(key=lambda match: (match[1], match[0]))
+    return matches[:limit]
+
+
+def backfill(batch_size=200):
+    """Хеши и полосы для репортов, загруженных до появления индекса"""
+    indexed = 0
+    last_id = 0
+    while True:
+        reports = Report.query.filter(
+            Report.id > last_id,
+            Report.photo_hash.is_(None),
+            Report.photo_path.isnot(None)
+        ).order_by(Report.id).limit(batch_size).all()
+        if not reports:
+            break
+        for report in reports:
+            last_id = report.id
+            photo_hash = hash_file(os.path.join(current_app.config['UPLOAD_FOLDER'], report.photo_path))
+            if photo_hash:
+                report.photo_hash = photo_hash
+                add(report.id, photo_hash)
+                indexed += 1
+        db.session.commit()
+    return indexed
@@ -0,0 +1,78 @@
+"""
+Журнал баллов (points_ledger) и пересчет балансов по нему.
+
+Каждое начисление и списание — строка журнала (User.add_points /
+User.spend_points), а баланс, общий счет и уровень пользователя меняются в
+транзакции вызывающего кода. Балансы можно в любой момент пересчитать,
+переиграв журнал по порядку с теми же правилами, что и User.add_points.
+"""
+
+from sqlalchemy import bindparam, func, insert, literal, select
+from app import db
+from app.models import PointsEntry, User, level_for
+from app.report_hooks import collect
+
+
+def seed_opening_balances():
+    """
+    Входящие остатки для баз, созданных до появления журнала: начисление на
+    total_points и списание на points_spent каждого пользователя.
+    Вызывается, только пока журнал пуст.
+    """
+    users = User.__table__
+    ledger = PointsEntry.__table__
+    columns = ['user_id', 'amount', 'kind', 'reason', 'created_at']
+
+    earned = db.session.execute(insert(ledger).from_select(columns, select(
+        users.c.id, users.c.total_points, literal(PointsEntry.EARN),
+        literal('opening_balance'), func.current_timestamp()
+    ).where(func.coalesce(users.c.total_points, 0) > 0))).rowcount
+    db.session.execute(insert(ledger).from_select(columns, select(
+        users.c.id, -users.c.points_spent, literal(PointsEntry.SPEND),
+        literal('opening_balance'), func.current_timestamp()
+    ).where(func.coalesce(users.c.points_spent, 0) > 0)))
+    db.session.commit()
+    return earned
+
+
+def recompute_balances():
+    """
+    Пересчет total_points, points_spent, points_balance и level всех
+    пользователей по журналу. Записи переигрываются в порядке id, как их
+    применяли add_points/spend_points: штраф не опускает total_points и
+    баланс ниже нуля, поэтому простая сумма журнала разошлась бы с ними.
+    """
+    users = User.__table__
+    ledger = PointsEntry.__table__
+
+    balances = {user_id: [0, 0, 0] for user_id in db.session.execute(select(users.c.id)).scalars()}
+    entries = db.session.execute(
+        select(ledger.c.user_id, ledger.c.amount, ledger.c.kind)
+        .order_by(ledger.c.user_id, ledger.c.id)
+        .execution_options(yield_per=1000)
+    )
+    for user_id, amount, kind in entries:
+        state = balances.get(user_id)
+        if state is None:
+            continue
+        if kind == PointsEntry.SPEND:
+            state[1] += amount
+            state[2] -= amount
+        else:
+            state[0] = max(state[0] + amount, 0)
+            state[1] = max(state[1] + amount, 0)
+
+    if balances:
+        db.session.execute(
+            users.update().where(users.c.id == bindparam('user_id')).values(
+                total_points=bindparam('total'), points_balance=bindparam('balance'),
+                points_spent=bindparam('spent'), level=bindparam('user_level')
+            ),
+            [{'user_id': user_id, 'total': total, 'balance': balance,
+              'spent': spent, 'user_level': level_for(total)}
+             for user_id, (total, balance, spent) in balances.items()]
+        )
+    # Core-UPDATE не вызывает события модели — кеши лидерборда и рейтинга сбрасываем сами
+    collect('response_cache', 'leaderboard', 'stats')
+    db.session.commit()
+    return len(balances)
@@ -0,0 +1,127 @@
+"""
+Дешевый локальный фильтр фото перед вызовом vision API.
+
+По серой миниатюре (JPEG декодируется сразу уменьшенным) считаются размер,
+яркость и резкость (дисперсия лапласиана), а по индексу хешей — похожие
+фото. Явно негодные фото получают результат без обращения к API:
+
+- почти черные и крошечные — rejected;
+- пересвеченные, размытые и почти-дубликаты — needs_review (решает модератор).
+
+Остальные уходят в vision API. Решение фильтра (и метрики) записывается в
+ai_analysis в поле prefilter — и для отсеянных фото, и для пропущенных.
+Проверки качества применяются только к удаленному модератору (OpenAI):
+локальный OpenCV-модератор сам проверяет качество, а вызов API стоит денег и
+времени. Почти-дубликаты уходят на ручную проверку при любом модераторе, и баллы
+за них не начисляются — иначе повторная отправка того же фото приносила бы
+баллы.
+"""
+
+import json
+import numpy as np
+from PIL import ImageOps
+from flask import current_app
+from app import photo_index
+from app.image_io import open_pil
+
+THUMBNAIL_EDGE = 256
+
+
+def applies(moderator):
+    from app.ai_moderator_openai import OpenAIModeratorService
+    return current_app.config.get('PREFILTER_ENABLED', True) and isinstance(moderator, OpenAIModeratorService)
+
+
+def measure(image_path):
+    """Размер исходного фото, яркость и резкость серой миниатюры"""
+    with open_pil(image_path) as image:
+        # Размер исходного фото — до draft, который уменьшает JPEG при декодировании
+        width, height = image.size
+        image.draft('L', (THUMBNAIL_EDGE, THUMBNAIL_EDGE))
+        thumbnail = ImageOps.exif_transpose(image).convert('L')
+        thumbnail.thumbnail((THUMBNAIL_EDGE, THUMBNAIL_EDGE))
+        gray = np.asarray(thumbnail, dtype=np.float32)
+
+    # Лапласиан 4-связный: соседи минус 4 * центр
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4 * gray[1:-1, 1:-1])
+    return {
+        'width': width,
+        'height': height,
+        'brightness': round(float(gray.mean()), 1),
+        'sharpness': round(float(laplacian.var()), 1) if laplacian.size else 0.0,
+    }
+
+
+def decide(metrics, duplicates):
+    """(статус, причина) для явно негодного фото или (None, None); без metrics — только дубликаты"""
+    config = current_app.config
+    if metrics:
+        if min(metrics['width'], metrics['height']) < config.get('PREFILTER_MIN_EDGE', 200):
+            return 'rejected', 'tiny'
+        if metrics['brightness'] < config.get('PREFILTER_MIN_BRIGHTNESS', 15):
+            return 'rejected', 'black'
+        if metrics['brightness'] > config.get('PREFILTER_MAX_BRIGHTNESS', 245):
+            return 'needs_review', 'overexposed'
+        if metrics['sharpness'] < config.get('PREFILTER_MIN_SHARPNESS', 20):
+            return 'needs_review', 'blurry'
+    if duplicates:
+        return 'needs_review', 'duplicate'
+    return None, None
+
+
+def screen(image_path, photo_hash=None, report_id=None, check_quality=True):
+    """
+    Проверяет фото перед модератором: качество (если check_quality) и дубликаты.
+    Возвращает (результат модерации или None, запись о решении для ai_analysis).
+    """
+    metrics = {}
+    if check_quality:
+        try:
+            metrics = measure(image_path)
+        except Exception as exc:
+            # Фото не читается локально — пусть решает API (и его обработка ошибок)
+            return None, {'decision': 'pass', 'error': f'{type(exc).__name__}: {exc}'}
+
+    duplicates = photo_index.near_duplicates(photo_hash, exclude_id=report_id) if photo_hash else []
+    if report_id is not None:
+        # Дубликатом считается только более поздний репорт, оригинал проверяет API
+        duplicates = [match for match in duplicates if match[0] < report_id]
+    status, reason = decide(metrics, duplicates)
+    gate = dict(metrics, decision=status or 'pass')
+    if reason:
+        gate['reason'] = reason
+    if duplicates:
+        gate['duplicate_of'] = [duplicate_id for duplicate_id, _ in duplicates]
+    if status is None:
+        return None, gate
+
+    return {
+        'confidence': 0.0 if status == 'rejected' else None,
+        'status': status,
+        'analysis': json.dumps({'method': 'prefilter', 'prefilter': gate}, ensure_ascii=False),
+        'trash_detected': False,
+        'trash_type': None
+    }, gate
+
+
+def duplicate_of(result):
+    """id более ранних репортов с тем же фото по решению фильтра ([] — не дубликат)"""
+    try:
+        analysis = json.loads(result.get('analysis') or '{}')
+    except ValueError:
+        return []
+    gate = analysis.get('prefilter') if isinstance(analysis, dict) else None
+    return gate.get('duplicate_of', []) if isinstance(gate, dict) else []
+
+
+def annotate(result, gate):
+    """Добавляет решение фильтра в ai_analysis результата API"""
+    try:
+        analysis = json.loads(result['analysis']) if result.get('analysis') else {}
+    except ValueError:
+        analysis = {'raw': result['analysis']}
+    if not isinstance(analysis, dict):
+        analysis = {'raw': analysis}
+    analysis['prefilter'] = gate
+    return dict(result, analysis=json.dumps(analysis, ensure_ascii=False))
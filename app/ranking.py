@@ -0,0 +1,80 @@
+"""
+Сервис мест в рейтинге пользователей.
+
+Место = 1 + число пользователей с большим total_points. Вместо COUNT(*) по
+всей таблице используется гистограмма баллов по корзинам: пользователи из
+более высоких корзин суммируются по префиксным суммам (бинарный поиск), а
+внутри своей корзины считаются диапазонным запросом по индексу
+users.total_points.
+
+Гистограмма хранится в общем кеше воркеров под тегом leaderboard: тег
+сбрасывается после коммита, изменившего total_points (response_cache), и
+после пересчета балансов, а TTL ограничивает расхождение, если изменение
+прошло мимо ORM. В пределах TTL место может быть приблизительным.
+"""
+
+import bisect
+from sqlalchemy import func
+from app import db
+from app.models import User
+from app.shared_cache import shared_cache
+
+BUCKET_SIZE = 50
+
+
+class RankService:
+    def __init__(self, bucket_size=BUCKET_SIZE, ttl=300):
+        self.bucket_size = bucket_size
+        self.ttl = ttl
+
+    def _bucket(self, points):
+        return max(points or 0, 0) // self.bucket_size
+
+    def _build_histogram(self):
+        """(корзины по возрастанию, suffix): suffix[i] — пользователей в корзинах buckets[i:]"""
+        bucket = func.coalesce(User.total_points, 0) / self.bucket_size
+        rows = db.session.query(bucket, func.count(User.id)).group_by(bucket).all()
+        counts = {int(b): int(c) for b, c in rows if c}
+        buckets = sorted(counts)
+        suffix = [0] * (len(buckets) + 1)
+        for i in range(len(buckets) - 1, -1, -1):
+            suffix[i] = suffix[i + 1] + counts[buckets[i]]
+        return buckets, suffix
+
+    def _histogram(self):
+        return shared_cache.cached(
+            f'rank:histogram:{self.bucket_size}', self._build_histogram,
+            ttl=self.ttl, tags=('leaderboard',)
+        )
+
+    def _suffix_above(self, bucket):
+        """Пользователей в корзинах строго выше bucket"""
+        buckets, suffix = self._histogram()
+        return suffix[bisect.bisect_right(buckets, bucket)]
+
+    def rank_of(self, user):
+        """Место пользователя в общем рейтинге (1 — лидер)"""
+        points = user.total_points or 0
+        bucket = self._bucket(points)
+        same_bucket_above = User.query.filter(
+            User.total_points > points,
+            User.total_points < (bucket + 1) * self.bucket_size
+        ).count()
+        return self._suffix_above(bucket) + same_bucket_above + 1
+
+    def around(self, user, radius=2):
+        """Соседи по рейтингу: до radius пользователей выше и ниже"""
+        points = user.total_points or 0
+        above = User.query.filter(
+            User.id != user.id,
+            User.total_points >= points
+        ).order_by(User.total_points.asc(), User.id.asc()).limit(radius).all()
+        below = User.query.filter(
+            User.id != user.id,
+            User.total_points < points
+        ).order_by(User.total_points.desc(), User.id.asc()).limit(radius).all()
+        return list(reversed(above)) + [user] + below
+
+
+# Singleton instance
+rank_service = RankService()
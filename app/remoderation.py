@@ -0,0 +1,211 @@
+"""
+Повторная модерация архива репортов (`flask remoderate`).
+
+Нужна после смены порогов или модератора (local <-> openai): репорты идут
+по возрастанию id пачками, фото каждой пачки анализируются параллельно
+(локальный модератор — пулом процессов analyze_batch, OpenAI — пулом
+потоков, т.к. там ожидание сети; явно негодные фото до API не доходят,
+см. prefilter), а ai_confidence/ai_status/ai_analysis
+записываются одной транзакцией на пачку. Статус репорта и баллы не меняются.
+
+После каждой пачки в instance/remoderate.json сохраняется последний
+обработанный id, поэтому прерванный прогон продолжается с того же места.
+Фото, анализ которых упал (429, 5xx, таймауты OpenAI) или не выполнялся
+из-за открытого автомата, не останавливают прогон: их id копятся в
+checkpoint и повторяются в конце прогона и при следующем запуске. Если
+оценки AI нет, прежние ai_* репорта не затираются.
+Кеш модерации не используется: в его ключе нет порогов.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app import db, prefilter
+from app.models import Report
+from app.moderation_queue import get_moderator
+
+CHECKPOINT_FILE = 'remoderate.json'
+
+
+def checkpoint_path():
+    return os.path.join(current_app.instance_path, CHECKPOINT_FILE)
+
+
+def load_checkpoint(backend):
+    """Сохраненный прогон того же модератора или None"""
+    try:
+        with open(checkpoint_path()) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get('backend') != backend:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint):
+    # instance/ в репозитории нет, при первом прогоне его создаем
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    path = checkpoint_path()
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoint():
+    try:
+        os.remove(checkpoint_path())
+    except OSError:
+        pass
+
+
+def analyze_paths(moderator, paths, workers):
+    """Результаты модератора в порядке paths; None — анализ фото упал"""
+    if hasattr(moderator, 'analyze_batch'):
+        return moderator.analyze_batch(paths, workers=workers)
+    app = current_app._get_current_object()
+
+    def analyze(path):
+        # Настройки модератора (размер копии для vision и т.п.) читаются из app.config
+        with app.app_context():
+            try:
+                return moderator.analyze_image(path)
+            except Exception as exc:
+                # Временные ошибки OpenAI (429, 5xx, дедлайн) — после повторов клиента;
+                # остальные фото пачки анализируются дальше
+                print(f"⚠️ Не удалось проанализировать {path}: {type(exc).__name__}: {exc}")
+                return None
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(analyze, paths))
+
+
+def screen_and_analyze(moderator, todo, workers):
+    """Результаты для [(репорт, путь)]; явно негодные фото отсеивает prefilter до vision API"""
+    if not prefilter.applies(moderator):
+        return analyze_paths(moderator, [path for _, path in todo], workers)
+
+    results = [None] * len(todo)
+    gates = {}
+    for index, (item, path) in enumerate(todo):
+        results[index], gates[index] = prefilter.screen(path, item.photo_hash, item.id)
+    remote = [index for index, result in enumerate(results) if result is None]
+    for index, result in zip(remote, analyze_paths(moderator, [todo[index][1] for index in remote], workers)):
+        if result is not None:
+            results[index] = prefilter.annotate(result, gates[index])
+    return results
+
+
+def outcome(result):
+    """'done' — записать результат, 'retry' — повторить позже, 'skip' — оставить репорт как есть"""
+    if result is None:
+        return 'retry'
+    if result['confidence'] is None:
+        try:
+            analysis = json.loads(result['analysis'] or '{}')
+        except ValueError:
+            analysis = {}
+        if isinstance(analysis, dict) and analysis.get('method') == 'unavailable':
+            # Оценки AI нет: прежние ai_* не затираем. Открытый автомат — временно
+            return 'retry' if analysis.get('reason') == 'circuit_open' else 'skip'
+    return 'done'
+
+
+def process(moderator, reports, checkpoint, workers, upload_folder):
+    """Анализирует пачку и записывает результаты; id неудавшихся фото — в checkpoint['retry']"""
+    # Фото в очереди модерации и файлы, которых нет на диске, пропускаем
+    todo = []
+    for item in reports:
+        path = os.path.join(upload_folder, item.photo_path) if item.photo_path else None
+        if item.ai_status == 'queued' or not path or not os.path.exists(path):
+            checkpoint['skipped'] += 1
+        else:
+            todo.append((item, path))
+
+    results = screen_and_analyze(moderator, todo, workers)
+    done = 0
+    for (item, _), result in zip(todo, results):
+        state = outcome(result)
+        if state == 'retry':
+            checkpoint['retry'].append(item.id)
+            continue
+        if state == 'skip':
+            checkpoint['skipped'] += 1
+            continue
+        item.ai_confidence = result['confidence']
+        item.ai_status = result['status']
+        item.ai_analysis = result['analysis']
+        done += 1
+    checkpoint['processed'] += done
+    return done
+
+
+def retry_failed(moderator, checkpoint, batch_size, workers, upload_folder):
+    """Еще один проход по фото, анализ которых упал; возвращает число перемодерированных"""
+    pending, checkpoint['retry'] = checkpoint['retry'], []
+    done = 0
+    for offset in range(0, len(pending), batch_size):
+        ids = pending[offset:offset + batch_size]
+        reports = Report.query.filter(Report.id.in_(ids), Report.deleted_at.is_(None)).order_by(Report.id).all()
+        done += process(moderator, reports, checkpoint, workers, upload_folder)
+        # Еще не повторенные id остаются в checkpoint на случай прерывания
+        saved = dict(checkpoint, retry=checkpoint['retry'] + pending[offset + batch_size:])
+        db.session.commit()
+        save_checkpoint(saved)
+    return done
+
+
+def remoderate(backend, batch_size=200, workers=None, restart=False, log=print):
+    """Перемодерирует неудаленные репорты; возвращает итоговый checkpoint"""
+    moderator = get_moderator(backend)
+    workers = workers or os.cpu_count() or 1
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+
+    checkpoint = None if restart else load_checkpoint(backend)
+    if checkpoint:
+        checkpoint.setdefault('retry', [])
+        log(f"↩️ Продолжаем с репорта #{checkpoint['last_id'] + 1} "
+            f"(уже обработано {checkpoint['processed']}, к повтору {len(checkpoint['retry'])})")
+    else:
+        checkpoint = {'backend': backend, 'last_id': 0, 'processed': 0, 'skipped': 0, 'retry': []}
+
+    started = time.monotonic()
+    done_now = 0
+    if checkpoint['retry']:
+        # Фото, упавшие в прошлом запуске
+        done_now += retry_failed(moderator, checkpoint, batch_size, workers, upload_folder)
+
+    while True:
+        reports = Report.query.filter(
+            Report.id > checkpoint['last_id'],
+            Report.deleted_at.is_(None)
+        ).order_by(Report.id).limit(batch_size).all()
+        if not reports:
+            break
+
+        done_now += process(moderator, reports, checkpoint, workers, upload_folder)
+        checkpoint['last_id'] = reports[-1].id
+        db.session.commit()
+        save_checkpoint(checkpoint)
+
+        elapsed = time.monotonic() - started
+        log(f"⏳ До #{checkpoint['last_id']}: {checkpoint['processed']} обработано, "
+            f"{checkpoint['skipped']} пропущено, {len(checkpoint['retry'])} к повтору, "
+            f"{done_now / elapsed if elapsed else 0:.1f} фото/с")
+
+    if checkpoint['retry']:
+        done_now += retry_failed(moderator, checkpoint, batch_size, workers, upload_folder)
+    if checkpoint['retry']:
+        # Неудавшиеся фото повторит следующий запуск
+        save_checkpoint(checkpoint)
+        log(f"⚠️ Не удалось перемодерировать {len(checkpoint['retry'])} фото, "
+            f"запустите команду еще раз")
+    else:
+        clear_checkpoint()
+    elapsed = time.monotonic() - started
+    checkpoint['seconds'] = round(elapsed, 1)
+    checkpoint['rate'] = round(done_now / elapsed, 1) if elapsed else 0
+    return checkpoint
@@ -0,0 +1,123 @@
+"""
+Хуки изменений репортов.
+
+Агрегаты (кластеры карты и т.п.) обновляются инкрементально в той же
+транзакции, что и сам репорт. Обработчик регистрируется декоратором
+@on_report_change и получает (connection, old, new), где old/new — снимки
+репорта до и после изменения (None для вставки).
+
+Побочные эффекты вне БД (удаление файлов кеша и т.п.) откладываются до
+коммита: обработчик накапливает значения через collect(), а функция,
+зарегистрированная @after_commit, получает их только после успешного коммита.
+"""
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Report
+
+# Поля репорта, от которых зависят агрегаты
+TRACKED_FIELDS = (
+    'status', 'deleted_at', 'latitude', 'longitude',
+    'district', 'report_category', 'trash_type', 'created_at', 'user_id'
+)
+
+_handlers = []
+_commit_handlers = {}
+
+_PENDING_KEY = 'report_hooks_pending'
+
+
+def on_report_change(handler):
+    """Регистрирует обработчик изменений репортов"""
+    _handlers.append(handler)
+    return handler
+
+
+def after_commit(name):
+    """Регистрирует обработчик значений, накопленных под именем name"""
+    def decorator(handler):
+        _commit_handlers[name] = handler
+        return handler
+    return decorator
+
+
+def collect(name, *items):
+    """Откладывает значения до коммита текущей сессии"""
+    pending = db.session.info.setdefault(_PENDING_KEY, {})
+    pending.setdefault(name, set()).update(items)
+
+
+def _make_snapshot(report_id, values):
+    return {
+        'id': report_id,
+        'status': values['status'],
+        'deleted': values['deleted_at'] is not None or values['status'] == 'deleted',
+        'latitude': values['latitude'],
+        'longitude': values['longitude'],
+        'district': values['district'],
+        'category': values['report_category'] or values['trash_type'] or 'trash',
+        'created_at': values['created_at'],
+        'user_id': values['user_id'],
+    }
+
+
+def _current_snapshot(target):
+    return _make_snapshot(target.id, {name: getattr(target, name) for name in TRACKED_FIELDS})
+
+
+def _previous_snapshot(connection, target):
+    """Снимок репорта до изменения (по истории атрибутов или из БД)"""
+    state = inspect(target)
+    values = {}
+    for name in TRACKED_FIELDS:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.added:
+            # Старое значение не было загружено — читаем строку до UPDATE
+            table = Report.__table__
+            row = connection.execute(
+                select(*[table.c[field] for field in TRACKED_FIELDS]).where(table.c.id == target.id)
+            ).mappings().first()
+            return _make_snapshot(target.id, row) if row else None
+        else:
+            values[name] = getattr(target, name)
+    return _make_snapshot(target.id, values)
+
+
+def _dispatch(connection, old, new):
+    for handler in _handlers:
+        handler(connection, old, new)
+
+
+@event.listens_for(Report, 'after_insert')
+def _report_inserted(mapper, connection, target):
+    _dispatch(connection, None, _current_snapshot(target))
+
+
+@event.listens_for(Report, 'before_update')
+def _report_updated(mapper, connection, target):
+    old = _previous_snapshot(connection, target)
+    new = _current_snapshot(target)
+    if old != new:
+        _dispatch(connection, old, new)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_commit_handlers(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    for name, items in pending.items():
+        handler = _commit_handlers.get(name)
+        if handler:
+            try:
+                handler(items)
+            except Exception as exc:
+                print(f"⚠️ Ошибка обработчика {name}: {exc}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop(_PENDING_KEY, None)
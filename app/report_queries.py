@@ -0,0 +1,52 @@
+"""
+Общий слой запросов для списков репортов.
+
+Списки выбирают только нужные колонки, имя автора получают одним JOIN
+(без ленивой загрузки r.author на каждую строку) и не тянут большие
+текстовые поля, которые в списках не показываются.
+"""
+
+from sqlalchemy import case, or_
+from sqlalchemy.orm import defer, joinedload
+from app.models import Report, User
+
+ANONYMOUS_NAME = 'Аноним'
+
+# Колонки, которых хватает карте и дельта-ленте
+MAP_COLUMNS = (
+    Report.id, Report.created_at, Report.updated_at, Report.deleted_at,
+    Report.latitude, Report.longitude, Report.address, Report.district,
+    Report.description, Report.photo_path, Report.trash_type, Report.report_category,
+    Report.status, Report.ai_confidence, Report.is_anonymous, Report.upvotes
+)
+
+
+def author_name_column():
+    """Отображаемое имя автора с учетом анонимности (для JOIN с users)"""
+    return case(
+        (or_(
+            User.id.is_(None),
+            Report.is_anonymous.is_(True),
+            User.is_anonymous_display.is_(True)
+        ), ANONYMOUS_NAME),
+        else_=User.username
+    ).label('author_name')
+
+
+def map_rows(query):
+    """Проекция запроса по Report на MAP_COLUMNS + author_name одним запросом"""
+    return query.outerjoin(User, User.id == Report.user_id)\
+        .with_entities(*MAP_COLUMNS, author_name_column())
+
+
+def report_list(query, with_author=False, with_description=True):
+    """
+    Опции загрузки для HTML-списков: ai_analysis и moderation_comment
+    откладываются, автор (если нужен шаблону) подгружается тем же запросом.
+    """
+    options = [defer(Report.ai_analysis), defer(Report.moderation_comment)]
+    if not with_description:
+        options.append(defer(Report.description))
+    if with_author:
+        options.append(joinedload(Report.author))
+    return query.options(*options)
@@ -0,0 +1,124 @@
+"""
+Кеш готовых ответов публичных страниц и API.
+
+Ответ кешируется по (маршрут, аргументы, Accept) с TTL в общем кеше
+воркеров (app.shared_cache). Каждая запись помечается тегами (reports, stats,
+leaderboard, report:<id>, district:<район>). Изменения репортов и
+пользователей собирают теги через report_hooks.collect(), и после коммита
+записи с этими тегами устаревают во всех воркерах — вручную сбрасывать кеш
+в маршрутах не нужно.
+
+HTML-страницы кешируются только для анонимных посетителей без flash-сообщений:
+для них шаблон не зависит от пользователя.
+"""
+
+from functools import wraps
+from flask import current_app, request, session, Response
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from app.models import Report, User
+from app.report_hooks import collect, after_commit
+from app.shared_cache import shared_cache
+
+# Поля, изменение которых не влияет на закешированные ответы
+IGNORED_REPORT_FIELDS = {'views_count', 'updated_at'}
+USER_FIELDS = ('total_points', 'reports_count', 'confirmed_reports', 'level', 'username', 'is_anonymous_display')
+
+# Заголовки, которые нельзя отдавать другим посетителям
+PRIVATE_HEADERS = {'set-cookie'}
+
+
+def _cacheable(anonymous_only):
+    if request.method != 'GET':
+        return False
+    if not current_app.config.get('RESPONSE_CACHE_ENABLED', True):
+        return False
+    if anonymous_only and (current_user.is_authenticated or session.get('_flashes')):
+        return False
+    return True
+
+
+def _cache_key():
+    return f'response:{request.script_root}{request.full_path}|{request.headers.get("Accept", "")}'
+
+
+def cached_response(*tags, ttl=None, anonymous_only=False):
+    """
+    Кеширует ответ маршрута. tags — строки или функции от аргументов
+    маршрута, возвращающие тег (например, lambda report_id: f'report:{report_id}').
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _cacheable(anonymous_only):
+                return view(*args, **kwargs)
+
+            key = _cache_key()
+            entry = shared_cache.get(key)
+            if entry is not None:
+                body, status, headers = entry
+                response = Response(body, status=status, headers=headers)
+                etag, _ = response.get_etag()
+                if etag and request.if_none_match.contains(etag):
+                    return Response(status=304, headers={'ETag': response.headers['ETag']})
+                return response
+
+            entry_tags = set()
+            for tag in tags:
+                tag = tag(**kwargs) if callable(tag) else tag
+                if tag:
+                    entry_tags.add(tag)
+            # Версии тегов до выполнения маршрута: изменение во время рендера не закешируется
+            versions = shared_cache.tag_versions(entry_tags)
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                headers = [(name, value) for name, value in response.headers
+                           if name.lower() not in PRIVATE_HEADERS]
+                shared_cache.set(
+                    key, (response.get_data(), response.status_code, headers),
+                    ttl or current_app.config.get('RESPONSE_CACHE_TTL', 60),
+                    entry_tags, versions
+                )
+            return response
+        return wrapper
+    return decorator
+
+
+def report_list_tag():
+    """Список с фильтром по району зависит только от репортов этого района"""
+    district = request.args.get('district')
+    return f'district:{district}' if district else 'reports'
+
+
+def report_tags(report_id, *districts):
+    tags = {'reports', 'stats', 'leaderboard', f'report:{report_id}'}
+    tags.update(f'district:{district}' for district in districts if district)
+    return tags
+
+
+@event.listens_for(Report, 'after_insert')
+def _report_inserted(mapper, connection, target):
+    collect('response_cache', *report_tags(target.id, target.district))
+
+
+@event.listens_for(Report, 'after_update')
+def _report_updated(mapper, connection, target):
+    state = inspect(target)
+    changed = {prop.key for prop in mapper.column_attrs if state.attrs[prop.key].history.has_changes()}
+    if not changed - IGNORED_REPORT_FIELDS:
+        return
+    districts = [target.district] + list(state.attrs.district.history.deleted)
+    collect('response_cache', *report_tags(target.id, *districts))
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in USER_FIELDS):
+        collect('response_cache', 'leaderboard', 'stats')
+
+
+@after_commit('response_cache')
+def drop_responses(tags):
+    shared_cache.invalidate_tags(*tags)
@@ -0,0 +1,182 @@
+"""
+Почасовые и посуточные роллапы репортов.
+
+report_rollups хранит число репортов, созданных в интервале, по
+(район, категория, текущий статус). Таблица обновляется инкрементально через
+report_hooks (создание репорта, смена статуса, мягкое удаление), поэтому
+статистика за любой период читается одним диапазонным запросом по
+(granularity, bucket), без COUNT по reports на каждый день. Короткие периоды
+(до HOURLY_MAX_DAYS суток) строятся по почасовым роллапам, длинные — по
+суточным. Готовые ряды и разбивки хранятся в общем кеше воркеров под тегом stats.
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from app.models import Report, ReportRollup
+from app.report_hooks import on_report_change
+from app.shared_cache import shared_cache
+
+DELETED = 'deleted'
+GRANULARITIES = ('hour', 'day')
+
+# Допустимая длина периода статистики (дней)
+MAX_DAYS = 3660
+# Периоды не длиннее этого показываются по часам
+HOURLY_MAX_DAYS = 2
+
+DistrictStat = namedtuple('DistrictStat', 'district total cleaned')
+CategoryStat = namedtuple('CategoryStat', 'category count')
+
+
+def truncate(moment, granularity):
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _keys(snapshot):
+    if snapshot is None or snapshot['created_at'] is None:
+        return []
+    status = DELETED if snapshot['deleted'] else (snapshot['status'] or 'pending')
+    return [
+        (granularity, truncate(snapshot['created_at'], granularity),
+         snapshot['district'] or '', snapshot['category'], status)
+        for granularity in GRANULARITIES
+    ]
+
+
+def _bump(connection, key, delta):
+    table = ReportRollup.__table__
+    granularity, bucket, district, category, status = key
+    result = connection.execute(
+        table.update().where(
+            table.c.granularity == granularity,
+            table.c.bucket == bucket,
+            table.c.district == district,
+            table.c.category == category,
+            table.c.status == status
+        ).values(count=table.c.count + delta)
+    )
+    if result.rowcount == 0 and delta > 0:
+        connection.execute(table.insert().values(
+            granularity=granularity, bucket=bucket, district=district,
+            category=category, status=status, count=delta
+        ))
+
+
+@on_report_change
+def update_rollups(connection, old, new):
+    """Переносит репорт между роллапами при создании и смене статуса"""
+    before, after = _keys(old), _keys(new)
+    if before == after:
+        return
+    for key in before:
+        _bump(connection, key, -1)
+    for key in after:
+        _bump(connection, key, 1)
+
+
+def rebuild_rollups():
+    """Заполнение report_rollups с нуля по таблице reports"""
+    totals = defaultdict(int)
+    rows = db.session.query(
+        Report.created_at, Report.district, Report.report_category,
+        Report.trash_type, Report.status, Report.deleted_at
+    ).yield_per(1000)
+    for created_at, district, category, trash_type, status, deleted_at in rows:
+        snapshot = {
+            'created_at': created_at,
+            'district': district,
+            'category': category or trash_type or 'trash',
+            'status': status,
+            'deleted': deleted_at is not None or status == DELETED,
+        }
+        for key in _keys(snapshot):
+            totals[key] += 1
+
+    ReportRollup.query.delete()
+    if totals:
+        db.session.execute(ReportRollup.__table__.insert(), [
+            {'granularity': key[0], 'bucket': key[1], 'district': key[2],
+             'category': key[3], 'status': key[4], 'count': count}
+            for key, count in totals.items()
+        ])
+    db.session.commit()
+    return len(totals)
+
+
+def _range_query(columns, granularity, start=None, end=None):
+    query = db.session.query(*columns).filter(
+        ReportRollup.granularity == granularity,
+        ReportRollup.status != DELETED
+    )
+    if start is not None:
+        query = query.filter(ReportRollup.bucket >= start)
+    if end is not None:
+        query = query.filter(ReportRollup.bucket < end)
+    return query
+
+
+def series(start, end, granularity='day'):
+    """[(начало интервала, число репортов)] с нулями для пустых интервалов"""
+    start = truncate(start, granularity)
+    key = f'rollups:series:{granularity}:{start.isoformat()}:{truncate(end, granularity).isoformat()}'
+    return shared_cache.cached(key, lambda: _series(start, end, granularity), tags=('stats',))
+
+
+def _series(start, end, granularity):
+    rows = _range_query(
+        (ReportRollup.bucket, func.sum(ReportRollup.count)), granularity, start, end
+    ).group_by(ReportRollup.bucket).all()
+    values = {bucket: int(count or 0) for bucket, count in rows}
+
+    step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    result = []
+    moment = start
+    while moment < end:
+        result.append((moment, values.get(moment, 0)))
+        moment += step
+    return result
+
+
+def breakdown(start=None, end=None):
+    """Разбивка по районам и категориям за период (None — за всё время)"""
+    key = f'rollups:breakdown:{start.isoformat() if start else ""}:{end.isoformat() if end else ""}'
+    district_stats, category_stats = shared_cache.cached(key, lambda: _breakdown(start, end), tags=('stats',))
+    return list(district_stats), list(category_stats)
+
+
+def _breakdown(start, end):
+    rows = _range_query(
+        (ReportRollup.district, ReportRollup.category, ReportRollup.status, func.sum(ReportRollup.count)),
+        'day', start, end
+    ).group_by(ReportRollup.district, ReportRollup.category, ReportRollup.status).all()
+
+    districts = defaultdict(lambda: [0, 0])
+    categories = defaultdict(int)
+    for district, category, status, count in rows:
+        count = int(count or 0)
+        districts[district][0] += count
+        if status == 'cleaned':
+            districts[district][1] += count
+        categories[category] += count
+
+    district_stats = [DistrictStat(name or None, total, cleaned) for name, (total, cleaned) in districts.items()]
+    category_stats = [CategoryStat(name, count) for name, count in categories.items()]
+    return district_stats, category_stats
+
+
+def clamp_days(days):
+    """Длина периода в пределах 1..MAX_DAYS"""
+    return min(max(days, 1), MAX_DAYS)
+
+
+def period_granularity(days):
+    return 'hour' if days <= HOURLY_MAX_DAYS else 'day'
+
+
+def days_ago(days):
+    """Начало суток days-1 дней назад: период из days календарных дней, включая сегодня"""
+    return truncate(datetime.utcnow(), 'day') - timedelta(days=days - 1)
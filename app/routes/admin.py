@@ -1,10 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
 from flask_login import login_required, current_user, login_user
 from functools import wraps
 from urllib.parse import urlparse
 from werkzeug.utils import secure_filename
 from app import db
-from app.models import Report, User, Notification
+from app.models import Report, User, Notification, ModerationJob
+from app.pagination import keyset_page, approximate_count
+from app.report_queries import report_list
+from app.counters import status_counts
+from app import rollups, photo_index
 from datetime import datetime
 import os
 import uuid
@@ -42,13 +46,13 @@ def admin_only_required(f):
 
 def get_common_context():
     """Общий контекст для всех страниц админки"""
-    base_query = Report.query.filter(Report.deleted_at.is_(None))
-    # На рассмотрении = pending + confirmed (те, что ждут решения модератора)
-    pending_count = base_query.filter(Report.status.in_(['pending', 'confirmed'])).count()
+    counts = status_counts()
     return {
-        'pending_count': pending_count,
-        'in_progress_count': base_query.filter_by(status='in_progress').count(),
-        'pending_verification_count': base_query.filter_by(status='pending_verification').count(),
+        # На рассмотрении = pending + confirmed (те, что ждут решения модератора)
+        'pending_count': counts.sum('pending', 'confirmed'),
+        'in_progress_count': counts['in_progress'],
+        'pending_verification_count': counts['pending_verification'],
+        'status_counts': counts,
         'notification_count': Notification.query.filter_by(is_read=False).count() if hasattr(Notification, 'is_read') else 0
     }
 
@@ -106,15 +110,16 @@ def dashboard():
     
     # Исключаем удаленные репорты
     base_query = Report.query.filter(Report.deleted_at.is_(None))
+    list_query = report_list(base_query, with_author=True)
     
     # На рассмотрении (pending + confirmed) — ожидают решения модератора
-    pending_reports = base_query.filter(Report.status.in_(['pending', 'confirmed']))\
+    pending_reports = list_query.filter(Report.status.in_(['pending', 'confirmed']))\
         .order_by(Report.created_at.desc())\
         .limit(20)\
         .all()
     
     # Репорты в работе (для модератора)
-    in_progress_reports = base_query.filter_by(status='in_progress')\
+    in_progress_reports = list_query.filter_by(status='in_progress')\
         .order_by(Report.created_at.desc())\
         .limit(20)\
         .all()
@@ -122,20 +127,21 @@ def dashboard():
     # Репорты на финальной проверке (только для админа)
     pending_verification_reports = []
     if current_user.role == 'admin':
-        pending_verification_reports = base_query.filter_by(status='pending_verification')\
+        pending_verification_reports = list_query.filter_by(status='pending_verification')\
             .order_by(Report.cleaned_at.desc())\
             .all()
     
     # Статистика
+    counts = ctx['status_counts']
     stats = {
         'pending': ctx['pending_count'],
         'in_progress': ctx['in_progress_count'],
         'pending_verification': ctx['pending_verification_count'],
-        'total_reports': base_query.count(),
+        'total_reports': counts.total(),
         'total_users': User.query.count(),
-        'confirmed': base_query.filter_by(status='confirmed').count(),
-        'cleaned': base_query.filter_by(status='cleaned').count(),
-        'rejected': base_query.filter_by(status='rejected').count(),
+        'confirmed': counts['confirmed'],
+        'cleaned': counts['cleaned'],
+        'rejected': counts['rejected'],
     }
     
     return render_template('admin/dashboard.html',
@@ -152,7 +158,6 @@ def dashboard():
 def reports():
     """Все репорты"""
     ctx = get_common_context()
-    page = request.args.get('page', 1, type=int)
     status = request.args.get('status')
     
     # Исключаем удаленные репорты (soft delete)
@@ -161,11 +166,19 @@ def reports():
     if status:
         query = query.filter_by(status=status)
     
-    reports = query.order_by(Report.created_at.desc())\
-        .paginate(page=page, per_page=current_app.config['REPORTS_PER_PAGE'], error_out=False)
+    # Keyset-пагинация: курсоры вместо OFFSET, приблизительный total из кеша
+    page = keyset_page(
+        report_list(query, with_author=True, with_description=False),
+        Report, current_app.config['REPORTS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before')
+    )
+    total_estimate = approximate_count(f'admin.reports:{status or ""}', query)
     
     return render_template('admin/reports.html', 
-                         reports=reports,
+                         reports=page.items,
+                         page=page,
+                         total_estimate=total_estimate,
                          **ctx)
 
 
@@ -180,7 +193,10 @@ def quick_moderate():
         Report.status.in_(['pending', 'confirmed'])
     ).order_by(Report.created_at.asc()).first()
     
-    return render_template('admin/quick_moderate.html', report=report, **ctx)
+    # Похожие фото из индекса перцептивных хешей
+    duplicates = photo_index.near_duplicates(report.photo_hash, exclude_id=report.id) if report else []
+    
+    return render_template('admin/quick_moderate.html', report=report, duplicates=duplicates, **ctx)
 
 
 @bp.route('/quick-moderate/<int:report_id>/action', methods=['POST'])
@@ -427,7 +443,7 @@ def approve_cleanup(report_id):
     if report.cleaned_by_id:
         cleaner = User.query.get(report.cleaned_by_id)
         if cleaner:
-            cleaner.add_points(current_app.config.get('POINTS_CLEANED_REPORT', 20))
+            cleaner.add_points(current_app.config.get('POINTS_CLEANED_REPORT', 20), 'cleanup_approved', report_id=report.id)
             
             notification = Notification(
                 user_id=cleaner.id,
@@ -440,7 +456,7 @@ def approve_cleanup(report_id):
     # Бонус автору репорта
     if report.author:
         bonus_points = 10
-        report.author.add_points(bonus_points)
+        report.author.add_points(bonus_points, 'report_cleaned', report_id=report.id)
         
         notification = Notification(
             user_id=report.author.id,
@@ -538,39 +554,33 @@ def rewards():
 @admin_only_required
 def statistics():
     """Статистика (только для админа)"""
-    from sqlalchemy import func, case
-    from datetime import timedelta
     ctx = get_common_context()
     
-    # Исключаем удаленные репорты
-    base_query = Report.query.filter(Report.deleted_at.is_(None))
-    
+    counts = ctx['status_counts']
     stats = {
-        'total_reports': base_query.count(),
-        'cleaned': base_query.filter_by(status='cleaned').count(),
-        'in_progress': base_query.filter_by(status='in_progress').count(),
-        'pending': base_query.filter_by(status='pending').count(),
-        'rejected': base_query.filter_by(status='rejected').count()
+        'total_reports': counts.total(),
+        'confirmed': counts['confirmed'],
+        'cleaned': counts['cleaned'],
+        'in_progress': counts['in_progress'],
+        'pending': counts['pending'],
+        'rejected': counts['rejected']
     }
     
-    # Статистика по дням
+    # Период графика (дней): 30 по умолчанию, можно 90, 365 и т.д.
+    days = rollups.clamp_days(request.args.get('days', 30, type=int))
+    now = datetime.utcnow()
+    
+    # Динамика — одна выборка из роллапов (за 1–2 дня по часам, иначе по дням)
+    granularity = rollups.period_granularity(days)
+    label_format = '%d.%m %H:00' if granularity == 'hour' else '%d.%m'
     daily_stats = {'labels': [], 'values': []}
-    for i in range(29, -1, -1):
-        day_start = datetime.utcnow() - timedelta(days=i+1)
-        day_end = datetime.utcnow() - timedelta(days=i)
-        count = base_query.filter(
-            Report.created_at >= day_start,
-            Report.created_at < day_end
-        ).count()
-        daily_stats['labels'].append(day_start.strftime('%d.%m'))
+    for moment, count in rollups.series(rollups.days_ago(days), now, granularity):
+        daily_stats['labels'].append(moment.strftime(label_format))
         daily_stats['values'].append(count)
     
-    # По районам
-    district_stats_list = base_query.with_entities(
-        Report.district,
-        func.count(Report.id).label('total'),
-        func.sum(case((Report.status == 'cleaned', 1), else_=0)).label('cleaned')
-    ).group_by(Report.district).all()
+    # По районам и категориям (за всё время) — тоже из роллапов
+    district_stats_list, category_stats_list = rollups.breakdown()
+    district_stats_list.sort(key=lambda d: d.total, reverse=True)
     
     district_chart_data = {
         'labels': [d.district or 'Не указан' for d in district_stats_list[:10]],
@@ -578,12 +588,6 @@ def statistics():
         'cleaned': [d.cleaned or 0 for d in district_stats_list[:10]]
     }
     
-    # По категориям
-    category_stats_list = base_query.with_entities(
-        func.coalesce(Report.report_category, Report.trash_type, 'trash').label('category'),
-        func.count(Report.id).label('count')
-    ).group_by('category').all()
-    
     label_map = {
         'trash': '🗑️ Мусор',
         'vandalism': '🎨 Вандализм',
@@ -611,9 +615,27 @@ def statistics():
                          district_stats=district_stats_list,
                          district_chart_data=district_chart_data,
                          trash_type_chart_data=trash_type_chart_data,
+                         days=days,
                          **ctx)
 
 
+@bp.route('/ai-status')
+@login_required
+@admin_only_required
+def ai_status():
+    """Состояние AI-модерации: счетчики клиента OpenAI по всем процессам и очередь задач (JSON)"""
+    from app.ai_moderator_openai import openai_moderator
+    from app.openai_client import cluster_stats
+    from app.image_io import peak_rss_mb
+    
+    queue = dict(db.session.query(ModerationJob.status, db.func.count(ModerationJob.id))
+                 .group_by(ModerationJob.status).all())
+    return jsonify({
+        'openai': cluster_stats(openai_moderator.client),
+        'queue': queue,
+        'peak_rss_mb': peak_rss_mb()
+    })
+
 @bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 @admin_only_required
@@ -621,10 +643,11 @@ def settings():
     """Настройки (только для админа)"""
     ctx = get_common_context()
     
+    counts = ctx['status_counts']
     stats = {
-        'total_reports': Report.query.count(),
+        'total_reports': counts.total(include_deleted=True),
         'total_users': User.query.count(),
-        'pending': Report.query.filter_by(status='pending').count()
+        'pending': counts['pending']
     }
     
     if request.method == 'POST':
@@ -1,68 +1,231 @@
-from flask import Blueprint, jsonify, request
-from app.models import Report, User
-from sqlalchemy import func
+import hashlib
+from flask import Blueprint, jsonify, request, abort, send_file, Response
+from app import db
+from app.models import Report, User, MAP_STATUS_GROUPS
+from app.geo import ALMATY_BBOX, parse_bbox, clip_bbox
+from app.clusters import query_clusters
+from app.tiles import TILE_ZOOMS, get_tile
+from app.pagination import keyset_page, encode_cursor, decode_cursor
+from app import columnar
+from app.report_queries import map_rows
+from app.counters import status_counts, district_counts
+from app.leaderboard import district_leaders
+from app import rollups
+from app.response_cache import cached_response, report_list_tag
+from app.shared_cache import shared_cache
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, or_
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Максимум изменений в одном ответе /reports/changes
+CHANGES_LIMIT = 500
+
+# updated_at ставится при flush, а видна строка после коммита: транзакция,
+# закоммиченная позже соседней, может получить время меньше уже выданного
+# курсора. Такие строки перечитываются в окне за курсором.
+CHANGES_SAFETY_WINDOW = timedelta(minutes=5)
+
+def _serialize_map_report(r):
+    """Строка map_rows() в формате карты"""
+    return {
+        'id': r.id,
+        'latitude': r.latitude,
+        'longitude': r.longitude,
+        'address': r.address,
+        'district': r.district,
+        'description': r.description,
+        'photo_path': r.photo_path,
+        'photo_url': f'/static/{r.photo_path}' if r.photo_path and r.photo_path == 'image.png' else (f'/static/uploads/{r.photo_path}' if r.photo_path else None),
+        'trash_type': r.trash_type,  # Для обратной совместимости
+        'report_category': r.report_category or r.trash_type or 'trash',
+        'status': r.status,
+        'ai_confidence': r.ai_confidence,
+        'is_anonymous': r.is_anonymous,
+        'upvotes': r.upvotes,
+        'created_at': r.created_at.isoformat() if r.created_at else None,
+        'author': r.author_name
+    }
+
+def _reports_version():
+    """
+    Версия данных репортов: время последнего изменения (индекс по updated_at)
+    и версия тега reports, которая растет после каждого коммита репортов —
+    в том числе для транзакций, закоммиченных с более ранним updated_at,
+    и для голосов, не трогающих updated_at.
+    """
+    updated_at = db.session.query(func.max(Report.updated_at)).scalar()
+    sequence = shared_cache.tag_versions(['reports']).get('reports', 0)
+    return f'{updated_at.isoformat() if updated_at else "-"}/{sequence}'
+
+def _reports_etag(variant=''):
+    raw = f'{_reports_version()}|{request.full_path}|{variant}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _not_modified(etag):
+    response = Response(status=304)
+    return _with_etag(response, etag)
+
+def _with_etag(response, etag):
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
 @bp.route('/reports')
+@cached_response(report_list_tag)
 def get_reports():
     """API для получения репортов (для карты)"""
+    # format=columnar — параллельные массивы с кодами вместо объектов
+    columnar_format = request.args.get('format') == 'columnar'
+    use_msgpack = columnar_format and columnar.wants_msgpack(request)
+    
+    # Клиент с актуальными данными получает 304 без выборки репортов
+    etag = _reports_etag('msgpack' if use_msgpack else '')
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    
     status = request.args.get('status', '')
     district = request.args.get('district')
     limit = request.args.get('limit', 500, type=int)
+    zoom = request.args.get('zoom', 12, type=int)
     
-    # Границы Алматы (расширенные для включения всех репортов)
-    ALMATY_LAT_MIN = 42.8
-    ALMATY_LAT_MAX = 43.5
-    ALMATY_LON_MIN = 76.4
-    ALMATY_LON_MAX = 77.3
+    # Окно карты (bbox=min_lon,min_lat,max_lon,max_lat); по умолчанию — весь город
+    bbox = parse_bbox(request.args.get('bbox'))
+    bbox = clip_bbox(bbox) if bbox else ALMATY_BBOX
+    if bbox is None:
+        return jsonify({'reports': []})
     
     # Исключаем удаленные и отклонённые — на карте не показываем
     query = Report.query.filter(
         Report.deleted_at.is_(None),
         Report.status.notin_(['rejected', 'deleted']),
-        Report.latitude >= ALMATY_LAT_MIN,
-        Report.latitude <= ALMATY_LAT_MAX,
-        Report.longitude >= ALMATY_LON_MIN,
-        Report.longitude <= ALMATY_LON_MAX
+        Report.in_bbox(bbox, zoom)
     )
     
     if status:
         # Фильтр по группе статусов для карты
-        if status == 'on_review':
-            query = query.filter(Report.status.in_(['pending', 'confirmed']))
-        elif status == 'in_work':
-            query = query.filter(Report.status.in_(['in_progress', 'pending_verification']))
+        if status in MAP_STATUS_GROUPS:
+            query = query.filter(Report.status.in_(MAP_STATUS_GROUPS[status]))
         else:
             query = query.filter_by(status=status)
     
     if district:
         query = query.filter_by(district=district)
     
-    reports = query.order_by(Report.created_at.desc()).limit(limit).all()
+    if columnar_format:
+        # Только колонки, нужные для первой отрисовки
+        query = query.with_entities(
+            Report.id, Report.created_at, Report.latitude, Report.longitude,
+            Report.status, Report.report_category, Report.trash_type
+        )
+        page = keyset_page(query, Report, limit, after=request.args.get('cursor'))
+        body, mimetype = columnar.encode({
+            'next_cursor': page.next_cursor,
+            'enums': columnar.enums(),
+            'columns': columnar.to_columnar(page.items)
+        }, use_msgpack)
+        response = Response(body, mimetype=mimetype)
+        response.vary.add('Accept')
+        return _with_etag(response, etag)
+    
+    page = keyset_page(map_rows(query), Report, limit, after=request.args.get('cursor'))
+    reports = page.items
+    
+    response = jsonify({
+        'next_cursor': page.next_cursor,
+        'reports': [_serialize_map_report(r) for r in reports]
+    })
+    return _with_etag(response, etag)
+
+@bp.route('/reports/changes')
+def get_report_changes():
+    """
+    Дельта для карты: репорты, измененные после токена since.
+    Удаленные и отклоненные возвращаются как tombstones ({'id', 'deleted': true}).
+    Изменения из окна CHANGES_SAFETY_WINDOW до токена отдаются повторно —
+    клиент применяет их по id, повтор безопасен.
+    """
+    since = decode_cursor(request.args.get('since'))
+    if request.args.get('since') and since is None:
+        return jsonify({'error': 'Некорректный токен since'}), 400
+    
+    etag = _reports_etag()
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    
+    query = Report.query.filter(Report.updated_at.isnot(None))
+    recheck = []
+    if since:
+        updated_at, report_id = since
+        after_cursor = or_(
+            Report.updated_at > updated_at,
+            and_(Report.updated_at == updated_at, Report.id > report_id)
+        )
+        # Окно за курсором не двигает токен и не влияет на has_more
+        recheck = map_rows(query.filter(
+            Report.updated_at >= updated_at - CHANGES_SAFETY_WINDOW,
+            ~after_cursor
+        )).order_by(Report.updated_at.desc(), Report.id.desc()).limit(CHANGES_LIMIT).all()
+        query = query.filter(after_cursor)
+    
+    rows = map_rows(query).order_by(Report.updated_at.asc(), Report.id.asc()).limit(CHANGES_LIMIT + 1).all()
+    has_more = len(rows) > CHANGES_LIMIT
+    rows = rows[:CHANGES_LIMIT]
+    
+    changes = []
+    deleted = []
+    for r in list(reversed(recheck)) + rows:
+        if r.deleted_at or r.status in ('rejected', 'deleted'):
+            deleted.append({'id': r.id, 'deleted': True})
+        else:
+            changes.append(_serialize_map_report(r))
+    
+    token = encode_cursor(rows[-1].updated_at, rows[-1].id) if rows else request.args.get('since')
+    
+    response = jsonify({
+        'since': token,
+        'has_more': has_more,
+        'reports': changes,
+        'deleted': deleted
+    })
+    return _with_etag(response, etag)
+
+@bp.route('/reports/clusters')
+def get_report_clusters():
+    """API кластеров карты: центроиды с количеством репортов по группам статусов"""
+    zoom = request.args.get('zoom', 12, type=int)
+    bbox = parse_bbox(request.args.get('bbox'))
+    bbox = clip_bbox(bbox) if bbox else ALMATY_BBOX
+    if bbox is None:
+        return jsonify({'zoom': zoom, 'clusters': []})
+    
+    zoom, clusters = query_clusters(bbox, zoom)
     
     return jsonify({
-        'reports': [{
-            'id': r.id,
-            'latitude': r.latitude,
-            'longitude': r.longitude,
-            'address': r.address,
-            'district': r.district,
-            'description': r.description,
-            'photo_path': r.photo_path,
-            'photo_url': f'/static/{r.photo_path}' if r.photo_path and r.photo_path == 'image.png' else (f'/static/uploads/{r.photo_path}' if r.photo_path else None),
-            'trash_type': r.trash_type,  # Для обратной совместимости
-            'report_category': r.report_category or r.trash_type or 'trash',
-            'status': r.status,
-            'ai_confidence': r.ai_confidence,
-            'is_anonymous': r.is_anonymous,
-            'upvotes': r.upvotes,
-            'created_at': r.created_at.isoformat() if r.created_at else None,
-            'author': (r.author.username if r.author and not r.is_anonymous and not (r.author.is_anonymous_display if r.author and hasattr(r.author, 'is_anonymous_display') else False) else 'Аноним') if r.author else 'Аноним'
-        } for r in reports]
+        'zoom': zoom,
+        'clusters': [{
+            'cell': c.cell,
+            'latitude': c.lat_sum / c.total,
+            'longitude': c.lon_sum / c.total,
+            'count': c.total,
+            'on_review': c.on_review,
+            'in_work': c.in_work,
+            'cleaned': c.cleaned
+        } for c in clusters]
     })
 
+@bp.route('/tiles/<int:z>/<int:x>/<int:y>')
+def get_tile_geojson(z, x, y):
+    """GeoJSON-тайл с точками репортов (кешируется на диске, nginx и браузером)"""
+    if z not in TILE_ZOOMS or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        abort(404)
+    
+    response = send_file(get_tile(z, x, y), mimetype='application/geo+json', conditional=True, max_age=60)
+    response.cache_control.public = True
+    return response
+
 @bp.route('/leaderboard')
+@cached_response('leaderboard')
 def get_leaderboard():
     """API для получения лидерборда"""
     limit = request.args.get('limit', 10, type=int)
@@ -70,12 +233,7 @@ def get_leaderboard():
     
     if district:
         # Лидерборд по району (исключаем удаленные репорты)
-        users = User.query.join(Report)\
-            .filter(Report.district == district, Report.deleted_at.is_(None))\
-            .group_by(User.id)\
-            .order_by(func.count(Report.id).desc())\
-            .limit(limit)\
-            .all()
+        users = district_leaders(limit=limit, district=district).get(district, [])
     else:
         # Общий лидерборд
         users = User.query.filter(User.total_points > 0)\
@@ -95,43 +253,64 @@ def get_leaderboard():
     })
 
 @bp.route('/stats')
+@cached_response('stats')
 def get_stats():
-    """API для получения общей статистики"""
-    # Исключаем удаленные репорты
-    base_query = Report.query.filter(Report.deleted_at.is_(None))
-    total_reports = base_query.count()
-    confirmed_reports = base_query.filter_by(status='confirmed').count()
-    cleaned_reports = base_query.filter_by(status='cleaned').count()
-    pending_reports = base_query.filter_by(status='pending').count()
-    active_users = User.query.filter(User.reports_count > 0).count()
+    """API для получения общей статистики (days=N — разбивка по районам и динамика за период)"""
+    days = request.args.get('days', type=int)
     
-    # Статистика по районам
-    district_stats = base_query.with_entities(
-        Report.district,
-        func.count(Report.id).label('total'),
-        func.sum(func.case([(Report.status == 'cleaned', 1)], else_=0)).label('cleaned')
-    ).group_by(Report.district).all()
+    # Счетчики по статусам и районам (без удаленных репортов)
+    counts = status_counts()
+    total_reports = counts.total()
+    active_users = User.query.filter(User.reports_count > 0).count()
     
     # Статистика AI
-    ai_auto_confirmed = base_query.filter_by(ai_status='auto_confirmed').count()
-    ai_needs_review = base_query.filter_by(ai_status='needs_review').count()
+    ai_auto_confirmed = Report.query.filter(
+        Report.deleted_at.is_(None),
+        Report.ai_status == 'auto_confirmed'
+    ).count()
+    
+    if days:
+        # Период — из суточных роллапов одним диапазонным запросом
+        days = rollups.clamp_days(days)
+        start = rollups.days_ago(days)
+        now = datetime.utcnow()
+        district_rows, _ = rollups.breakdown(start=start)
+        period = {
+            'days': days,
+            'daily': [{'date': day.date().isoformat(), 'count': count}
+                      for day, count in rollups.series(start, now)]
+        }
+        if rollups.period_granularity(days) == 'hour':
+            # Короткий период — еще и по часам из почасовых роллапов
+            period['hourly'] = [{'hour': hour.isoformat(), 'count': count}
+                                for hour, count in rollups.series(start, now, 'hour')]
+    else:
+        district_rows = [
+            rollups.DistrictStat(name, district.total(), district['cleaned'])
+            for name, district in district_counts().items()
+        ]
+        period = None
+    
+    districts = [{
+        'name': d.district,
+        'total': d.total,
+        'cleaned': d.cleaned,
+        'cleanup_rate': round(d.cleaned / max(d.total, 1) * 100, 1)
+    } for d in district_rows if d.district]
     
     return jsonify({
+        'period': period,
         'total_reports': total_reports,
-        'confirmed_reports': confirmed_reports,
-        'cleaned_reports': cleaned_reports,
-        'pending_reports': pending_reports,
+        'confirmed_reports': counts['confirmed'],
+        'cleaned_reports': counts['cleaned'],
+        'pending_reports': counts['pending'],
         'active_users': active_users,
         'ai_accuracy': round(ai_auto_confirmed / max(total_reports, 1) * 100, 1),
-        'districts': [{
-            'name': d[0],
-            'total': d[1],
-            'cleaned': d[2],
-            'cleanup_rate': round(d[2] / max(d[1], 1) * 100, 1)
-        } for d in district_stats if d[0]]
+        'districts': districts
     })
 
 @bp.route('/report/<int:report_id>')
+@cached_response(lambda report_id: f'report:{report_id}')
 def get_report(report_id):
     """API для получения конкретного репорта"""
     report = Report.query.filter(Report.deleted_at.is_(None)).filter_by(id=report_id).first_or_404()
@@ -143,7 +322,8 @@ def get_report(report_id):
         'address': report.address,
         'district': report.district,
         'description': report.description,
-        'photo_url': f'/static/uploads/{report.photo_path}',
+        'photo_path': report.photo_path,
+        'photo_url': f'/static/{report.photo_path}' if report.photo_path == 'image.png' else f'/static/uploads/{report.photo_path}',
         'cleaned_photo_url': f'/static/img_after.jpeg' if (not report.cleaned_photo_path or report.cleaned_photo_path == 'img_after.jpeg') else (f'/static/{report.cleaned_photo_path}' if report.cleaned_photo_path == 'img_after.jpeg' else f'/static/uploads/{report.cleaned_photo_path}'),
         'trash_type': report.trash_type,  # Для обратной совместимости
         'report_category': report.report_category or report.trash_type or 'trash',
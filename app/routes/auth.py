@@ -113,7 +113,7 @@ def logout():
 def profile():
     """Личный кабинет"""
     # Получаем репорты пользователя
-    user_reports = Report.query.filter_by(user_id=current_user.id)\
+    user_reports = report_list(Report.query.filter_by(user_id=current_user.id))\
         .order_by(Report.created_at.desc())\
         .limit(20)\
         .all()
@@ -121,14 +121,15 @@ def profile():
     # Получаем бейджи
     badges = current_user.badges
     
-    # Получаем место в рейтинге
-    users_above = User.query.filter(User.total_points > current_user.total_points).count()
-    rank = users_above + 1
+    # Место в рейтинге и соседи по нему (без полного COUNT по users)
+    rank = rank_service.rank_of(current_user)
+    neighbours = rank_service.around(current_user)
     
     return render_template('auth/profile.html',
                          reports=user_reports,
                          badges=badges,
-                         rank=rank)
+                         rank=rank,
+                         neighbours=neighbours)
 
 @bp.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
@@ -147,4 +148,6 @@ def edit_profile():
 
 # Import Report model here to avoid circular import
 from app.models import Report
+from app.report_queries import report_list
+from app.ranking import rank_service
 
@@ -3,6 +3,7 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from app import db
 from app.models import Report, Notification
+from app.report_queries import report_list
 from werkzeug.utils import secure_filename
 import os
 import uuid
@@ -31,10 +32,10 @@ def allowed_file(filename):
 def dashboard():
     """Панель управления клинера"""
     # Репорты, требующие уборки (подтвержденные)
-    confirmed_reports = Report.query.filter_by(status='confirmed').order_by(Report.created_at.desc()).all()
+    confirmed_reports = report_list(Report.query.filter_by(status='confirmed')).order_by(Report.created_at.desc()).all()
     
     # Репорты, убранные текущим клинером
-    my_cleaned_reports = Report.query.filter_by(cleaned_by_id=current_user.id).order_by(Report.cleaned_at.desc()).all()
+    my_cleaned_reports = report_list(Report.query.filter_by(cleaned_by_id=current_user.id)).order_by(Report.cleaned_at.desc()).all()
     
     return render_template('cleaner/dashboard.html',
                          confirmed_reports=confirmed_reports,
@@ -2,7 +2,10 @@ from flask import Blueprint, render_template, request, abort, flash, redirect, u
 from flask_login import login_required, current_user
 from app import db
 from app.models import Report, User, Reward, RewardRedemption, Notification
-from sqlalchemy import func, case
+from app.counters import status_counts
+from app.leaderboard import district_leaders as get_district_leaders
+from app.response_cache import cached_response
+from app.counter_buffer import counter_buffer
 from datetime import datetime
 
 bp = Blueprint('main', __name__)
@@ -34,6 +37,7 @@ Crawl-delay: 1
 
 
 @bp.route('/sitemap.xml')
+@cached_response('reports', ttl=3600)
 def sitemap_xml():
     """Sitemap.xml для SEO"""
     base_url = 'https://tazaqala.com'
@@ -80,19 +84,18 @@ def sitemap_xml():
     return response
 
 @bp.route('/')
+@cached_response('stats', anonymous_only=True)
 def index():
     """Главная страница - landing page"""
     # Статистика для главной
-    total_reports = Report.query.count()
-    cleaned_reports = Report.query.filter_by(status='cleaned').count()
+    counts = status_counts()
     active_users = User.query.filter(User.reports_count > 0).count()
-    pending_reports = Report.query.filter_by(status='pending').count()
     
     stats = {
-        'total_reports': total_reports,
-        'cleaned_reports': cleaned_reports,
+        'total_reports': counts.total(),
+        'cleaned_reports': counts['cleaned'],
         'active_users': active_users,
-        'pending_reports': pending_reports
+        'pending_reports': counts['pending']
     }
     
     return render_template('home.html', stats=stats)
@@ -100,12 +103,12 @@ def index():
 @bp.route('/map')
 def map():
     """Страница с картой загрязнений"""
-    base = Report.query.filter(Report.deleted_at.is_(None), Report.status.notin_(['rejected', 'deleted']))
+    counts = status_counts()
     stats = {
-        'total_reports': base.count(),
-        'on_review': Report.query.filter(Report.deleted_at.is_(None), Report.status.in_(['pending', 'confirmed'])).count(),
-        'in_work': Report.query.filter(Report.deleted_at.is_(None), Report.status.in_(['in_progress', 'pending_verification'])).count(),
-        'cleaned': Report.query.filter(Report.deleted_at.is_(None), Report.status == 'cleaned').count(),
+        'total_reports': counts.total() - counts['rejected'],
+        'on_review': counts.group('on_review'),
+        'in_work': counts.group('in_work'),
+        'cleaned': counts.group('cleaned'),
     }
     return render_template('map.html', stats=stats)
 
@@ -115,6 +118,7 @@ def about():
     return render_template('about.html')
 
 @bp.route('/leaderboard')
+@cached_response('leaderboard', anonymous_only=True)
 def leaderboard():
     """Лидерборд"""
     # ТОП-10 пользователей по городу
@@ -123,20 +127,8 @@ def leaderboard():
         .limit(10)\
         .all()
     
-    # ТОП по районам (пример для Алмалинского)
-    districts = ['Алмалинский', 'Ауэзовский', 'Бостандыкский', 'Жетысуский', 
-                 'Медеуский', 'Наурызбайский', 'Турксибский', 'Алатауский']
-    
-    district_leaders = {}
-    for district in districts:
-        # Получаем топ-3 пользователей по району (исправлено: указываем явный join)
-        district_top = User.query.join(Report, User.id == Report.user_id)\
-            .filter(Report.district == district)\
-            .group_by(User.id)\
-            .order_by(func.count(Report.id).desc())\
-            .limit(3)\
-            .all()
-        district_leaders[district] = district_top
+    # ТОП-3 по всем районам одним запросом
+    district_leaders = get_district_leaders(limit=3)
     
     return render_template('leaderboard.html', 
                          top_users=top_users,
@@ -182,8 +174,7 @@ def redeem_reward(reward_id):
         return redirect(url_for('main.rewards'))
 
     try:
-        current_user.points_balance -= reward.cost_points
-        current_user.points_spent += reward.cost_points
+        current_user.spend_points(reward.cost_points, 'reward_redeemed', reward_id=reward.id)
         reward.redeemed_count += 1
 
         redemption = RewardRedemption(
@@ -215,10 +206,9 @@ def view_report(report_id):
     """Просмотр конкретного репорта"""
     report = Report.query.get_or_404(report_id)
     
-    # Увеличиваем счетчик просмотров
-    report.views_count += 1
-    from app import db
-    db.session.commit()
+    # Просмотр копится в буфере и пишется пакетом — без блокировки записи
+    counter_buffer.incr(report.id)
+    views_count = (report.views_count or 0) + counter_buffer.pending(report.id)
     
-    return render_template('report_detail.html', report=report)
+    return render_template('report_detail.html', report=report, views_count=views_count)
 
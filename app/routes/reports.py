@@ -4,7 +4,9 @@ from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from app import db
 from app.models import Report, Notification
-from app.ai_moderator_openai import openai_moderator
+from app import moderation_queue, photo_index, image_io
+from app.report_queries import report_list
+from app.counter_buffer import upvote
 from datetime import datetime
 import uuid
 
@@ -53,10 +55,19 @@ def new_report():
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
         file.save(filepath)
         
-        # AI-модерация через OpenAI Vision API
-        ai_result = openai_moderator.analyze_image(filepath)
+        # Размер — по заголовку файла; слишком большое фото не декодируем вовсе
+        try:
+            image_io.check_size(*image_io.probe(filepath))
+        except image_io.ImageTooLarge:
+            os.remove(filepath)
+            flash('Слишком большое разрешение фото, уменьшите его и попробуйте снова', 'danger')
+            return render_template('reports/new.html')
+        except Exception:
+            os.remove(filepath)
+            flash('Не удалось прочитать фотографию', 'danger')
+            return render_template('reports/new.html')
         
-        # Создаем репорт
+        # Создаем репорт сразу; AI-модерация фото выполняется в фоне
         report = Report(
             user_id=current_user.id if current_user.is_authenticated else None,
             is_anonymous=not current_user.is_authenticated,
@@ -67,45 +78,27 @@ def new_report():
             description=description,
             photo_path=unique_filename,
             report_category=report_category,
-            ai_confidence=ai_result['confidence'],
-            ai_status=ai_result['status'],
-            ai_analysis=ai_result['analysis'],
-            trash_type=ai_result.get('trash_type'),  # Для обратной совместимости
-            status='pending' if ai_result['status'] != 'auto_confirmed' else 'confirmed'
+            status='pending'
         )
         
         db.session.add(report)
+        db.session.flush()  # id репорта нужен индексу фото
         
-        # Начисляем баллы зарегистрированному пользователю
+        # Хеш фото — в индекс почти-дубликатов; дубликаты отсеивает фильтр
+        # очереди модерации (prefilter), репорт все равно проходит модерацию
+        photo_hash = photo_index.hash_file(filepath)
+        if photo_hash:
+            report.photo_hash = photo_hash
+            photo_index.add(report.id, photo_hash)
+        moderation_queue.enqueue(report)
+        
+        # Баллы и уведомление начисляются, когда модерация завершится
         if current_user.is_authenticated:
-            points = current_app.config['POINTS_CONFIRMED_REPORT']
-            
-            # Дополнительные баллы за GPS и комментарий
-            if description:
-                points += current_app.config['POINTS_WITH_GPS_COMMENT']
-            
-            current_user.add_points(points)
             current_user.reports_count += 1
-            
-            if report.status == 'confirmed':
-                current_user.confirmed_reports += 1
-            
-            # Создаем уведомление
-            notification = Notification(
-                user_id=current_user.id,
-                message=f'Ваш репорт получен! Статус: {report.status}. Начислено {points} баллов.',
-                notification_type='report_submitted',
-                related_report_id=report.id
-            )
-            db.session.add(notification)
         
         db.session.commit()
         
-        # Сообщение пользователю
-        if report.status == 'confirmed':
-            flash(f'Спасибо! Ваш репорт подтвержден AI-модерацией (достоверность: {ai_result["confidence"]*100:.0f}%)', 'success')
-        else:
-            flash('Спасибо! Ваш репорт отправлен на проверку модератору', 'info')
+        flash('Спасибо! Ваш репорт отправлен на проверку, баллы будут начислены после модерации', 'info')
         
         return redirect(url_for('main.view_report', report_id=report.id))
     
@@ -116,10 +109,9 @@ def new_report():
 def upvote_report(report_id):
     """Поддержать репорт (лайк)"""
     report = Report.query.get_or_404(report_id)
-    report.upvotes += 1
-    db.session.commit()
+    added, upvotes = upvote(report.id, current_user.id)
     
-    return jsonify({'success': True, 'upvotes': report.upvotes})
+    return jsonify({'success': True, 'upvotes': upvotes, 'already_upvoted': not added})
 
 @bp.route('/<int:report_id>/mark_cleaned', methods=['POST'])
 @login_required
@@ -149,7 +141,7 @@ def mark_cleaned(report_id):
     
     # Начисляем бонусные баллы автору репорта
     if report.author:
-        report.author.add_points(current_app.config['POINTS_CLEANED_REPORT'])
+        report.author.add_points(current_app.config['POINTS_CLEANED_REPORT'], 'report_cleaned', report_id=report.id)
         
         # Уведомление
         notification = Notification(
@@ -161,7 +153,7 @@ def mark_cleaned(report_id):
         db.session.add(notification)
     
     # Баллы волонтеру
-    current_user.add_points(current_app.config['POINTS_CLEANED_REPORT'])
+    current_user.add_points(current_app.config['POINTS_CLEANED_REPORT'], 'cleanup', report_id=report.id)
     
     db.session.commit()
     
@@ -172,7 +164,7 @@ def mark_cleaned(report_id):
 @login_required
 def my_reports():
     """Список репортов текущего пользователя"""
-    reports = Report.query.filter_by(user_id=current_user.id)\
+    reports = report_list(Report.query.filter_by(user_id=current_user.id))\
         .order_by(Report.created_at.desc())\
         .all()
     
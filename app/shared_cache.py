@@ -0,0 +1,233 @@
+"""
+Общий кеш для всех воркеров gunicorn.
+
+Хранилище — отдельная SQLite-база в instance/ (WAL), поэтому значение,
+посчитанное одним воркером, видят остальные, и без внешнего Redis.
+Каждая запись имеет TTL; при превышении max_entries вытесняются записи,
+к которым дольше всех не обращались (LRU). Время обращения обновляется при
+попадании не чаще раза в TOUCH_INTERVAL секунд, чтобы чтения не становились
+записями.
+
+Инвалидация по тегам: у тега есть версия, запись хранит версии своих тегов
+на момент записи. invalidate_tags() увеличивает версии, и записи с устаревшими
+версиями считаются промахом во всех воркерах сразу.
+
+Ошибки хранилища не ломают запрос — кеш просто ведет себя как пустой.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, tags BLOB,'
+    ' last_access REAL NOT NULL DEFAULT 0)',
+    'CREATE INDEX IF NOT EXISTS ix_entries_expires ON entries (expires)',
+    'CREATE TABLE IF NOT EXISTS tag_versions (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)',
+)
+
+# Как часто (в записях) проверять размер и чистить истекшие записи
+PRUNE_EVERY = 100
+# Не чаще чем раз в столько секунд попадание обновляет last_access
+TOUCH_INTERVAL = 10
+
+
+class SharedCache:
+    def __init__(self, max_entries=5000, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.path = None
+        self._local = threading.local()
+        self._writes = 0
+
+    def init_app(self, app):
+        self.path = app.config.get('SHARED_CACHE_PATH') or os.path.join(app.instance_path, 'shared_cache.sqlite3')
+        self.max_entries = app.config.get('SHARED_CACHE_MAX_ENTRIES', self.max_entries)
+        self.default_ttl = app.config.get('SHARED_CACHE_TTL', self.default_ttl)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            connection = self._connection()
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(entries)')}
+            if 'last_access' not in columns:
+                # Файл кеша от версии без LRU
+                connection.execute('ALTER TABLE entries ADD COLUMN last_access REAL NOT NULL DEFAULT 0')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access)')
+        except sqlite3.Error as exc:
+            print(f"⚠️ Общий кеш недоступен ({self.path}): {exc}")
+
+    def _connection(self):
+        # Соединение на поток и процесс: после fork воркер открывает свое
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid() or getattr(local, 'path', None) != self.path:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            local.connection, local.pid, local.path = connection, os.getpid(), self.path
+        return local.connection
+
+    def tag_versions(self, tags):
+        """Текущие версии тегов; снимаются до вычисления значения для set(versions=...)"""
+        if self.path is None or not tags:
+            return {}
+        try:
+            return self._tag_versions(self._connection(), tuple(tags))
+        except sqlite3.Error as exc:
+            print(f"⚠️ Ошибка чтения общего кеша: {exc}")
+            # Версии, которые никогда не совпадут: такая запись сразу устареет
+            return dict.fromkeys(tags, -1)
+
+    def _tag_versions(self, connection, tags):
+        if not tags:
+            return {}
+        placeholders = ','.join('?' * len(tags))
+        rows = connection.execute(
+            f'SELECT tag, version FROM tag_versions WHERE tag IN ({placeholders})', list(tags)
+        ).fetchall()
+        versions = dict.fromkeys(tags, 0)
+        versions.update(rows)
+        return versions
+
+    def get(self, key, default=None):
+        if self.path is None:
+            return default
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                'SELECT value, expires, tags, last_access FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            value, expires, tags, last_access = row
+            now = time.time()
+            if expires < now:
+                return default
+            try:
+                if tags:
+                    stored = pickle.loads(tags)
+                    if self._tag_versions(connection, stored) != stored:
+                        return default
+                value = pickle.loads(value)
+                if now - last_access >= TOUCH_INTERVAL:
+                    connection.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+                return value
+            except sqlite3.Error:
+                raise
+            except Exception as exc:
+                # Запись от прошлой версии кода (класс переименован, модуль удален и т.п.)
+                print(f"⚠️ Устаревшая запись общего кеша {key}: {exc}")
+                self.delete(key)
+                return default
+        except sqlite3.Error as exc:
+            print(f"⚠️ Ошибка чтения общего кеша: {exc}")
+            return default
+
+    def get_prefix(self, prefix):
+        """{ключ: значение} неистекших записей, ключ которых начинается с prefix (теги не проверяются)"""
+        if self.path is None:
+            return {}
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        try:
+            rows = self._connection().execute(
+                "SELECT key, value FROM entries WHERE key LIKE ? ESCAPE '\\' AND expires >= ?",
+                (escaped + '%', time.time())
+            ).fetchall()
+        except sqlite3.Error as exc:
+            print(f"⚠️ Ошибка чтения общего кеша: {exc}")
+            return {}
+        values = {}
+        for key, value in rows:
+            try:
+                values[key] = pickle.loads(value)
+            except Exception as exc:
+                print(f"⚠️ Устаревшая запись общего кеша {key}: {exc}")
+        return values
+
+    def set(self, key, value, ttl=None, tags=(), versions=None):
+        """
+        Сохраняет значение. versions — версии тегов, снятые до вычисления:
+        если теги инвалидировали во время вычисления, запись сразу устареет.
+        """
+        if self.path is None:
+            return
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                stored_tags = None
+                if tags:
+                    if versions is None:
+                        versions = self._tag_versions(connection, tuple(tags))
+                    stored_tags = pickle.dumps(versions)
+                now = time.time()
+                connection.execute(
+                    'INSERT OR REPLACE INTO entries (key, value, expires, tags, last_access) VALUES (?, ?, ?, ?, ?)',
+                    (key, pickle.dumps(value), now + (ttl or self.default_ttl), stored_tags, now)
+                )
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    self._prune(connection)
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        except (sqlite3.Error, pickle.PickleError) as exc:
+            print(f"⚠️ Ошибка записи в общий кеш: {exc}")
+
+    def _prune(self, connection):
+        connection.execute('DELETE FROM entries WHERE expires < ?', (time.time(),))
+        count = connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if count > self.max_entries:
+            connection.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+    def delete(self, key):
+        if self.path is None:
+            return
+        try:
+            self._connection().execute('DELETE FROM entries WHERE key = ?', (key,))
+        except sqlite3.Error as exc:
+            print(f"⚠️ Ошибка удаления из общего кеша: {exc}")
+
+    def invalidate_tags(self, *tags):
+        """Делает устаревшими все записи с любым из тегов (во всех воркерах)"""
+        if self.path is None or not tags:
+            return
+        try:
+            self._connection().executemany(
+                'INSERT INTO tag_versions (tag, version) VALUES (?, 1) '
+                'ON CONFLICT(tag) DO UPDATE SET version = version + 1',
+                [(tag,) for tag in tags]
+            )
+        except sqlite3.Error as exc:
+            print(f"⚠️ Ошибка инвалидации общего кеша: {exc}")
+
+    def cached(self, key, compute, ttl=None, tags=()):
+        """Значение из кеша или compute(), сохраненное для остальных воркеров"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            versions = self.tag_versions(tags)
+            value = compute()
+            self.set(key, value, ttl, tags, versions)
+        return value
+
+    def clear(self):
+        if self.path is None:
+            return
+        try:
+            connection = self._connection()
+            connection.execute('DELETE FROM entries')
+            connection.execute('DELETE FROM tag_versions')
+        except sqlite3.Error as exc:
+            print(f"⚠️ Ошибка очистки общего кеша: {exc}")
+
+
+# Singleton instance
+shared_cache = SharedCache()
@@ -0,0 +1,131 @@
+"""
+GeoJSON-тайлы репортов для карты с кешем на диске.
+
+Тайл z/x/y содержит точки репортов из ячейки сетки с quadkey этого тайла
+(один диапазонный запрос по Report.grid_cell). Готовые тайлы лежат в
+<instance>/tiles/z/x/y.v<версия>.geojson; при изменении репорта удаляются
+только тайлы, в которые он попадает (до и после изменения).
+
+Версия — версия тега tile:z/x/y в общем кеше воркеров. После коммита она
+увеличивается, поэтому тайл, рендер которого начался до коммита, а запись
+закончилась уже после удаления, лежит под старой версией и не отдается.
+"""
+
+import glob
+import json
+import os
+from flask import current_app
+from app.geo import ALMATY_BBOX, covering_tiles, latlon_to_tile, prefix_range, tile_to_quadkey
+from app.models import Report, map_status_group
+from app.report_hooks import on_report_change, collect, after_commit
+from app.shared_cache import shared_cache
+
+TILE_ZOOMS = range(10, 19)
+WARMUP_ZOOMS = range(10, 15)
+
+
+def tiles_root():
+    return os.path.join(current_app.instance_path, 'tiles')
+
+
+def tile_tag(z, x, y):
+    return f'tile:{z}/{x}/{y}'
+
+
+def tile_version(z, x, y):
+    tag = tile_tag(z, x, y)
+    return shared_cache.tag_versions([tag]).get(tag, 0)
+
+
+def tile_path(z, x, y, version):
+    return os.path.join(tiles_root(), str(z), str(x), f'{y}.v{version}.geojson')
+
+
+def render_tile(z, x, y):
+    """Собирает GeoJSON FeatureCollection для тайла"""
+    lo, hi = prefix_range(tile_to_quadkey(x, y, z))
+    rows = Report.query.with_entities(
+        Report.id, Report.latitude, Report.longitude, Report.status,
+        Report.report_category, Report.trash_type
+    ).filter(
+        Report.deleted_at.is_(None),
+        Report.status.notin_(['rejected', 'deleted']),
+        Report.grid_cell >= lo,
+        Report.grid_cell < hi
+    ).all()
+
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'id': r.id,
+            'geometry': {'type': 'Point', 'coordinates': [r.longitude, r.latitude]},
+            'properties': {
+                'id': r.id,
+                'status': r.status,
+                'group': map_status_group(r.status),
+                'report_category': r.report_category or r.trash_type or 'trash'
+            }
+        } for r in rows]
+    }
+
+
+def get_tile(z, x, y):
+    """Путь к файлу тайла текущей версии; рендерит и кладет в кеш, если его нет"""
+    version = tile_version(z, x, y)
+    path = tile_path(z, x, y, version)
+    if not os.path.exists(path):
+        write_tile(z, x, y, version)
+    return path
+
+
+def write_tile(z, x, y, version=None):
+    """
+    Рендерит тайл в файл версии version (снятой до рендера).
+    Если за время рендера тайл инвалидировали, файл старой версии никто
+    не прочитает; его удалит drop_tiles при следующем изменении тайла.
+    """
+    if version is None:
+        version = tile_version(z, x, y)
+    path = tile_path(z, x, y, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(render_tile(z, x, y), fh, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return path
+
+
+def warm_up(zooms=WARMUP_ZOOMS, bbox=ALMATY_BBOX):
+    """Пререндер тайлов города на заданных зумах"""
+    rendered = 0
+    for z in zooms:
+        for x, y in covering_tiles(bbox, z):
+            write_tile(z, x, y)
+            rendered += 1
+    return rendered
+
+
+def tiles_for_point(lat, lon):
+    return {(z, *latlon_to_tile(lat, lon, z)) for z in TILE_ZOOMS}
+
+
+@on_report_change
+def invalidate_report_tiles(connection, old, new):
+    """Помечает тайлы репорта (старые и новые координаты) на удаление после коммита"""
+    for snapshot in (old, new):
+        if snapshot and snapshot['latitude'] is not None and snapshot['longitude'] is not None:
+            collect('tiles', *tiles_for_point(snapshot['latitude'], snapshot['longitude']))
+
+
+@after_commit('tiles')
+def drop_tiles(tiles):
+    # Сначала новая версия: рендер, идущий параллельно, запишет уже устаревший файл
+    shared_cache.invalidate_tags(*(tile_tag(z, x, y) for z, x, y in tiles))
+    for z, x, y in tiles:
+        pattern = os.path.join(tiles_root(), str(z), str(x), f'{y}.v*.geojson')
+        for path in glob.glob(pattern):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -20,6 +20,30 @@ class Config:
     AI_CONFIDENCE_REJECT = 0.50
     AI_REJECT_THRESHOLD = 0.50  # alias for templates/settings
     
+    # AI moderation queue
+    MODERATION_BACKEND = os.environ.get('MODERATION_BACKEND', 'openai')  # openai, local, fake
+    MODERATION_WORKERS = int(os.environ.get('MODERATION_WORKERS', 2))  # потоков в веб-воркере (0 — только CLI)
+    MODERATION_MAX_ATTEMPTS = 5
+    PREFILTER_ENABLED = os.environ.get('PREFILTER_ENABLED', '1') == '1'  # локальный фильтр перед vision API
+    PREFILTER_MIN_EDGE = 200  # px по короткой стороне
+    PREFILTER_MIN_BRIGHTNESS = 15
+    PREFILTER_MAX_BRIGHTNESS = 245
+    PREFILTER_MIN_SHARPNESS = 20  # дисперсия лапласиана миниатюры 256 px
+    DUPLICATE_MAX_DISTANCE = 5  # бит Хэмминга между хешами фото, чтобы считать дубликатом
+    MODERATION_CACHE_DAYS = 30  # сколько хранить результаты по хешу фото
+    MODERATION_CACHE_MAX_ENTRIES = 20000
+    MODERATION_WORK_EDGE = int(os.environ.get('MODERATION_WORK_EDGE', 1024))  # px копии для цветовых признаков локального модератора
+    
+    # Копия фото для vision-модели
+    VISION_MAX_EDGE = int(os.environ.get('VISION_MAX_EDGE', 1024))  # px по длинной стороне
+    VISION_FORMAT = os.environ.get('VISION_FORMAT', 'jpeg').lower()  # jpeg или webp
+    VISION_QUALITY = int(os.environ.get('VISION_QUALITY', 85))
+    
+    # Декодирование фото (app/image_io.py)
+    IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 64_000_000))  # больше — отклоняется без декодирования
+    IMAGE_DECODE_PIXELS = int(os.environ.get('IMAGE_DECODE_PIXELS', 4_000_000))  # предел декодированного буфера
+    IMAGE_MAX_UNSCALED_PIXELS = int(os.environ.get('IMAGE_MAX_UNSCALED_PIXELS', 16_000_000))  # PNG/WebP/GIF: без уменьшения при декодировании
+    
     # Points system
     POINTS_CONFIRMED_REPORT = 10
     POINTS_WITH_GPS_COMMENT = 5
@@ -30,6 +54,15 @@ class Config:
     # Session settings
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
     
+    # Response cache (публичные страницы и API)
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    
+    # Общий кеш воркеров gunicorn (по умолчанию instance/shared_cache.sqlite3)
+    SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH')
+    SHARED_CACHE_MAX_ENTRIES = 5000
+    SHARED_CACHE_TTL = 60
+    
     # Pagination
     REPORTS_PER_PAGE = 20
     LEADERBOARD_TOP = 10
@@ -0,0 +1,49 @@
+import pytest
+from config import Config
+from app import create_app, db as _db
+from app.models import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        SHARED_CACHE_PATH = str(tmp_path / 'shared_cache.sqlite3')
+        RESPONSE_CACHE_ENABLED = False
+        MODERATION_WORKERS = 0
+        MODERATION_BACKEND = 'fake'
+        WTF_CSRF_ENABLED = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        yield app
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return _db
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client, db):
+    """Входит в тестовый клиент пользователем с заданной ролью"""
+    def _login(role='user', is_cleaner=False):
+        user = User(username=f'{role}_session', email=f'{role}_session@example.com',
+                    role=role, is_cleaner=is_cleaner)
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return user
+    return _login
@@ -0,0 +1,56 @@
+"""
+Рабочая копия MODERATION_WORK_EDGE не меняет оценки локального модератора:
+на фиксированном наборе фото больше рабочего края итог тот же, что при
+анализе в полном размере.
+"""
+
+import cv2
+import numpy as np
+import pytest
+from app.ai_moderator import AIModeratorService
+
+SIZES = [(1600, 1200), (2048, 1536), (2448, 3264), (4000, 3000)]
+
+
+def _photo(rng, width, height):
+    """Градиентный фон, цветные прямоугольники, шум и иногда размытие"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, 3)
+    image = np.stack([
+        base[channel] + rng.uniform(-80, 80) * x / width + rng.uniform(-80, 80) * y / height
+        for channel in range(3)
+    ], axis=-1)
+    for _ in range(rng.integers(5, 40)):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1, y1 = x0 + int(rng.integers(20, width // 3)), y0 + int(rng.integers(20, height // 3))
+        cv2.rectangle(image, (x0, y0), (x1, y1), rng.uniform(0, 255, 3).tolist(), -1)
+    image += rng.normal(0, rng.uniform(0, 25), image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    if rng.random() < 0.5:
+        image = cv2.GaussianBlur(image, (0, 0), rng.uniform(0.5, 4))
+    return image
+
+
+def _scores(moderator, image):
+    features = moderator.extract_features(image)
+    quality = moderator._check_image_quality(features)
+    # Случайная добавка MVP-эвристики одинакова для обоих прогонов
+    np.random.seed(0)
+    trash = moderator._detect_trash(features)
+    confidence = round(moderator._calculate_final_confidence(quality, trash), 2)
+    return round(quality, 2), confidence, moderator._classify_trash_type(features)
+
+
+@pytest.mark.parametrize('seed', range(12))
+def test_work_copy_keeps_scores(seed):
+    rng = np.random.default_rng(seed)
+    image = _photo(rng, *SIZES[seed % len(SIZES)])
+
+    full = AIModeratorService()
+    full.work_edge = max(image.shape)
+    reduced = AIModeratorService()
+    reduced.work_edge = 1024
+
+    assert _scores(reduced, image) == _scores(full, image)
+    assert reduced.extract_features(image)['laplacian_var'] == pytest.approx(
+        full.extract_features(image)['laplacian_var'])
@@ -0,0 +1,25 @@
+"""
+Поддержки не меняют updated_at, но должны обновлять список карты.
+"""
+
+from app.models import Report, User
+
+
+def test_upvote_changes_map_etag(app, db, client, login):
+    app.config['RESPONSE_CACHE_ENABLED'] = True
+    author = User.query.filter_by(username='admin').first()
+    report = Report(user_id=author.id, latitude=43.25, longitude=76.9, district='Алмалинский',
+                    photo_path='photo.jpg', status='confirmed')
+    db.session.add(report)
+    db.session.commit()
+
+    first = client.get('/api/reports?district=Алмалинский')
+    etag = first.headers['ETag']
+    assert first.json['reports'][0]['upvotes'] == 0
+
+    login()
+    assert client.post(f'/reports/{report.id}/upvote').json['upvotes'] == 1
+
+    second = client.get('/api/reports?district=Алмалинский', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.json['reports'][0]['upvotes'] == 1
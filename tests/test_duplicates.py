@@ -0,0 +1,70 @@
+"""
+Почти-дубликаты фото: проходят очередь модерации и уходят на ручную проверку;
+однотонные фото дубликатами друг друга не считаются.
+"""
+
+import json
+import os
+import numpy as np
+from PIL import Image
+from app.models import Notification, Report, User
+from app import moderation_queue, photo_index
+
+
+def _photo(app, name, pixels):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+    Image.fromarray(pixels).save(path)
+    return name
+
+
+def _report(db, author, photo_path, app):
+    report = Report(user_id=author.id, latitude=43.25, longitude=76.9, photo_path=photo_path)
+    db.session.add(report)
+    db.session.flush()
+    report.photo_hash = photo_index.hash_file(os.path.join(app.config['UPLOAD_FOLDER'], photo_path))
+    photo_index.add(report.id, report.photo_hash)
+    moderation_queue.enqueue(report)
+    db.session.commit()
+    return report.id
+
+
+def _run_all():
+    while True:
+        claimed = moderation_queue.claim_job('test')
+        if claimed is None:
+            return
+        moderation_queue.run_job(*claimed)
+
+
+def test_duplicate_is_moderated_and_sent_to_review(app, db):
+    textured = np.random.default_rng(7).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    author = User(username='reporter', email='reporter@example.com')
+    db.session.add(author)
+    db.session.flush()
+    original_id = _report(db, author, _photo(app, 'original.png', textured), app)
+    copy_id = _report(db, author, _photo(app, 'copy.png', textured), app)
+
+    _run_all()
+
+    original, copy = db.session.get(Report, original_id), db.session.get(Report, copy_id)
+    assert original.ai_status == 'auto_confirmed'
+    assert copy.ai_status == 'needs_review'
+    gate = json.loads(copy.ai_analysis)['prefilter']
+    assert gate['reason'] == 'duplicate' and gate['duplicate_of'] == [original_id]
+    # Баллы — только за оригинал; о дубликате автор получает уведомление
+    assert db.session.get(User, author.id).total_points == app.config['POINTS_CONFIRMED_REPORT']
+    notices = Notification.query.filter_by(related_report_id=copy_id).all()
+    assert len(notices) == 1 and 'не начисляются' in notices[0].message
+
+
+def test_uniform_photos_are_not_duplicates(app, db):
+    dark = np.full((240, 320, 3), 3, dtype=np.uint8)
+    author = User(username='reporter', email='reporter@example.com')
+    db.session.add(author)
+    db.session.flush()
+    first_id = _report(db, author, _photo(app, 'dark1.png', dark), app)
+    _report(db, author, _photo(app, 'dark2.png', dark), app)
+
+    photo_hash = db.session.get(Report, first_id).photo_hash
+    assert not photo_index.informative(photo_hash)
+    assert photo_index.near_duplicates(photo_hash) == []
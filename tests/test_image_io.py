@@ -0,0 +1,35 @@
+"""
+Лимиты декодирования из настроек приложения: PNG/WebP/GIF, которые не
+уменьшаются при декодировании, ограничены IMAGE_MAX_UNSCALED_PIXELS.
+"""
+
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from app import image_io
+
+
+def _save(app, name, size=(1200, 900)):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+    Image.fromarray(np.zeros((size[1], size[0], 3), dtype=np.uint8)).save(path)
+    return path
+
+
+@pytest.fixture
+def small_limits(app):
+    app.config.update(IMAGE_MAX_PIXELS=2_000_000, IMAGE_DECODE_PIXELS=300_000, IMAGE_MAX_UNSCALED_PIXELS=600_000)
+
+
+def test_unscaled_formats_have_smaller_limit(app, small_limits):
+    with pytest.raises(image_io.ImageTooLarge):
+        image_io.decode_bgr(_save(app, 'big.png'))
+    with pytest.raises(image_io.ImageTooLarge):
+        image_io.open_pil(_save(app, 'big.webp'))
+
+
+def test_jpeg_is_reduced_while_decoding(app, small_limits):
+    image, decode = image_io.decode_bgr(_save(app, 'big.jpg'))
+    assert decode['jpeg_scale'] == 2
+    assert image.shape[0] * image.shape[1] <= 300_000
+    assert decode['buffer_mb'] == round(image.nbytes / 2 ** 20, 1)
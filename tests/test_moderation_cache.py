@@ -0,0 +1,31 @@
+"""
+Кеш модерации пишет свои строки отдельно от сессии вызывающего кода.
+"""
+
+import os
+from PIL import Image
+from app.ai_moderator_fake import fake_moderator
+from app.models import ModerationCacheEntry, User
+from app import moderation_cache
+
+
+def test_cache_writes_leave_caller_session_alone(app, db):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'photo.jpg')
+    Image.new('RGB', (320, 240), (90, 120, 60)).save(path)
+    fake_moderator.configure()
+
+    user = User(username='pending', email='pending@example.com')
+    db.session.add(user)
+
+    first = moderation_cache.analyze(fake_moderator, path)
+    second = moderation_cache.analyze(fake_moderator, path)
+
+    # Незакоммиченное изменение вызывающего кода все еще в сессии и не записано
+    assert user in db.session.new
+    db.session.rollback()
+    assert User.query.filter_by(username='pending').first() is None
+
+    assert first['confidence'] == second['confidence']
+    assert '"hit": true' in second['analysis']
+    entry = ModerationCacheEntry.query.one()
+    assert entry.hits == 1
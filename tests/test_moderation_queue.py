@@ -0,0 +1,44 @@
+"""
+Очередь модерации: результат применяется один раз, даже если задачу
+вернули в очередь как зависшую, пока первый прогон еще шел.
+"""
+
+import os
+from datetime import datetime, timedelta
+from PIL import Image
+from app.models import ModerationJob, Notification, Report, User
+from app import moderation_queue
+
+
+def _queued_report(app, db):
+    Image.new('RGB', (320, 240), (90, 120, 60)).save(os.path.join(app.config['UPLOAD_FOLDER'], 'photo.jpg'))
+    author = User(username='reporter', email='reporter@example.com')
+    db.session.add(author)
+    db.session.flush()
+    report = Report(user_id=author.id, latitude=43.25, longitude=76.9, photo_path='photo.jpg')
+    db.session.add(report)
+    moderation_queue.enqueue(report)
+    db.session.commit()
+    return author.id, report.id
+
+
+def test_result_applied_once_after_stale_release(app, db):
+    author_id, report_id = _queued_report(app, db)
+
+    first = moderation_queue.claim_job('worker-a')
+    # Первый прогон «завис»: задачу возвращают в очередь и берет другой воркер
+    ModerationJob.query.filter_by(id=first[0]).update(
+        {'locked_at': datetime.utcnow() - moderation_queue.STALE_AFTER - timedelta(seconds=1)})
+    db.session.commit()
+    assert moderation_queue.release_stale() == 1
+    second = moderation_queue.claim_job('worker-b')
+    assert second[0] == first[0]
+
+    moderation_queue.run_job(*second)
+    moderation_queue.run_job(*first)
+
+    author = db.session.get(User, author_id)
+    assert author.total_points == app.config['POINTS_CONFIRMED_REPORT']
+    assert Notification.query.filter_by(user_id=author_id).count() == 1
+    assert db.session.get(Report, report_id).ai_status == 'auto_confirmed'
+    assert db.session.get(ModerationJob, first[0]).status == ModerationJob.DONE
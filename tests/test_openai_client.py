@@ -0,0 +1,194 @@
+"""
+ResilientOpenAIClient против локального stub-сервера OpenAI API:
+таймауты, повторы временных ошибок и автомат (circuit breaker).
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from PIL import Image
+from app.ai_moderator_openai import OpenAIModeratorService
+from app.openai_client import CircuitOpenError, DeadlineExceeded, ResilientOpenAIClient
+
+pytest.importorskip('openai')
+
+COMPLETION = {
+    'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+        'role': 'assistant',
+        'content': json.dumps({'trash_detected': True, 'trash_type': 'пластик', 'confidence': 0.9}),
+    }}],
+}
+
+
+class StubServer:
+    """Отвечает по очереди сценариями: ('ok',), ('status', код), ('sleep', секунд)"""
+
+    def __init__(self):
+        self.script = []
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests += 1
+                action = stub.script.pop(0) if stub.script else ('ok',)
+                if action[0] == 'sleep':
+                    time.sleep(action[1])
+                    action = ('ok',)
+                if action[0] == 'status':
+                    self._reply(action[1], {'error': {'message': 'stub error', 'type': 'server_error'}})
+                else:
+                    self._reply(200, COMPLETION)
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент уже ушел по таймауту
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/v1'
+        threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def _client(stub, **options):
+    settings = dict(api_key='test', base_url=stub.url, timeout=2.0, deadline=5.0,
+                    max_retries=3, backoff_base=0.01, backoff_max=0.05)
+    settings.update(options)
+    return ResilientOpenAIClient(**settings)
+
+
+def _call(client):
+    return client.chat_completion(model='stub', messages=[{'role': 'user', 'content': 'hi'}], max_tokens=5)
+
+
+def test_retries_transient_errors(stub):
+    stub.script = [('status', 503), ('status', 500)]
+    client = _client(stub)
+
+    response = _call(client)
+
+    assert response.choices[0].message.content
+    assert stub.requests == 3
+    assert client.stats()['retries'] == 2
+    assert client.breaker.state == client.breaker.CLOSED
+
+
+def test_client_error_is_not_retried(stub):
+    stub.script = [('status', 400)]
+    client = _client(stub)
+
+    with pytest.raises(Exception) as error:
+        _call(client)
+
+    assert not client.is_transient(error.value)
+    assert stub.requests == 1
+
+
+def test_attempt_timeout_bounded_by_deadline(stub):
+    stub.script = [('sleep', 1.0)] * 5
+    client = _client(stub, timeout=0.2, deadline=0.5)
+
+    started = time.monotonic()
+    with pytest.raises(Exception) as error:
+        _call(client)
+
+    assert client.is_transient(error.value)
+    assert time.monotonic() - started < 1.0
+    assert client.stats()['timeouts'] >= 1
+
+
+def test_breaker_opens_and_recovers(stub):
+    stub.script = [('status', 500)] * 2
+    client = _client(stub, max_retries=0, failure_threshold=2, reset_timeout=0.2)
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            _call(client)
+    with pytest.raises(CircuitOpenError):
+        _call(client)
+    assert stub.requests == 2
+
+    # После reset_timeout одна пробная попытка закрывает автомат
+    time.sleep(0.25)
+    _call(client)
+    assert client.breaker.state == client.breaker.CLOSED
+
+
+def test_moderator_leaves_transient_errors_to_the_queue(app, stub):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'photo.jpg')
+    Image.new('RGB', (320, 240), (90, 120, 60)).save(path)
+    moderator = OpenAIModeratorService()
+    moderator.client = _client(stub, max_retries=1, failure_threshold=10)
+
+    stub.script = [('status', 502)] * 2
+    with pytest.raises(Exception) as error:
+        moderator.analyze_image(path)
+    assert moderator.client.is_transient(error.value)
+
+    assert moderator.analyze_image(path)['status'] == 'auto_confirmed'
+
+    stub.script = [('status', 422)]
+    assert moderator.analyze_image(path)['confidence'] is None
+
+
+def test_moderator_sends_open_circuit_to_review(app, stub):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'photo.jpg')
+    Image.new('RGB', (320, 240), (90, 120, 60)).save(path)
+    moderator = OpenAIModeratorService()
+    moderator.client = _client(stub, max_retries=0, failure_threshold=1, reset_timeout=60)
+
+    stub.script = [('status', 500)]
+    with pytest.raises(Exception):
+        moderator.analyze_image(path)
+    result = moderator.analyze_image(path)
+
+    assert result['status'] == 'needs_review'
+    assert json.loads(result['analysis'])['reason'] == 'circuit_open'
+    assert stub.requests == 1
+
+
+def test_deadline_exceeded_is_transient():
+    assert ResilientOpenAIClient(api_key='test').is_transient(DeadlineExceeded('late'))
+
+
+def test_cluster_stats_sum_all_processes(app, stub, monkeypatch):
+    from app import openai_client
+    first, second = _client(stub), _client(stub)
+
+    # Два процесса: у каждого свой ключ в общем кеше
+    monkeypatch.setattr(openai_client.os, 'getpid', lambda: 1001)
+    _call(first)
+    monkeypatch.setattr(openai_client.os, 'getpid', lambda: 1002)
+    stub.script = [('status', 503)]
+    _call(second)
+    stats = openai_client.cluster_stats(second)
+
+    assert stats['processes'] == 2
+    assert stats['calls'] == 2 and stats['successes'] == 2 and stats['retries'] == 1
+    assert sorted(stats['circuit_state'].values()) == ['closed', 'closed']
+    assert stats['latency_ms']['max'] is not None
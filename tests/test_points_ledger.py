@@ -0,0 +1,27 @@
+"""
+Пересчет балансов по журналу совпадает с тем, что насчитали add_points/spend_points.
+"""
+
+from app.models import User
+from app.points_ledger import recompute_balances
+
+
+def test_recompute_replays_clamped_penalties(db):
+    user = User(username='reporter', email='reporter@example.com')
+    db.session.add(user)
+    db.session.flush()
+
+    user.add_points(5, 'report_submitted')
+    user.add_points(-10, 'fake_penalty')  # баланс не уходит ниже нуля
+    user.add_points(60, 'report_cleaned')
+    user.spend_points(20, 'reward_redeemed')
+    db.session.commit()
+    expected = (user.total_points, user.points_balance, user.points_spent, user.level)
+    assert expected == (60, 40, 20, 'Активист')
+
+    user.total_points = user.points_balance = user.points_spent = 0
+    db.session.commit()
+
+    recompute_balances()
+    user = db.session.get(User, user.id)
+    assert (user.total_points, user.points_balance, user.points_spent, user.level) == expected
@@ -0,0 +1,75 @@
+"""
+Перемодерация архива: временная ошибка одного фото не обрывает прогон,
+а результат без оценки AI не затирает прежние ai_*.
+"""
+
+import json
+import os
+from app import remoderation
+from app.models import Report
+from app.openai_client import DeadlineExceeded
+
+
+class FlakyModerator:
+    """Первый анализ фото из fail_once падает с DeadlineExceeded"""
+
+    def __init__(self, fail_once=(), unavailable=False):
+        self.fail_once = set(fail_once)
+        self.unavailable = unavailable
+
+    def analyze_image(self, image_path):
+        name = os.path.basename(image_path)
+        if name in self.fail_once:
+            self.fail_once.discard(name)
+            raise DeadlineExceeded('deadline')
+        if self.unavailable:
+            return {'confidence': None, 'status': 'needs_review', 'trash_detected': False,
+                    'trash_type': 'unknown',
+                    'analysis': json.dumps({'method': 'unavailable', 'reason': 'circuit_open'})}
+        return {'confidence': 0.7, 'status': 'needs_review', 'analysis': '{}',
+                'trash_detected': True, 'trash_type': 'mixed'}
+
+
+def _reports(app, db, count=3):
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    ids = []
+    for index in range(count):
+        name = f'photo{index}.jpg'
+        open(os.path.join(app.config['UPLOAD_FOLDER'], name), 'wb').close()
+        report = Report(latitude=43.25, longitude=76.9, photo_path=name,
+                        ai_status='auto_confirmed', ai_confidence=0.9)
+        db.session.add(report)
+        db.session.flush()
+        ids.append(report.id)
+    db.session.commit()
+    return ids
+
+
+def _states(db, ids):
+    return [(db.session.get(Report, id).ai_status, db.session.get(Report, id).ai_confidence) for id in ids]
+
+
+def test_transient_error_is_retried_without_aborting(app, db, monkeypatch, tmp_path):
+    # instance/ еще не существует
+    app.instance_path = str(tmp_path / 'instance')
+    ids = _reports(app, db)
+    monkeypatch.setattr(remoderation, 'get_moderator', lambda backend: FlakyModerator({'photo1.jpg'}))
+
+    result = remoderation.remoderate('openai', batch_size=2, workers=2, log=lambda message: None)
+
+    assert result['processed'] == 3 and result['retry'] == []
+    assert _states(db, ids) == [('needs_review', 0.7)] * 3
+    assert not os.path.exists(remoderation.checkpoint_path())
+
+
+def test_unavailable_result_keeps_previous_scores(app, db, monkeypatch, tmp_path):
+    app.instance_path = str(tmp_path / 'instance')
+    ids = _reports(app, db)
+    monkeypatch.setattr(remoderation, 'get_moderator', lambda backend: FlakyModerator(unavailable=True))
+
+    result = remoderation.remoderate('openai', workers=2, log=lambda message: None)
+
+    assert _states(db, ids) == [('auto_confirmed', 0.9)] * 3
+    assert result['processed'] == 0 and sorted(result['retry']) == ids
+    # Следующий запуск повторит эти фото
+    assert remoderation.load_checkpoint('openai')['retry'] == result['retry']
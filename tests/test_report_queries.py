@@ -0,0 +1,75 @@
+"""
+Число SQL-запросов списков репортов не зависит от числа строк (нет N+1).
+"""
+
+from datetime import datetime
+import pytest
+from sqlalchemy import event
+from app.models import Report, User
+from app.shared_cache import shared_cache
+
+
+def _add_reports(db, count, status='confirmed', **fields):
+    # У каждого репорта свой автор: ленивая загрузка r.author дала бы запрос на строку
+    for _ in range(count):
+        index = User.query.count()
+        author = User(username=f'author{index}', email=f'author{index}@example.com')
+        db.session.add(author)
+        db.session.flush()
+        db.session.add(Report(
+            user_id=fields.get('user_id', author.id), latitude=43.25, longitude=76.9,
+            district='Алмалинский', description='Мусор у дороги', photo_path='photo.jpg',
+            status=status, cleaned_by_id=fields.get('cleaned_by_id'),
+            cleaned_at=datetime.utcnow() if status == 'cleaned' else None
+        ))
+    db.session.commit()
+
+
+def _count_queries(db, client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Оба замера — с холодным кешем (приблизительный total админки и т.п.)
+    shared_cache.clear()
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def _assert_constant(db, client, url, add_rows):
+    add_rows(2)
+    few = _count_queries(db, client, url)
+    add_rows(10)
+    many = _count_queries(db, client, url)
+    assert many == few
+
+
+def test_map_list_query_count(db, client):
+    _assert_constant(db, client, '/api/reports', lambda n: _add_reports(db, n))
+
+
+def test_my_reports_query_count(db, client, login):
+    user = login()
+    _assert_constant(db, client, '/reports/my', lambda n: _add_reports(db, n, user_id=user.id))
+
+
+def test_cleaner_dashboard_query_count(db, client, login):
+    cleaner = login(is_cleaner=True)
+
+    def add_rows(count):
+        _add_reports(db, count, status='confirmed')
+        _add_reports(db, count, status='cleaned', cleaned_by_id=cleaner.id)
+
+    _assert_constant(db, client, '/cleaner/', add_rows)
+
+
+@pytest.mark.parametrize('status', ['', 'confirmed'])
+def test_admin_reports_query_count(db, client, login, status):
+    login(role='admin')
+    _assert_constant(db, client, f'/admin/reports?status={status}', lambda n: _add_reports(db, n))
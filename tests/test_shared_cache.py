@@ -0,0 +1,29 @@
+"""
+Вытеснение в общем кеше: при превышении max_entries уходят записи,
+к которым дольше всех не обращались.
+"""
+
+from app import shared_cache as shared_cache_module
+from app.shared_cache import SharedCache
+
+
+def test_evicts_least_recently_used(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache_module, 'PRUNE_EVERY', 1)
+    monkeypatch.setattr(shared_cache_module, 'TOUCH_INTERVAL', 0)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(shared_cache_module.time, 'time', lambda: float(next(clock)))
+    app.config['SHARED_CACHE_PATH'] = str(tmp_path / 'lru.sqlite3')
+    cache = SharedCache()
+    cache.init_app(app)
+    cache.max_entries = 3
+
+    cache.set('hot', 1, ttl=600)
+    cache.set('a', 2, ttl=600)
+    cache.set('b', 3, ttl=600)
+    # Горячая запись прочитана последней, хотя записана первой и истекает раньше
+    assert cache.get('hot') == 1
+    cache.set('c', 4, ttl=6000)
+
+    assert cache.get('hot') == 1
+    assert cache.get('a') is None
+    assert cache.get('b') == 3 and cache.get('c') == 4